@@ -8,14 +8,16 @@
 import time
 import lgpio as GPIO
 from examples.lgpio_moisture import Moisture
+from grow.filters import Hampel
 import statistics
 import yaml
 import os
 import logging
 
 def get_stable_reading(sensor, samples=10, delay=1):
-    """Get a stable reading by averaging multiple samples."""
+    """Get a stable reading by averaging multiple samples, with outliers replaced by a Hampel filter."""
     readings = []
+    outliers = Hampel(window=5, threshold=3.0)
     print("Taking readings", end="")
     
     # Initial delay to let sensor stabilize
@@ -26,7 +28,7 @@ def get_stable_reading(sensor, samples=10, delay=1):
             reading = sensor.moisture
             print(f"\nReading {i+1}: {reading:.2f} Hz")  # More detailed output
             if reading > 0:
-                readings.append(reading)
+                readings.append(outliers.update(reading))
         else:
             print("\nSensor not active!")
             break
@@ -40,11 +42,6 @@ def get_stable_reading(sensor, samples=10, delay=1):
         print(f"Last raw reading: {sensor.moisture}")
         return 0
     
-    # Remove outliers (optional)
-    if len(readings) >= 4:
-        readings.sort()
-        readings = readings[1:-1]  # Remove highest and lowest
-    
     avg = statistics.mean(readings)
     std = statistics.stdev(readings) if len(readings) > 1 else 0
     
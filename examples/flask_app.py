@@ -1,8 +1,29 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS  # If needed for cross-origin requests
-import json
 import lgpio as GPIO
 import logging
+import math
+import time
+
+from datetime import datetime
+
+from grow.archive import ArchiveIndex
+from grow.dosing import get_dose_queue
+from grow.downsample import METHODS, finite
+from grow.history import RingView, SensorView
+from grow.journal import JournalView
+from grow.rollup import DEFAULT_TIERS, choose_tier, tier_path
+
+SENSOR_LOG_FILE = 'sensor_data.bin'
+ROLLUP_DIR = 'sensor_rollups'
+HISTORY_DIR = 'sensor_history'  # Root of the sensor_history/YYYY/MM/ daily archives
+DOSE_JOURNAL_DIR = 'dose_journal'  # Journal of every pump dose, plus daily totals per channel
+SENSOR_DATA_WINDOW = 60 * 60  # Seconds of history /sensor_data returns when no range is given
+HISTORY_POINTS = 500  # Default points per channel returned by /history
+HISTORY_MAX_POINTS = 2000
+HISTORY_OVERSAMPLE = 4  # Rollup buckets read per returned point, bounds the work per request
+WEB_MAX_DURATION = 10.0  # Longest dose, in seconds, /activate_pump accepts
+WEB_MAX_QUEUED = 3  # Web doses a channel may have waiting to start
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS if needed
@@ -10,6 +31,12 @@ CORS(app)  # Enable CORS if needed
 # Global variable to store channel references
 channels = None
 gpio_handle = None  # Add this
+history_view = None  # Read-only mapping of the sensor log, shared by all requests
+rollup_views = {}  # Read-only mappings of the rollup tiers, by resolution
+storage_writer = None
+history_index = None  # Day index over the daily archives
+sensor_store = None  # SQLite store when that engine is in use, otherwise history comes from the mapped log
+journal_view = None  # Read-only mapping of the dose journal
 
 def init_channels(channel_list, handle):  # Modify to accept GPIO handle
     """Initialize channels and GPIO handle for the Flask app to access"""
@@ -17,15 +44,300 @@ def init_channels(channel_list, handle):  # Modify to accept GPIO handle
     channels = channel_list
     gpio_handle = handle  # Store the handle
 
+def init_storage(writer, store=None):
+    """Give the Flask app access to the storage writer's counters and, optionally, a SQLite store"""
+    global storage_writer, sensor_store
+    storage_writer = writer
+    sensor_store = store
+
 @app.route('/')
 def home():
     return "Flask server is running!"
 
+def fresh_view(view, open_view):
+    """Return a mapped view, opening it with open_view() if there is none or its file has been replaced
+
+    eg: by migrate-history.py --force or a capacity change. Requests still
+    reading the old mapping keep it alive until they finish.
+    """
+    if view is None or view.stale():
+        view = open_view()
+    return view
+
+def get_history_view():
+    """Map the sensor log on first use and keep the mapping for later requests"""
+    global history_view
+    history_view = fresh_view(history_view, lambda: SensorView(SENSOR_LOG_FILE))
+    return history_view
+
+def get_rollup_view(resolution):
+    """Map a rollup tier on first use and keep the mapping for later requests"""
+    rollup_views[resolution] = fresh_view(rollup_views.get(resolution),
+                                          lambda: RingView(tier_path(ROLLUP_DIR, resolution)))
+    return rollup_views[resolution]
+
+def get_journal_view():
+    """Map the dose journal on first use and keep the mapping for later requests"""
+    global journal_view
+    journal_view = fresh_view(journal_view, lambda: JournalView(DOSE_JOURNAL_DIR))
+    return journal_view
+
+def get_history_index():
+    """Load the archive day index on first use, it reloads itself when the monitor updates it"""
+    global history_index
+    if history_index is None:
+        history_index = ArchiveIndex(HISTORY_DIR)
+    return history_index
+
+def view_columns(view, fields, start, stop):
+    """Copy the requested columns out of a mapped view into JSON friendly lists"""
+    columns = {}
+    for name in fields:
+        # NaN marks a missing reading, which JSON has no literal for
+        columns[name] = [None if math.isnan(value) else value
+                         for segment in view.column(name, start, stop) for value in segment.tolist()]
+    return columns
+
+def parse_time(value):
+    """Parse a query string time given as epoch seconds or ISO format"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
 @app.route('/sensor_data')
 def get_sensor_data():
+    """Latest reading plus history, limited with ?from=&to=
+
+    Without from, only the SENSOR_DATA_WINDOW seconds before to (or now) are
+    returned, rather than decoding the whole log on every request.
+    """
+    try:
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        if start_time is None:
+            start_time = (time.time() if stop_time is None else stop_time) - SENSOR_DATA_WINDOW
+        if sensor_store:
+            # Indexed range scans on (channel, ts)
+            data = sensor_store.latest_reading() or {'timestamp': None, 'sensors': {}, 'light': {}}
+            data['history'] = list(sensor_store.readings(start_time, stop_time))
+            return jsonify(data)
+
+        view = get_history_view()
+        start, stop = view.between(start_time, stop_time)
+        data = view.latest_reading() or {'timestamp': None, 'sensors': {}, 'light': {}}
+        data['history'] = list(view.readings(start, stop))
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sensor_data/columns')
+def get_sensor_columns():
+    """Raw history columns sliced straight out of the mapped log
+
+    Query parameters: from, to (epoch seconds or ISO) and fields (comma separated,
+    eg: timestamp,channel1_moisture). Returns one list of values per field.
+    """
+    try:
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        source = sensor_store or get_history_view()
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else source.fields
+        unknown = [name for name in fields if name not in source.fields]
+        if unknown:
+            return jsonify({'error': f'Unknown fields {unknown}'}), 400
+
+        if sensor_store:
+            records = sensor_store.records(start_time, stop_time)
+            columns = dict(zip(sensor_store.fields, zip(*records))) if records else {}
+            columns = dict((name, [None if math.isnan(value) else value for value in columns.get(name, ())])
+                           for name in fields)
+            return jsonify({'columns': columns})
+
+        view = source
+        start, stop = view.between(start_time, stop_time)
+        return jsonify({'start': start, 'stop': stop, 'columns': view_columns(view, fields, start, stop)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sensor_data/channel/<int:channel>')
+def get_channel_history(channel):
+    """Moisture history for one channel, optionally limited with ?from=&to=
+
+    Served from an indexed range scan when using the SQLite engine, otherwise
+    sliced from the mapped log.
+    """
+    try:
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        if sensor_store:
+            if channel < 1 or channel > sensor_store.channels:
+                return "Invalid channel", 400
+            rows = sensor_store.channel_range(channel, start_time, stop_time)
+            return jsonify({
+                'timestamp': [row[0] for row in rows],
+                'moisture': [row[1] for row in rows],
+                'alarm': [bool(row[2]) for row in rows]
+            })
+
+        view = get_history_view()
+        if channel < 1 or channel > view.channels:
+            return "Invalid channel", 400
+        start, stop = view.between(start_time, stop_time)
+        columns = view_columns(view, ['timestamp', f'channel{channel}_moisture', f'channel{channel}_alarm'], start, stop)
+        return jsonify({
+            'timestamp': columns['timestamp'],
+            'moisture': columns[f'channel{channel}_moisture'],
+            'alarm': [bool(value) for value in columns[f'channel{channel}_alarm']]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sensor_data/rollup')
+def get_sensor_rollup():
+    """Min/max/mean/count history read from a rollup tier
+
+    Query parameters: from, to (epoch seconds or ISO), fields (comma separated,
+    eg: channel1_moisture_mean) and either resolution (1, 60 or 3600 seconds) or
+    points, in which case the finest tier covering the range in that many
+    buckets is used. Long ranges are therefore read from the coarse tiers.
+    """
+    try:
+        resolutions = [resolution for resolution, _ in DEFAULT_TIERS]
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        resolution = request.args.get('resolution', type=int)
+
+        if resolution is None:
+            points = request.args.get('points', 1000, type=int)
+            now = datetime.now().timestamp()
+            resolution = choose_tier(resolutions,
+                                     start_time if start_time is not None else now - 24 * 60 * 60,
+                                     stop_time if stop_time is not None else now,
+                                     points)
+        elif resolution not in resolutions:
+            return jsonify({'error': f'Resolution must be one of {resolutions}'}), 400
+
+        view = get_rollup_view(resolution)
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else view.fields
+        unknown = [name for name in fields if name not in view.fields]
+        if unknown:
+            return jsonify({'error': f'Unknown fields {unknown}'}), 400
+
+        start, stop = view.between(start_time, stop_time)
+        return jsonify({'resolution': resolution, 'columns': view_columns(view, fields, start, stop)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/history')
+def get_history():
+    """Downsampled moisture history per channel, in the shape charts.js draws
+
+    Query parameters: from, to (epoch seconds or ISO, default the last 24 hours),
+    channels (comma separated, default all), points (per channel, default 500)
+    and method (lttb or minmax). The finest rollup tier that covers the range in
+    a few buckets per point is read and then downsampled, so the payload and the
+    work done stay the same however long the range or the history is.
+    """
+    try:
+        resolutions = [resolution for resolution, _ in DEFAULT_TIERS]
+        now = datetime.now().timestamp()
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        start_time = start_time if start_time is not None else now - 24 * 60 * 60
+        stop_time = stop_time if stop_time is not None else now
+
+        points = min(max(request.args.get('points', HISTORY_POINTS, type=int), 3), HISTORY_MAX_POINTS)
+        method = request.args.get('method', 'lttb')
+        if method not in METHODS:
+            return jsonify({'error': f'Method must be one of {sorted(METHODS)}'}), 400
+
+        resolution = choose_tier(resolutions, start_time, stop_time, points * HISTORY_OVERSAMPLE)
+        view = get_rollup_view(resolution)
+        available = [int(name[7:-14]) for name in view.fields
+                     if name.startswith('channel') and name.endswith('_moisture_mean')]
+        selected = request.args.get('channels')
+        selected = [int(channel) for channel in selected.split(',')] if selected else available
+        unknown = [channel for channel in selected if channel not in available]
+        if unknown:
+            return jsonify({'error': f'Unknown channels {unknown}'}), 400
+
+        start, stop = view.between(start_time, stop_time)
+        timestamps = [value for segment in view.column('timestamp', start, stop) for value in segment.tolist()]
+
+        data = {}
+        for channel in selected:
+            moisture = [value for segment in view.column(f'channel{channel}_moisture_mean', start, stop)
+                        for value in segment.tolist()]
+            xs, ys = finite(timestamps, moisture)
+            values = [{'timestamp': datetime.fromtimestamp(xs[i]).isoformat(), 'value': ys[i]}
+                      for i in METHODS[method](xs, ys, points)]
+
+            # One marker where each alarm starts, the bucket mean is the fraction of time in alarm
+            alarms = []
+            alarm_field = f'channel{channel}_alarm_max'
+            if alarm_field in view.fields:
+                previous = False
+                alarm = [value for segment in view.column(alarm_field, start, stop) for value in segment.tolist()]
+                for timestamp, level, value in zip(timestamps, alarm, moisture):
+                    active = level > 0
+                    if active and not previous and not math.isnan(value):
+                        alarms.append({'timestamp': datetime.fromtimestamp(timestamp).isoformat(), 'value': value})
+                    previous = active
+                alarms = alarms[-points:]
+
+            data[f'channel{channel}'] = {'values': values, 'alarms': alarms}
+        return jsonify(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/storage', methods=['GET'])
+def get_storage_stats():
+    """Queue depth, drop and flush latency counters for the storage writer"""
+    if not storage_writer:
+        return jsonify({'error': 'Storage not initialized'}), 500
+    return jsonify(storage_writer.stats())
+
+@app.route('/sensor_history/summary')
+def get_history_summary():
+    """Record counts, time span and per-field min/max of the daily archives
+
+    Answered entirely from the day index, no archives are opened. Query
+    parameters: from, to (epoch seconds or ISO).
+    """
     try:
-        with open('sensor_data.json', 'r') as f:
-            return jsonify(json.load(f))
+        index = get_history_index()
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        summary = index.summary(start_time, stop_time)
+        summary['per_day'] = dict((day.isoformat(), entry) for day, entry in index.entries(start_time, stop_time))
+        return jsonify(summary)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sensor_history')
+def get_archived_history():
+    """Archived history columns for a time range
+
+    Only the day archives overlapping the range are opened. Query parameters:
+    from, to (epoch seconds or ISO) and fields (comma separated).
+    """
+    try:
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else None
+        columns = get_history_index().columns(parse_time(request.args.get('from')),
+                                              parse_time(request.args.get('to')), fields)
+        columns = dict((name, [None if math.isnan(value) else value for value in values])
+                       for name, values in columns.items())
+        return jsonify({'columns': columns})
+    except KeyError as e:
+        return jsonify({'error': f'Unknown field {e}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -34,22 +346,87 @@ def activate_pump(channel):
     if channel < 1 or channel > 3:
         return "Invalid channel", 400
 
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
     logging.info(f"Received pump activation request: {data}")
-    
-    duration = float(data.get('duration', 0.2))
-    speed = min(max(float(data.get('speed', 100)), 0), 100) / 100
-    
+
+    try:
+        duration = float(data.get('duration', 0.2))
+        speed = float(data.get('speed', 100))
+    except (TypeError, ValueError):
+        return "Duration and speed must be numbers", 400
+    if not 0 < duration <= WEB_MAX_DURATION:
+        return f"Duration must be more than 0 and no more than {WEB_MAX_DURATION} seconds", 400
+    if not 0 < speed <= 100:
+        return "Speed must be more than 0 and no more than 100", 400
+    speed /= 100
+
     # Get the channel object
     channel_obj = channels[channel - 1]
-    
+
     # Activate the pump
     if channel_obj.pump:
-        channel_obj.pump.dose(speed=speed, duration=duration)
-        logging.info(f"Pump activated for channel {channel}")
+        waiting = [dose for dose in get_dose_queue().pending(channel_obj.pump) if dose.source == 'web']
+        if len(waiting) >= WEB_MAX_QUEUED:
+            return f"Channel {channel} already has {len(waiting)} doses waiting", 429
+        # Hardware timed, so the request doesn't wait for the dose to finish
+        channel_obj.pump.dose_pulse(speed=speed, duration=duration, source='web')
+        logging.info(f"Pump dose queued for channel {channel}, {len(get_dose_queue().pending())} doses waiting")
     
     return "OK"
 
+@app.route('/api/pumps', methods=['GET'])
+def get_pump_queue():
+    """Running and queued doses, with queue wait time counters"""
+    try:
+        queue = get_dose_queue()
+        return jsonify({
+            'stats': queue.stats(),
+            'active': [dose.as_dict() for dose in queue.active()],
+            'pending': [dose.as_dict() for dose in queue.pending()],
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/doses', methods=['GET'])
+def get_doses():
+    """Journalled doses, optionally limited with ?from=&to=&channel="""
+    try:
+        channel = request.args.get('channel', type=int)
+        doses = get_journal_view().doses(parse_time(request.args.get('from')),
+                                         parse_time(request.args.get('to')), channel)
+        return jsonify({'doses': doses})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/doses/daily', methods=['GET'])
+def get_dose_totals():
+    """Doses, seconds pumped and ml delivered per channel per day, with totals for the range
+
+    Read from the daily totals, so a week costs seven records, eg: ?from=2024-06-01&to=2024-06-08
+    """
+    try:
+        start_time = parse_time(request.args.get('from'))
+        stop_time = parse_time(request.args.get('to'))
+        view = get_journal_view()
+        return jsonify({
+            'days': view.daily(start_time, stop_time),
+            'totals': view.summary(start_time, stop_time),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/watering', methods=['GET'])
+def get_watering():
+    """Auto-watering controller state for each channel"""
+    try:
+        return jsonify({
+            channel.channel: dict(channel.controller.stats(), auto_water=channel.auto_water)
+            for channel in channels if channel
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/light/<state>', methods=['POST'])
 def control_light(state):
     """Control USB grow light state"""
@@ -1,8 +1,14 @@
 # This is version V2.0 of the code
 
+import threading
 import time
 import lgpio as GPIO
 import logging
+from bisect import bisect_left
+from collections import deque
+
+from grow.frequency import DEFAULT_PRECISION, NO_READING, Reading, from_timestamps, interval, periods_needed
+from grow.snapshot import SnapshotPublisher
 
 # Update moisture sensor pins to match the correct pinout
 MOISTURE_1_PIN = 23  # GPIO 23 (Pin 16) - Moisture 1
@@ -10,13 +16,53 @@ MOISTURE_2_PIN = 8   # GPIO 8  (Pin 24) - Moisture 2
 MOISTURE_3_PIN = 25  # GPIO 25 (Pin 22) - Moisture 3
 MOISTURE_INT_PIN = 4  # GPIO 4  (Pin 7)  - Moisture Int
 
-class Moisture:
-    def __init__(self, channel, gpio_handle=None):
-        """Create a new moisture sensor instance for a specific channel (1-3)."""
+EDGE_WINDOW = 128  # Most rising edges a reading is measured over
+MIN_EDGES = 8  # Fewest rising edges a reading is measured over, when there are enough
+EDGE_TIMEOUT = 3.0  # Seconds without an edge before the reading drops to 0Hz, wet sensors run at ~1Hz
+MAX_GATE = 10.0  # Longest time a reading is measured over, however imprecise
+
+MODE_EDGES = 'edges'  # Measure over a sliding window of edges, updated on every edge
+MODE_GATE = 'gate'  # Only count edges, measure once per gate period
+GATE_TIME = 1.0  # Shortest gate period in seconds
+
+class Moisture(SnapshotPublisher):
+    def __init__(self, channel, gpio_handle=None, window=EDGE_WINDOW, mode=MODE_EDGES, gate=GATE_TIME,
+                 precision=DEFAULT_PRECISION, max_gate=MAX_GATE):
+        """Create a new moisture sensor instance for a specific channel (1-3).
+
+        Frequency is measured from the kernel timestamps of rising edges, so it
+        is unaffected by how late the Python callback runs. Each reading is
+        measured over just enough edges for its 95% confidence interval to be
+        within `precision` of the reading, up to `max_gate` seconds, so slow
+        (wet) readings are measured over longer than fast (dry) ones.
+
+        In MODE_EDGES the spread of the periods between the last `window` edges
+        decides how many are needed. In MODE_GATE the callback only counts
+        edges, and each gate of at least `gate` seconds stays open until a one
+        edge miscount would be within `precision`.
+
+        Readers get an immutable grow.snapshot.Snapshot from snapshot(), which
+        measures any new edges first. It never blocks: if another thread is
+        already measuring, the previous snapshot is returned.
+        """
         self._gpio_pin = [MOISTURE_1_PIN, MOISTURE_2_PIN, MOISTURE_3_PIN][channel - 1]
-        self._history = []
-        self._freq = 0.0
-        self._last_edge = None
+        self._history = deque(maxlen=96)  # Frequencies, newest first
+        self._update_lock = threading.Lock()
+        self._edges = deque(maxlen=max(2, window))  # Kernel timestamps in nanoseconds
+        self._edge_count = 0
+        self._gap = int(EDGE_TIMEOUT * 1e9)
+        self._seen_count = 0
+        self._seen_time = time.monotonic()
+        self._mode = mode
+        self._gate = gate
+        self._edge = (0, 0)  # Edge count and kernel timestamp of the last edge, in gate mode
+        self._gate_start = (0, None)
+        self._gate_opened = self._gate_changed = time.monotonic()
+        self._gate_reading = NO_READING
+        self._estimate = NO_READING
+        self._precision = precision
+        self._max_gate = max_gate
+        self._callback = None
         self._wet_point = 0.7
         self._dry_point = 26.7
         self._h = gpio_handle if gpio_handle is not None else GPIO.gpiochip_open(0)
@@ -44,7 +90,7 @@ class Moisture:
             try:
                 logging.info(f"Setting up edge detection on GPIO {self._gpio_pin}")
                 GPIO.gpio_claim_alert(self._h, self._gpio_pin, GPIO.RISING_EDGE)
-                GPIO.callback(self._h, self._gpio_pin, GPIO.RISING_EDGE, self._event_handler)
+                self._callback = GPIO.callback(self._h, self._gpio_pin, GPIO.RISING_EDGE, self._handler())
                 logging.info(f"Successfully registered callbacks for pin {self._gpio_pin}")
             except Exception as e:
                 logging.error(f"Failed to register callbacks for pin {self._gpio_pin}: {e}")
@@ -56,44 +102,157 @@ class Moisture:
             raise
 
     def _event_handler(self, chip, gpio, level, timestamp):
-        """Handle the GPIO edge event and calculate frequency."""
-        current_time = time.time() * 1000000  # Convert to microseconds
-        logging.debug(f"Edge detected on GPIO {gpio} at {timestamp}")  # Changed to debug level
-
-        if self._last_edge is not None:
-            delta = current_time - self._last_edge
-            if delta > 0:
-                self._freq = 1000000.0 / delta  # Convert from microseconds to Hz
-                self._history.append(self.saturation)
-                if len(self._history) > 96:  # Maintain 96 samples
-                    self._history.pop(0)
-        
-        self._last_edge = current_time
+        """Record the kernel timestamp of a rising edge."""
+        edges = self._edges
+        if edges and timestamp - edges[-1] > self._gap:
+            edges.clear()  # The sensor stalled, don't average across the gap
+        edges.append(timestamp)
+        self._edge_count += 1
+
+    def _count_edge(self, chip, gpio, level, timestamp):
+        """Count a rising edge, everything else waits for the end of the gate period."""
+        self._edge = (self._edge[0] + 1, timestamp)
+
+    def _handler(self):
+        return self._count_edge if self._mode == MODE_GATE else self._event_handler
+
+    def set_mode(self, mode, gate=None):
+        """Switch between MODE_EDGES and MODE_GATE, optionally changing the gate period."""
+        if gate is not None:
+            self._gate = gate
+        if mode == self._mode:
+            return
+        with self._update_lock:
+            self._mode = mode
+            self._edges.clear()
+            self._edge = (0, 0)
+            self._gate_start = (0, None)
+            self._gate_reading = NO_READING
+            self._estimate = NO_READING
+            if self._callback is not None:
+                self._callback.cancel()
+                self._callback = GPIO.callback(self._h, self._gpio_pin, GPIO.RISING_EDGE, self._handler())
+
+    def _close_gate(self, now):
+        """Measure the edges counted since the last gate and start a new one."""
+        count, timestamp = self._edge
+        start_count, start_timestamp = self._gate_start
+        periods = count - start_count
+        if periods > 0:
+            self._gate_changed = now
+            if start_timestamp is not None and timestamp > start_timestamp:
+                # Without per period timings, precision is bounded by miscounting one edge
+                if periods * self._precision < 1.0 and now - self._gate_opened < self._max_gate:
+                    return  # Keep the gate open for more edges
+                # Whole periods between the first and last edges, timed by the kernel
+                frequency = periods * 1e9 / (timestamp - start_timestamp)
+                self._gate_reading = Reading(frequency, *interval(frequency, 1.0 / periods), edges=periods + 1)
+                self._history.appendleft(frequency)
+            self._gate_start = (count, timestamp)
+        elif now - self._gate_changed > EDGE_TIMEOUT:
+            self._gate_reading = NO_READING
+            self._gate_start = (count, None)  # Don't measure across the stall
+        self._gate_opened = now
+
+    def _measure(self):
+        """Measure over just enough of the recent edges to meet the target precision."""
+        edges = tuple(self._edges)
+        if len(edges) < 2:
+            return NO_READING
+        edges = edges[bisect_left(edges, edges[-1] - int(self._max_gate * 1e9)):]
+        count = min(len(edges), MIN_EDGES)
+        while True:
+            reading, cv = from_timestamps(edges[-count:], 1e-9)
+            needed = periods_needed(cv, self._precision) + 1
+            if needed <= count or count == len(edges):
+                return reading
+            count = min(len(edges), needed)
+
+    def set_precision(self, precision, max_gate=None):
+        """Set the target relative precision of readings and, optionally, the longest time they are measured over."""
+        self._precision = precision
+        if max_gate is not None:
+            self._max_gate = max_gate
+
+    def set_window(self, edges):
+        """Set the most rising edges a reading is measured over."""
+        self._edges = deque(self._edges, maxlen=max(2, int(edges)))
 
     def set_wet_point(self, freq):
         """Set the frequency for 100% saturation."""
         self._wet_point = freq
+        with self._update_lock:
+            self._publish_reading(self._snapshot.reading)
 
     def set_dry_point(self, freq):
         """Set the frequency for 0% saturation."""
         self._dry_point = freq
+        with self._update_lock:
+            self._publish_reading(self._snapshot.reading)
 
     @property
     def history(self):
-        """Return history of saturation readings."""
-        return self._history
+        """Return history of saturation readings, newest first."""
+        return self.snapshot().history
+
+    def _publish_reading(self, reading):
+        def fields():
+            frequency = reading.frequency
+            return (frequency, self._saturation(frequency), self.active and frequency > 0, reading,
+                    [self._saturation(value) for value in self._history])
+        self._publish(fields)
+
+    def snapshot(self):
+        """Return the latest Snapshot of the sensor, measuring any edges that have arrived since the last."""
+        if self._update_lock.acquire(blocking=False):
+            try:
+                self._update()
+            finally:
+                self._update_lock.release()
+        return self._snapshot
+
+    def _update(self):
+        # Edge timestamps come from the kernel's clock, so staleness is judged
+        # by whether any edges have arrived rather than by comparing clocks
+        now = time.monotonic()
+        if self._mode == MODE_GATE:
+            if now - self._gate_opened >= self._gate:
+                self._close_gate(now)
+            reading = self._gate_reading
+        elif self._edge_count != self._seen_count:
+            self._seen_count = self._edge_count
+            self._seen_time = now
+            self._estimate = self._measure()
+            self._history.appendleft(self._estimate.frequency)
+            reading = self._estimate
+        elif now - self._seen_time > EDGE_TIMEOUT:
+            reading = NO_READING
+        else:
+            reading = self._estimate
+
+        if reading is not self._snapshot.reading:
+            self._publish_reading(reading)
+
+    @property
+    def reading(self):
+        """Return the current reading as a grow.frequency.Reading.
+
+        This gives the frequency in Hz, the bounds of its 95% confidence interval
+        and the number of edges it was measured from.
+        """
+        return self.snapshot().reading
 
     @property
     def moisture(self):
         """Return the current moisture frequency in Hz."""
-        if self._last_edge is None or (time.time() * 1000000 - self._last_edge) > 1000000:  # 1 second timeout
-            self._freq = 0
-        return self._freq
+        return self.snapshot().moisture
 
     @property
     def saturation(self):
         """Return the current saturation as float 0.0 to 1.0."""
-        moisture = self.moisture
+        return self.snapshot().saturation
+
+    def _saturation(self, moisture):
         if moisture == 0:
             return 0.0
         zero = self._dry_point
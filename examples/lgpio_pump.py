@@ -1,44 +1,106 @@
-import time
 import lgpio as GPIO
 
+from grow.dosing import get_dose_queue
+from grow.gpio import LgpioBackend
+from grow.pump import PUMP_MAX_DUTY, PUMP_PWM_FREQ
+
 # Verify pump GPIO pins are correct
 PUMP_1_PIN = 17  # GPIO 17 (Pin 11) - Pump 1
 PUMP_2_PIN = 27  # GPIO 27 (Pin 13) - Pump 2
 PUMP_3_PIN = 22  # GPIO 22 (Pin 15) - Pump 3
 
 class Pump:
-    def __init__(self, channel, gpio_handle=None):
-        """Create a new pump instance for a specific channel (1-3)."""
+    def __init__(self, channel, gpio_handle=None, queue=None, flow_model=None):
+        """Create a new pump instance for a specific channel (1-3).
+
+        Doses from every pump go through one grow.dosing.DoseQueue, which limits how
+        many pumps run at once and queues the rest rather than dropping them.
+        flow_model, a grow.flow.FlowModel from calibrate-pump.py, lets dose_volume()
+        dose by ml rather than seconds.
+        """
+        self.channel = channel
         self._gpio_pin = [PUMP_1_PIN, PUMP_2_PIN, PUMP_3_PIN][channel - 1]
         self._h = gpio_handle if gpio_handle is not None else GPIO.gpiochip_open(0)
         self._owns_handle = gpio_handle is None
         GPIO.gpio_claim_output(self._h, self._gpio_pin, 0)  # Initialize as off
+        self._pwm = LgpioBackend(handle=self._h).pwm(self._gpio_pin, PUMP_PWM_FREQ)
+        self._queue = queue if queue is not None else get_dose_queue()
+        self._speed = 0.0
+        self.flow_model = flow_model
 
-    def dose(self, speed=1.0, duration=0.1, blocking=True):
-        """Run pump at speed for duration seconds."""
-        try:
-            # Convert speed (0.0 to 1.0) to PWM
-            pwm = min(max(int(speed * 255), 0), 255)  # Scale to 0-255
-            GPIO.gpio_write(self._h, self._gpio_pin, 1)  # Turn on pump
-            
-            if blocking:
-                time.sleep(duration)
-                GPIO.gpio_write(self._h, self._gpio_pin, 0)  # Turn off pump
-            else:
-                def stop_pump():
-                    time.sleep(duration)
-                    GPIO.gpio_write(self._h, self._gpio_pin, 0)
-                import threading
-                threading.Thread(target=stop_pump, daemon=True).start()
-
-        except Exception as e:
-            print(f"Error during pump dose: {e}")
-            GPIO.gpio_write(self._h, self._gpio_pin, 0)  # Ensure pump is off
+    def set_speed(self, speed):
+        """Run the pump at speed, from 0.0 (off) to 1.0 (PUMP_MAX_DUTY).
+
+        The PWM is timed by lgpio, no Python thread runs while the pump does.
+        Returns False if as many pumps as the dose queue allows are already running.
+        """
+        speed = min(max(float(speed), 0.0), 1.0)
+        if speed > 0 and not self._queue.acquire(self):
+            return False
+        self._pwm.set_duty(PUMP_MAX_DUTY * speed)
+        self._speed = speed
+        if speed == 0:
+            GPIO.gpio_write(self._h, self._gpio_pin, 0)  # Make sure the pin is left low
+            self._queue.release(self)
+        return True
+
+    def get_speed(self):
+        return self._speed
+
+    def stop(self):
+        """Stop the pump and cancel any of its queued doses."""
+        self._queue.cancel(self)
+        self.set_speed(0)
+
+    def dose(self, speed=1.0, duration=0.1, blocking=True, source=None):
+        """Run pump at speed for duration seconds, once it's this pump's turn in the dose queue."""
+        if speed <= 0:
+            self.stop()
+            return None
+        dose = self.dose_pulse(speed, duration, source=source)
+        if blocking:
+            try:
+                dose.result()
+            except Exception as e:
+                print(f"Error during pump dose: {e}")
+                self.stop()  # Ensure pump is off
+        return dose
+
+    def dose_pulse(self, speed=1.0, duration=0.1, callback=None, source=None):
+        """Queue a dose of speed for duration seconds, timed by lgpio, and return right away.
+
+        Returns the grow.dosing.Dose, a concurrent.futures.Future resolved with the seconds
+        the pump ran for. callback, if given, is called with the Dose once it has finished.
+        """
+        speed = min(max(float(speed), 0.0), 1.0)
+        return self._queue.submit(self, speed, duration, source, callback)
+
+    def dose_volume(self, volume, speed=None, blocking=False, callback=None, source=None):
+        """Queue a dose of volume ml, timed using the pump's flow model, and return its Dose."""
+        if self.flow_model is None:
+            raise ValueError(f"Pump {self.channel} has no flow model, calibrate it to dose by volume")
+        speed = self.flow_model.speed if speed is None else min(max(float(speed), 0.0), 1.0)
+        duration = self.flow_model.seconds(volume, speed)
+        dose = self._queue.submit(self, speed, duration, source, callback, volume)
+        if blocking:
+            dose.result()
+        return dose
+
+    def _pulse(self, speed, duration):
+        """Run a dose from the queue."""
+        self._speed = speed
+        pulse = self._pwm.pulse(PUMP_MAX_DUTY * speed, duration)
+        pulse.add_done_callback(self._pulse_done)
+        return pulse
+
+    def _pulse_done(self, pulse):
+        if self._pwm.duty == 0:
+            self._speed = 0.0
 
     def __del__(self):
         """Clean up GPIO resources."""
         try:
-            GPIO.gpio_write(self._h, self._gpio_pin, 0)  # Ensure pump is off
+            self.stop()  # Ensure pump is off
             if self._owns_handle:
                 GPIO.gpiochip_close(self._h)
         except:
@@ -12,6 +12,7 @@ import os
 import json
 from datetime import datetime
 import signal
+from collections import deque
 from werkzeug.serving import is_running_from_reloader
 from flask import request
 
@@ -23,14 +24,28 @@ from fonts.ttf import RobotoMedium as UserFont
 from PIL import Image, ImageDraw, ImageFont
 
 from grow import Piezo
-from lgpio_moisture import Moisture  # Use our patched moisture module instead
+from grow.archive import ArchiveIndex, ArchiveWriter, archive_path
+from grow.database import SQLiteStore
+from grow.control import WateringController
+from grow.filters import Pipeline
+from grow.flow import FlowModel
+from grow.dosing import MAX_ACTIVE_PUMPS, get_dose_queue
+from grow.frequency import DEFAULT_PRECISION
+from grow.gpio import get_backend
+from grow.shared import SharedReadings
+from grow.history import SensorLog
+from grow.journal import DoseJournal
+from grow.writer import StorageWriter
+from grow.rollup import Rollups
+from lgpio_moisture import Moisture, EDGE_WINDOW, GATE_TIME, MAX_GATE, MODE_EDGES  # Use our patched moisture module instead
 from lgpio_pump import Pump  # Use our patched pump module
+from sampler import SAMPLER_NAME, SharedLight, SharedMoisture
 from chilli_screensaver import draw_chilli_animation
 print("Imported draw_chilli_animation from:", draw_chilli_animation.__module__)
 from threading import Thread
 from threading import Event
 from threading import Lock
-from flask_app import app, init_channels
+from flask_app import app, init_channels, init_storage, SENSOR_LOG_FILE, ROLLUP_DIR, HISTORY_DIR, DOSE_JOURNAL_DIR
 
 # Global variables
 viewcontroller = None
@@ -40,6 +55,12 @@ screensaver_stop_event = Event()
 screensaver_active = False
 last_button_press = 0
 icons = None
+sensor_store = None
+storage_engine = None
+rollups = None
+dose_journal = None
+storage_writer = None
+history_index = None
 
 # Global icon variables
 icon_drop = None
@@ -62,6 +83,14 @@ LABELS = ["A", "B", "X", "Y"]
 DISPLAY_WIDTH = 160
 DISPLAY_HEIGHT = 80
 
+MAX_HISTORY = 24 * 60 * 60  # Readings kept in the sensor log before archiving
+ARCHIVE_INTERVAL = MAX_HISTORY - 60 * 60  # Unarchived readings that trigger a daily history write
+SENSOR_DB_FILE = 'sensor_data.db'  # Used instead of the log and archives with "storage: sqlite"
+
+STORAGE_BATCH_SIZE = 100  # Readings per storage write
+STORAGE_FLUSH_INTERVAL = 5.0  # Longest a reading waits to be written, in seconds
+STORAGE_MAX_QUEUE = 1000  # Readings held in memory if the disk stalls
+
 COLOR_WHITE = (255, 255, 255)
 COLOR_BLUE = (31, 137, 251)
 COLOR_GREEN = (99, 255, 1)
@@ -252,8 +281,9 @@ class MainView(View):
             bar_x + ((bar_width + bar_margin) * 2),
         ][channel.channel - 1]
 
-        # Saturation amounts from each sensor
-        saturation = channel.sensor.saturation
+        # Saturation amounts from each sensor, taken from one consistent snapshot
+        state = channel.sensor.snapshot()
+        saturation = state.saturation
         active = channel.sensor.active and channel.enabled
         warn_level = channel.warn_level
 
@@ -603,7 +633,7 @@ class ChannelView(View):
         )
 
     def draw_context(self, position, metric="Hz"):
-        context = f"Now: {self.channel.sensor.moisture:.2f}Hz"
+        context = f"Now: {self.channel.moisture:.2f}Hz"
         if metric.lower() == "sat":
             context = f"Now: {self.channel.sensor.saturation * 100:.2f}%"
         self._draw.text(
@@ -637,8 +667,8 @@ class DetailView(ChannelView):
             # Draw the graph background
             self._draw.rectangle((graph_x, graph_y, graph_x + graph_width, graph_y + graph_height), (50, 50, 50))
 
-            # Render the graph bars
-            for x, value in enumerate(self.channel.sensor.history[:graph_width]):
+            # Render the graph bars, newest on the right
+            for x, value in enumerate(self.channel.sensor.snapshot().history[:graph_width]):
                 color = self.channel.indicator_color(value)
                 h = value * graph_height
                 x = graph_x + graph_width - x - 1
@@ -839,6 +869,7 @@ class Channel:
         warn_level=0.5,
         pump_speed=0.5,
         pump_time=0.2,
+        pump_volume=None,
         watering_delay=60,
         wet_point=0.7,
         dry_point=26.7,
@@ -856,6 +887,9 @@ class Channel:
         self.auto_water = auto_water
         self.pump_speed = pump_speed
         self.pump_time = pump_time
+        self.pump_volume = pump_volume  # ml per dose, used instead of pump_time once the pump is calibrated
+        self.flow_model = None
+        self._flow_config = None
         self.watering_delay = watering_delay
         self._wet_point = wet_point
         self._dry_point = dry_point
@@ -868,6 +902,14 @@ class Channel:
         self._initialized = False  # Add this flag
         self._startup_readings = []  # Add this for initial readings
         self._startup_count = 5  # Number of readings to collect before activating alarms
+        self.filters = Pipeline()  # Conditions raw sensor readings before alarms and display use them
+        self._filter_config = None
+        self.moisture = 0.0  # Latest conditioned reading
+        self.saturation = 0.0  # Latest conditioned reading, from 0.0 (dry point) to 1.0 (wet point)
+        self.controller = WateringController(water_level)  # Sizes auto-watering doses
+        self._controller_config = None
+        self._other_doses = deque()  # Normal doses given other than by auto-watering, for the controller
+        get_dose_queue().add_listener(self._dose_finished)
 
     def initialize(self):
         """Initialize sensor and pump after GPIO is properly set up"""
@@ -886,7 +928,7 @@ class Channel:
             time.sleep(0.1)  # Delay between sensor and pump init
             
             if self.pump is None:
-                self.pump = Pump(self.pump_channel, self._gpio_handle)
+                self.pump = Pump(self.pump_channel, self._gpio_handle, flow_model=self.flow_model)
                 
         except Exception as e:
             print(f"Error initializing channel {self.channel}: {e}")
@@ -940,6 +982,7 @@ class Channel:
         if config is not None:
             self.pump_speed = config.get("pump_speed", self.pump_speed)
             self.pump_time = config.get("pump_time", self.pump_time)
+            self.pump_volume = config.get("pump_volume", self.pump_volume)
             self.warn_level = config.get("warn_level", self.warn_level)
             self.water_level = config.get("water_level", self.water_level)
             self.watering_delay = config.get("watering_delay", self.watering_delay)
@@ -948,6 +991,24 @@ class Channel:
             self.wet_point = config.get("wet_point", self.wet_point)
             self.dry_point = config.get("dry_point", self.dry_point)
 
+            filters = config.get("filters")
+            if filters != self._filter_config:
+                self.filters = Pipeline.from_config(filters)
+                self._filter_config = filters
+
+            flow_model = config.get("flow_model")
+            if flow_model != self._flow_config:
+                self.flow_model = FlowModel.from_config(flow_model)
+                self._flow_config = flow_model
+                if self.pump is not None:
+                    self.pump.flow_model = self.flow_model
+
+            controller = config.get("controller")
+            if controller != self._controller_config:
+                # Retuning keeps track of doses still soaking in, so it can't set off another straight away
+                self.controller = WateringController.from_config(self.water_level, controller, self.controller)
+                self._controller_config = controller
+
         pass
 
     def __str__(self):
@@ -958,6 +1019,8 @@ Auto water: {auto_water}
 Water level: {water_level}
 Pump speed: {pump_speed}
 Pump time: {pump_time}
+Pump volume: {pump_volume}
+Flow model: {flow_model}
 Delay: {watering_delay}
 Wet point: {wet_point}
 Dry point: {dry_point}
@@ -969,28 +1032,67 @@ Dry point: {dry_point}
             water_level=self.water_level,
             pump_speed=self.pump_speed,
             pump_time=self.pump_time,
+            pump_volume=self.pump_volume,
+            flow_model=self.flow_model,
             watering_delay=self.watering_delay,
             wet_point=self.wet_point,
             dry_point=self.dry_point,
         )
 
-    def water(self):
-        if not self.auto_water:
+    def water(self, dose=1.0):
+        """Give dose times the normal dose, pump_volume ml or pump_time seconds, if watering_delay has passed"""
+        if not self.auto_water or self.pump is None:
             return False
         if time.time() - self.last_dose > self.watering_delay:
-            self.pump.dose(self.pump_speed, self.pump_time, blocking=False)
+            # lgpio times the dose, so short doses aren't stretched by a busy Pi
+            if self.pump_volume and self.flow_model is not None:
+                # At the speed the pump was calibrated at, the model may not know how flow changes with speed
+                self.pump.dose_volume(self.pump_volume * dose, source='auto')
+            else:
+                self.pump.dose_pulse(self.pump_speed, self.pump_time * dose, source='auto')
             self.last_dose = time.time()
             return True
         return False
 
+    def normal_doses(self, dose):
+        """Return how many of the channel's normal doses a finished grow.dosing.Dose gave"""
+        if dose.ran is None:
+            return 0.0
+        delivered = dose.delivered
+        if self.pump_volume and delivered is not None:
+            return delivered / self.pump_volume
+        if not self.pump_time or not self.pump_speed:
+            return 0.0
+        # Without a flow model, taking flow as proportional to speed
+        return dose.ran * dose.speed / (self.pump_time * self.pump_speed)
+
+    def _dose_finished(self, dose):
+        """Dose queue listener, called from the dose thread, passing water from the web, buttons etc. to the controller"""
+        if self.pump is None or dose.pump is not self.pump or dose.source == 'auto':
+            return
+        doses = self.normal_doses(dose)
+        if doses > 0:
+            self._other_doses.append((doses, dose.finished))
+
+    def to_saturation(self, moisture):
+        """Convert a moisture reading in Hz to saturation, from 0.0 (dry point) to 1.0 (wet point)"""
+        if moisture <= 0 or self._wet_point == self._dry_point:
+            return 0.0
+        saturation = (moisture - self._dry_point) / (self._wet_point - self._dry_point)
+        return max(0.0, min(1.0, saturation))
+
     def render(self, image, font):
         pass
 
     def update(self):
         """Update channel status and handle automatic watering"""
         if self.sensor and self.sensor.active:
-            # Get current moisture level
-            moisture = self.sensor.moisture
+            # The loop polls faster than the sensor takes readings, each reading is only
+            # filtered and acted on once. Invalid (zero) readings are kept out of the filters
+            moisture = self.filters.update_snapshot(self.sensor.snapshot())
+            if moisture is None:
+                return
+            self.moisture = moisture
             
             # During startup, collect readings before enabling alarms
             if not self._initialized:
@@ -1021,6 +1123,21 @@ Dry point: {dry_point}
                 elif not self.alarm and previous_alarm:
                     logging.info(f"Channel {self.channel} alarm CLEARED - moisture ({moisture:.2f}) wet enough (<{self.warn_level:.2f})")
 
+            # Auto-watering, the controller sizes each dose from how far saturation is below its target
+            while self._other_doses:
+                # Water given from the web or by hand is still soaking in, it isn't topped up straight away
+                doses, finished = self._other_doses.popleft()
+                self.controller.dosed(doses, finished)
+
+            if self.enabled and self.auto_water and moisture > 0:
+                self.saturation = self.to_saturation(moisture)
+                self.controller.level = self.water_level  # Follows edits made on the display
+                dose = self.controller.update(self.saturation)
+                if dose > 0 and self.water(dose):
+                    self.controller.dosed(dose)
+                    logging.info(f"Channel {self.channel} auto watering - saturation {self.saturation:.2f}, " +
+                                 f"target {self.controller.target:.2f}, dose x{dose:.2f}")
+
 
 class Alarm(View):
     def __init__(self, image, enabled=True, interval=10.0, beep_frequency=440):
@@ -1077,19 +1194,7 @@ class Alarm(View):
             and time.time() - self._time_last_beep > self.interval
         ):
             logging.info("Triggering alarm beeps")
-            self.piezo.beep(self.beep_frequency, 0.1, blocking=False)
-            threading.Timer(
-                0.3,
-                self.piezo.beep,
-                args=[self.beep_frequency, 0.1],
-                kwargs={"blocking": False},
-            ).start()
-            threading.Timer(
-                0.6,
-                self.piezo.beep,
-                args=[self.beep_frequency, 0.1],
-                kwargs={"blocking": False},
-            ).start()
+            self.piezo.beeps(self.beep_frequency, 0.1, count=3, interval=0.3)
             self._time_last_beep = time.time()
             self._triggered = False
 
@@ -1216,6 +1321,7 @@ class Config:
             "auto_water",
             "pump_time",
             "pump_speed",
+            "pump_volume",
             "water_level",
         ]
 
@@ -1278,43 +1384,24 @@ class Config:
         self.set("general", settings)
 
 
-def write_daily_history(data, current_time):
-    """Write daily sensor history to yearly archive file"""
-    year = current_time.year
-    month = current_time.month
-    day = current_time.day
-    
-    # Create directory structure if it doesn't exist
-    history_dir = pathlib.Path('sensor_history')
-    year_dir = history_dir / str(year)
-    month_dir = year_dir / f"{month:02d}"
-    
-    for dir_path in [history_dir, year_dir, month_dir]:
-        dir_path.mkdir(exist_ok=True)
-    
-    # Create daily history file
-    filename = f"sensor_data_{year}-{month:02d}-{day:02d}.json"
-    file_path = month_dir / filename
-    
-    try:
-        # If file exists, load and append, otherwise create new
-        if file_path.exists():
-            with open(file_path, 'r') as f:
-                daily_data = json.load(f)
-                if 'history' not in daily_data:
-                    daily_data['history'] = []
-        else:
-            daily_data = {'history': []}
-        
-        # Add current history to daily file
-        daily_data['history'].extend(data['history'])
-        
-        # Write updated daily history
-        with open(file_path, 'w') as f:
-            json.dump(daily_data, f)
-        logging.info(f"Daily history archived to {file_path}")
-    except Exception as e:
-        logging.error(f"Failed to write daily history: {e}")
+def write_daily_history(fields, records):
+    """Append sensor records to the compressed columnar archive for the day they were taken"""
+    days = {}
+    for record in records:
+        days.setdefault(datetime.fromtimestamp(record[0]).date(), []).append(record)
+
+    for day, day_records in days.items():
+        file_path = archive_path(HISTORY_DIR, day)
+        try:
+            # Each archive run is appended as one chunk, existing data is never rewritten
+            with ArchiveWriter(file_path, fields) as archive:
+                archive.append(day_records)
+
+            # Keep the day index current so range and summary queries can skip the archives
+            history_index.add(day, file_path, fields, day_records)
+            logging.info(f"Daily history archived to {file_path}")
+        except Exception as e:
+            logging.error(f"Failed to write daily history: {e}")
 
 def normalize_moisture(raw_value):
     """Normalize moisture readings to a 0-100 scale"""
@@ -1334,8 +1421,59 @@ def normalize_moisture(raw_value):
     logging.debug(f"Normalized moisture value: {normalized}%")
     return normalized
 
+def open_storage(engine="file", retention_days=365):
+    """Open the storage engine and rollups and start the background storage writer
+
+    engine is "file" for the ring log plus daily archives, or "sqlite" for a
+    WAL mode database that expires readings after retention_days instead of archiving.
+    """
+    global sensor_store, storage_engine, rollups, storage_writer, history_index, dose_journal
+    storage_engine = engine
+    if engine == "sqlite":
+        sensor_store = SQLiteStore(SENSOR_DB_FILE, retention=retention_days * 24 * 60 * 60)
+    else:
+        sensor_store = SensorLog(SENSOR_LOG_FILE, capacity=MAX_HISTORY)
+    logging.info(f"Storing sensor history with the {engine} engine")
+
+    rollups = Rollups(ROLLUP_DIR)
+    history_index = ArchiveIndex(HISTORY_DIR)
+    storage_writer = StorageWriter(store_records, batch_size=STORAGE_BATCH_SIZE,
+                                   flush_interval=STORAGE_FLUSH_INTERVAL, max_queue=STORAGE_MAX_QUEUE)
+    init_storage(storage_writer, sensor_store if engine == "sqlite" else None)
+
+    # Every finished dose is journalled, with each channel's daily totals updated as it is
+    dose_journal = DoseJournal(DOSE_JOURNAL_DIR)
+    get_dose_queue().add_listener(dose_journal.record)
+
+
+def store_records(records):
+    """Write a batch of sensor records, called from the storage writer thread
+
+    The writer retries a batch that fails, so each stage skips records it already
+    holds: the store keeps only records newer than its latest, and each rollup
+    tier skips readings at or before the last it folded in.
+    """
+    stored = sensor_store.unstored(records)
+    if storage_engine == "sqlite":
+        # One transaction per batch, old rows are expired by the store itself
+        sensor_store.write(stored)
+    else:
+        # Appending only writes the new records and the cursor, never the whole history
+        sensor_store.extend(stored)
+
+        # Archive before the oldest unarchived readings are overwritten. The log
+        # holds MAX_HISTORY records, comfortably more than ARCHIVE_INTERVAL plus a batch.
+        if sensor_store.written - sensor_store.mark >= ARCHIVE_INTERVAL:
+            write_daily_history(sensor_store.fields, list(sensor_store.records(sensor_store.mark)))
+            sensor_store.mark = sensor_store.written
+
+    # Keep the 1s/1min/1h min/max/mean tiers up to date as each reading arrives
+    for record in records:
+        rollups.add(record[0], dict(zip(sensor_store.fields, record)))
+
+
 def write_sensor_data(channels, light):
-    """Write current sensor data to JSON file with history"""
+    """Queue current sensor data for the background storage writer"""
     current_time = datetime.now()
     timestamp = current_time.isoformat()
     
@@ -1348,18 +1486,6 @@ def write_sensor_data(channels, light):
         lux_value = 0.0
         proximity_value = 0.0
     
-    try:
-        with open('sensor_data.json', 'r') as f:
-            data = json.load(f)
-            if 'history' not in data:
-                data['history'] = []
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = {
-            'history': [],
-            'sensors': {},
-            'light': {}
-        }
-    
     # Create current reading
     current_reading = {
         'timestamp': timestamp,
@@ -1384,32 +1510,14 @@ def write_sensor_data(channels, light):
                 channel.min_moisture = float(f"{min(channel.min_moisture, raw_value):.2f}")
                 channel.max_moisture = float(f"{max(channel.max_moisture, raw_value):.2f}")
             
-            # Store in JSON with exactly 2 decimal places
             current_reading['sensors'][f'channel{channel.channel}'] = {
                 'moisture': raw_value,  # Already formatted to 2 decimal places
                 'alarm': channel.alarm,
                 'enabled': channel.enabled
             }
     
-    # Add current reading to history
-    data['history'].append(current_reading)
-    
-    # Check if we need to archive daily data
-    max_history = 24 * 60 * 60
-    if len(data['history']) >= max_history:
-        write_daily_history(data, current_time)
-        data['history'] = data['history'][-3600:]
-    
-    # Update current readings
-    data['timestamp'] = timestamp
-    data['sensors'] = current_reading['sensors']
-    data['light'] = current_reading['light']
-    
-    try:
-        with open('sensor_data.json', 'w') as f:
-            json.dump(data, f)
-    except Exception as e:
-        logging.error(f"Failed to write sensor data: {e}")
+    # Never blocks: if the disk stalls the oldest queued readings are dropped instead
+    storage_writer.put(sensor_store.encode(current_reading))
 
 
 def cleanup():
@@ -1438,9 +1546,16 @@ def cleanup():
                 if channel.pump:
                     channel.pump.dose(0, 0.1)  # Ensure pumps are off
         
+        # Flush any readings still waiting to be written
+        if storage_writer:
+            storage_writer.close()
+        if dose_journal:
+            get_dose_queue().remove_listener(dose_journal.record)
+            dose_journal.close()
+
         # Close GPIO handle
         if 'h' in globals():
-            GPIO.gpiochip_close(h)
+            get_backend().close()
         
         logging.info("Cleanup complete")
         
@@ -1588,8 +1703,8 @@ def main():
         image_blank = Image.new("RGBA", (DISPLAY_WIDTH, DISPLAY_HEIGHT), color=(0, 0, 0))
         logging.info("Canvas prepared for drawing")
 
-        # Initialize GPIO
-        h = GPIO.gpiochip_open(0)
+        # Initialize GPIO, sharing grow's chip handle with the piezo
+        h = get_backend('lgpio').handle
         logging.info("GPIO handle opened successfully")
         
         # Set up GPIO 26 as output for USB light
@@ -1607,12 +1722,33 @@ def main():
             except Exception as e:
                 logging.warning(f"Failed to initialize button {pin}: {e}")
 
+        config = Config()
+
+        try:
+            config.load()
+            logging.info("Configuration loaded successfully")
+        except Exception as e:
+            logging.error(f"Failed to load configuration: {e}")
+            return
+
+        # With the sampler daemon running, moisture and light are read from its shared memory
+        sampler = None
+        if config.get_general().get("sampler", False):
+            try:
+                sampler = SharedReadings(SAMPLER_NAME)
+                light = SharedLight(sampler)
+                logging.info(f"Reading sensors from sampler shared memory '{SAMPLER_NAME}'")
+            except FileNotFoundError:
+                logging.error("Sampler is enabled but not running, reading sensors directly")
+
         # Initialize channels with more careful error handling and delays
         channels = []
         for i in range(3):
             try:
                 time.sleep(0.5)
                 channel = Channel(i+1, i+1, i+1, gpio_handle=h)
+                if sampler is not None:
+                    channel.sensor = SharedMoisture(sampler, i+1)
                 channel.initialize()
                 
                 if channel.sensor is not None and channel.sensor.active:
@@ -1627,20 +1763,22 @@ def main():
             logging.error("No channels could be initialized")
             return
 
-        # Initialize alarm and config
+        # Initialize alarm
         alarm = Alarm(image)
-        config = Config()
-
-        try:
-            config.load()
-            logging.info("Configuration loaded successfully")
-        except Exception as e:
-            logging.error(f"Failed to load configuration: {e}")
-            return
 
         # Update channels and alarm from config
         for channel in channels:
             channel.update_from_yml(config.get_channel(channel.channel))
+            # Number of rising edges each moisture reading is averaged over
+            channel.sensor.set_window(config.get_general().get("moisture_window", EDGE_WINDOW))
+            # "gate" only counts edges in the GPIO callback and measures once per gate period
+            channel.sensor.set_mode(config.get_general().get("moisture_mode", MODE_EDGES),
+                                    config.get_general().get("moisture_gate", GATE_TIME))
+            # Readings are measured over just enough edges for this relative precision
+            channel.sensor.set_precision(config.get_general().get("moisture_precision", DEFAULT_PRECISION),
+                                         config.get_general().get("moisture_max_gate", MAX_GATE))
+        # Doses beyond this many pumps at once wait in the queue, to protect the power supply
+        get_dose_queue().set_max_active(config.get_general().get("max_pumps", MAX_ACTIVE_PUMPS))
         alarm.set_channels(channels)
         alarm.update_from_yml(config.get_general())
 
@@ -1700,6 +1838,12 @@ def main():
         # Initialize Flask app with channel access and GPIO handle
         init_channels(channels, h)  # Pass the GPIO handle
 
+        # Sensor history is written by a background thread so disk stalls never hold up the loop
+        open_storage(
+            config.get_general().get("storage", "file"),
+            config.get_general().get("storage_retention_days", 365)
+        )
+
         # Main loop
         last_display_update = time.time()
         while True:
@@ -1712,7 +1856,7 @@ def main():
                             logging.info(f"Channel {channel.channel} has alarm, triggering alarm system")
                             alarm.trigger()
 
-                # Write sensor data to file every 1 second instead of waiting for the full display refresh
+                # Queue sensor data for the storage writer instead of waiting for the full display refresh
                 write_sensor_data(channels, light)
 
                 # Only update display at normal FPS
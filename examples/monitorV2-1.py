@@ -1,13 +1,12 @@
 import time
 import lgpio as GPIO
 import logging
+from threading import Thread
 from PIL import Image, ImageDraw, ImageFont
 import ST7735
 
-# Update moisture sensor pins to match the correct pinout
-MOISTURE_1_PIN = 23  # GPIO 23 (Pin 16) - Moisture 1
-MOISTURE_2_PIN = 8   # GPIO 8  (Pin 24) - Moisture 2
-MOISTURE_3_PIN = 25  # GPIO 25 (Pin 22) - Moisture 3
+from grow.gpio import get_backend
+from grow.moisture import Moisture
 
 # Button pins and labels
 BUTTONS = [5, 6, 16, 24]  # GPIO pins for buttons A, B, X, Y
@@ -38,83 +37,6 @@ sensor_data = {
     'channel3': {'moisture': 0, 'saturation': 0, 'enabled': True},
 }
 
-class Moisture:
-    def __init__(self, channel, gpio_handle):
-        """Create a new moisture sensor instance for a specific channel (1-3)."""
-        self._gpio_pin = [MOISTURE_1_PIN, MOISTURE_2_PIN, MOISTURE_3_PIN][channel - 1]
-        self._history = []
-        self._freq = 0.0
-        self._last_edge = None
-        self._wet_point = 0.7
-        self._dry_point = 26.7
-        self._h = gpio_handle
-        self.active = True
-        
-        logging.info(f"Initializing Moisture sensor {channel} on GPIO {self._gpio_pin}")
-
-        # Configure GPIO - with error handling and cleanup
-        try:
-            # First try to free the GPIO in case it's already claimed
-            try:
-                logging.info(f"Attempting to free GPIO {self._gpio_pin}")
-                GPIO.gpio_free(self._h, self._gpio_pin)
-            except Exception as e:
-                logging.warning(f"Could not free GPIO {self._gpio_pin}: {e}")
-
-            time.sleep(0.1)  # Give system time to release the pin
-
-            # Now claim it as input
-            logging.info(f"Claiming GPIO {self._gpio_pin} as input")
-            GPIO.gpio_claim_input(self._h, self._gpio_pin)
-            
-            # Set up edge detection
-            try:
-                logging.info(f"Setting up edge detection on GPIO {self._gpio_pin}")
-                GPIO.gpio_claim_alert(self._h, self._gpio_pin, GPIO.RISING_EDGE)
-                GPIO.callback(self._h, self._gpio_pin, GPIO.RISING_EDGE, self._event_handler)
-                logging.info(f"Successfully registered callbacks for pin {self._gpio_pin}")
-            except Exception as e:
-                logging.error(f"Failed to register callbacks for pin {self._gpio_pin}: {e}")
-                self.active = False
-                
-        except Exception as e:
-            logging.error(f"Failed to initialize GPIO {self._gpio_pin}: {e}")
-            self.active = False
-            raise
-
-    def _event_handler(self, chip, gpio, level, timestamp):
-        """Handle the GPIO edge event and calculate frequency."""
-        current_time = time.time() * 1000000  # Convert to microseconds
-        logging.debug(f"Edge detected on GPIO {gpio} at {timestamp}")  # Changed to debug level
-
-        if self._last_edge is not None:
-            delta = current_time - self._last_edge
-            if delta > 0:
-                self._freq = 1000000.0 / delta  # Convert from microseconds to Hz
-                self._history.append(self.saturation)
-                if len(self._history) > 96:  # Maintain 96 samples
-                    self._history.pop(0)
-        
-        self._last_edge = current_time
-
-    @property
-    def moisture(self):
-        """Return the current moisture frequency in Hz."""
-        if self._last_edge is None or (time.time() * 1000000 - self._last_edge) > 1000000:  # 1 second timeout
-            self._freq = 0
-        return self._freq
-
-    @property
-    def saturation(self):
-        """Return the current saturation as float 0.0 to 1.0."""
-        moisture = self.moisture
-        if moisture == 0:
-            return 0.0
-        zero = self._dry_point
-        span = self._wet_point - self._dry_point
-        moisture = (moisture - zero) / span
-        return max(0.0, min(1.0, moisture))
-
 def handle_button(chip, gpio, level, timestamp):
     """Handle button presses."""
     index = BUTTONS.index(gpio)
@@ -164,13 +86,12 @@ def update_display():
         time.sleep(1.0)
 
 def main():
-    # Initialize GPIO handle
-    gpio_handle = GPIO.gpiochip_open(0)
+    # The moisture sensors claim their pins through grow's lgpio backend, share its chip handle
+    gpio = get_backend('lgpio')
+    gpio_handle = gpio.handle
 
     # Initialize moisture sensors
-    m1 = Moisture(1, gpio_handle)
-    m2 = Moisture(2, gpio_handle)
-    m3 = Moisture(3, gpio_handle)
+    sensors = [Moisture(channel, wet_point=0.7, dry_point=26.7) for channel in (1, 2, 3)]
 
     # Set up button handlers
     setup_buttons(gpio_handle)
@@ -183,20 +104,16 @@ def main():
     # Main loop to update sensor data
     try:
         while True:
-            sensor_data['channel1']['moisture'] = m1.moisture
-            sensor_data['channel1']['saturation'] = m1.saturation * 100
-
-            sensor_data['channel2']['moisture'] = m2.moisture
-            sensor_data['channel2']['saturation'] = m2.saturation * 100
-
-            sensor_data['channel3']['moisture'] = m3.moisture
-            sensor_data['channel3']['saturation'] = m3.saturation * 100
+            for channel, sensor in enumerate(sensors, start=1):
+                active = sensor.active
+                sensor_data[f'channel{channel}']['moisture'] = sensor.moisture if active else 0
+                sensor_data[f'channel{channel}']['saturation'] = sensor.saturation * 100 if active else 0
 
             time.sleep(1.0)
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
-        GPIO.gpiochip_close(gpio_handle)
+        gpio.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Sensor sampler daemon
+
+Owns the GPIO handle, moisture sensors and light sensor, and publishes their
+readings to shared memory so the monitor and web server can read them without
+sharing an interpreter (and a GIL) with the edge callbacks.
+
+Start it before the monitor, then set "sampler: true" in the general section
+of settings.yml:
+
+    python3 sampler.py [settings.yml]
+"""
+import logging
+import math
+import signal
+import sys
+import time
+from collections import deque
+
+import yaml
+
+from grow.frequency import NO_READING, Reading
+from grow.shared import SharedReadings
+from grow.snapshot import SnapshotPublisher
+
+SAMPLER_NAME = 'grow_sensors'  # Shared memory block the readings are published to
+SAMPLER_INTERVAL = 0.1  # Seconds between published readings
+SAMPLER_CAPACITY = 600  # Readings kept in the shared ring
+HISTORY_LENGTH = 96  # Saturation history returned by SharedMoisture, as the lgpio driver keeps
+STALE_TIME = 2.0  # Seconds after which readings are treated as missing, eg: the sampler has stopped
+
+
+def sampler_fields(channels=3):
+    channels = range(1, channels + 1)
+    return (['timestamp', 'lux', 'proximity'] + [f'channel{channel}_moisture' for channel in channels] +
+            [f'channel{channel}_sequence' for channel in channels])
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+class SharedMoisture(SnapshotPublisher):
+    """Moisture sensor stand-in reading from the sampler's shared memory
+
+    The sampler writes every SAMPLER_INTERVAL, far more often than a sensor takes a
+    reading, so each write carries the driver's snapshot sequence alongside its
+    moisture. A new snapshot is only published, and a reading only added to the
+    history, when that sequence changes.
+    """
+
+    def __init__(self, readings, channel):
+        self._readings = readings
+        self._index = readings.fields.index(f'channel{channel}_moisture')
+        self._sequence_index = readings.fields.index(f'channel{channel}_sequence')
+        self._wet_point = 0.7
+        self._dry_point = 26.7
+        self._key = None
+        self._sequence = None
+        self._history = deque(maxlen=HISTORY_LENGTH)  # Moisture of distinct readings, newest first
+
+    def set_wet_point(self, freq):
+        self._wet_point = freq
+        self._key = None
+
+    def set_dry_point(self, freq):
+        self._dry_point = freq
+        self._key = None
+
+    def snapshot(self):
+        """Publish a new snapshot whenever the sensor has taken a reading, or the sampler has stopped"""
+        record = self._readings.latest()
+        stale = record is None or time.time() - record[0] > STALE_TIME
+        sequence = None if record is None else _optional(record[self._sequence_index])
+        key = (sequence, stale)
+        if key != self._key:
+            self._key = key
+            if sequence is not None and sequence != self._sequence:
+                self._add_readings()
+            moisture = 0.0 if stale or sequence is None else record[self._index]
+            self._publish(lambda: (moisture, self._saturation(moisture), moisture > 0,
+                                   Reading(moisture, moisture, moisture, 0) if moisture > 0 else NO_READING,
+                                   [self._saturation(value) for value in self._history]))
+        return self._snapshot
+
+    def _add_readings(self):
+        """Add the readings taken since the last one seen to the history, once each"""
+        readings = []
+        newest = previous = None
+        for record in reversed(self._readings.history()):
+            sequence = _optional(record[self._sequence_index])
+            if sequence is None or sequence == self._sequence:
+                break
+            if previous is not None and sequence > previous:
+                break  # Written before the sampler restarted
+            if sequence != previous and record[self._index] > 0:
+                readings.append(record[self._index])
+            newest = sequence if newest is None else newest
+            previous = sequence
+        self._history.extendleft(reversed(readings))
+        if newest is not None:
+            self._sequence = newest
+
+    def set_window(self, edges):
+        """Sampling is configured in the sampler process"""
+        pass
+
+    def set_mode(self, mode, gate=None):
+        """Sampling is configured in the sampler process"""
+        pass
+
+    def set_precision(self, precision, max_gate=None):
+        """Sampling is configured in the sampler process"""
+        pass
+
+    def _latest(self):
+        record = self._readings.latest()
+        if record is None or time.time() - record[0] > STALE_TIME or math.isnan(record[self._index]):
+            return None
+        return record[self._index]
+
+    @property
+    def active(self):
+        return self._latest() is not None
+
+    @property
+    def moisture(self):
+        moisture = self._latest()
+        return moisture if moisture is not None else 0.0
+
+    def _saturation(self, moisture):
+        if moisture == 0:
+            return 0.0
+        return max(0.0, min(1.0, (moisture - self._dry_point) / (self._wet_point - self._dry_point)))
+
+    @property
+    def saturation(self):
+        return self._saturation(self.moisture)
+
+    @property
+    def history(self):
+        return self.snapshot().history
+
+
+class SharedLight:
+    """Light sensor stand-in reading from the sampler's shared memory"""
+
+    def __init__(self, readings):
+        self._readings = readings
+
+    def get_lux(self):
+        record = self._readings.latest()
+        return record[1] if record else 0.0
+
+    def get_proximity(self):
+        record = self._readings.latest()
+        return record[2] if record else 0.0
+
+
+def main():
+    import ltr559
+    from grow.frequency import DEFAULT_PRECISION
+    from grow.gpio import get_backend
+    from lgpio_moisture import Moisture, EDGE_WINDOW, GATE_TIME, MAX_GATE, MODE_EDGES
+
+    settings_file = sys.argv[1] if len(sys.argv) > 1 else 'settings.yml'
+    try:
+        with open(settings_file) as f:
+            general = (yaml.safe_load(f) or {}).get('general', {})
+    except FileNotFoundError:
+        general = {}
+
+    gpio = get_backend('lgpio')
+    h = gpio.handle
+    sensors = []
+    for channel in range(1, 4):
+        try:
+            sensor = Moisture(channel, h, window=general.get('moisture_window', EDGE_WINDOW),
+                              mode=general.get('moisture_mode', MODE_EDGES), gate=general.get('moisture_gate', GATE_TIME),
+                              precision=general.get('moisture_precision', DEFAULT_PRECISION),
+                              max_gate=general.get('moisture_max_gate', MAX_GATE))
+            sensors.append(sensor if sensor.active else None)
+        except Exception as e:
+            logging.error(f"Failed to initialize moisture sensor {channel}: {e}")
+            sensors.append(None)
+
+    try:
+        light = ltr559.LTR559()
+    except Exception as e:
+        logging.error(f"Light sensor initialization failed: {e}")
+        light = None
+
+    readings = SharedReadings(SAMPLER_NAME, sampler_fields(len(sensors)), SAMPLER_CAPACITY)
+    interval = general.get('sampler_interval', SAMPLER_INTERVAL)
+    running = [True]
+
+    def stop(signum, frame):
+        running[0] = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logging.info(f"Publishing readings to shared memory '{SAMPLER_NAME}' every {interval}s")
+
+    try:
+        while running[0]:
+            try:
+                lux, proximity = (light.get_lux(), light.get_proximity()) if light else (0.0, 0.0)
+            except Exception as e:
+                logging.error(f"Light sensor read error: {e}")
+                lux = proximity = 0.0
+            # NaN marks a channel without a working sensor. Each snapshot's sequence is written
+            # with its moisture, so readers can tell a new reading from the same one written again
+            snapshots = [sensor.snapshot() if sensor else None for sensor in sensors]
+            readings.write([time.time(), lux, proximity] +
+                           [snapshot.moisture if snapshot else float('nan') for snapshot in snapshots] +
+                           [float(snapshot.sequence) if snapshot else float('nan') for snapshot in snapshots])
+            time.sleep(interval)
+    finally:
+        readings.close()
+        gpio.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
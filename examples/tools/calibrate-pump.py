@@ -1,11 +1,17 @@
+import json
 import logging
+import pathlib
+import sys
+import threading
 import time
 
 import RPi.GPIO as GPIO
 import ST7735
 from fonts.ttf import RobotoMedium as UserFont
+import yaml
 from PIL import Image, ImageDraw, ImageFont
 
+from grow.flow import FlowModel, Run
 from grow.moisture import Moisture
 from grow.pump import Pump
 
@@ -21,6 +27,16 @@ A = Test settings
 B = Select setting to change
 X = Decrease value
 Y = Increase value
+
+Each test dose is also a pump calibration run: catch the water it delivers, measure
+it and type the ml in here. Runs are logged to pump-runs.jsonl and, after each one,
+a flow model is fitted to all of the channel's runs. Test a few different times and
+speeds for a good fit. When you exit, the model is saved to the channel's flow_model
+in settings.yml, letting monitor.py dose by volume with pump_volume.
+
+To refit from the logged runs, without any hardware, run:
+
+    python3 calibrate-pump.py fit
 """
 
 # Channel settings
@@ -36,6 +52,66 @@ dose_time = 0.96  # Time (in seconds) for water dose
 FPS = 15  # Display framerate
 NUM_SAMPLES = 10  # Number of saturation level samples to average over
 DOSE_FREQUENCY = 30.0  # Minimum time between automatic waterings (in seconds)
+RUNS_FILE = pathlib.Path(__file__).parent / "pump-runs.jsonl"
+SETTINGS_FILE = pathlib.Path(__file__).parent.parent / "settings.yml"
+
+
+def load_runs(channel):
+    """Return the logged calibration runs for a pump channel"""
+    runs = []
+    if RUNS_FILE.is_file():
+        with open(RUNS_FILE) as f:
+            for line in f:
+                run = json.loads(line)
+                if run["channel"] == channel:
+                    runs.append(Run(run["speed"], run["seconds"], run["volume"]))
+    return runs
+
+
+def log_run(channel, run):
+    with open(RUNS_FILE, "a") as f:
+        f.write(json.dumps({"channel": channel, "time": time.time(), **run._asdict()}) + "\n")
+
+
+def fit_runs(channel):
+    """Fit a flow model to a channel's logged runs, returns None if there are none"""
+    runs = load_runs(channel)
+    if not runs:
+        return None
+    try:
+        model = FlowModel.fit(runs)
+    except ValueError as e:
+        logging.warning("Can't fit a flow model yet: {}".format(e))
+        return None
+    logging.info("Fitted {} from {} runs, {:.2f} ml/s at speed {:.2f}".format(
+        model, len(runs), model.flow_rate(model.speed), model.speed))
+    return model
+
+
+def save_flow_model(channel, model):
+    """Store a flow model in the channel's settings"""
+    settings = {}
+    if SETTINGS_FILE.is_file():
+        with open(SETTINGS_FILE) as f:
+            settings = yaml.safe_load(f) or {}
+    settings.setdefault("channel{}".format(channel), {})["flow_model"] = model.to_config()
+    with open(SETTINGS_FILE, "w") as f:
+        yaml.dump(settings, f, default_flow_style=False)
+    logging.info("Saved flow model for channel {} to {}".format(channel, SETTINGS_FILE))
+
+
+logging.basicConfig(
+    format="%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s",
+    level=logging.INFO,
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+if len(sys.argv) > 1 and sys.argv[1] == "fit":
+    flow_model = fit_runs(pump_channel)
+    if flow_model is None:
+        sys.exit("No calibration runs logged for channel {}".format(pump_channel))
+    save_flow_model(pump_channel, flow_model)
+    sys.exit(0)
 
 BUTTONS = [5, 6, 16, 24]
 LABELS = ["A", "B", "X", "Y"]
@@ -49,6 +125,8 @@ GPIO.setup(BUTTONS, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
 mode = 0
 last_dose = time.time()
+last_run = None  # (speed, seconds) of the last test dose, waiting for its volume
+flow_model = fit_runs(pump_channel)
 saturation = [1.0 for _ in range(NUM_SAMPLES)]
 
 display = ST7735.ST7735(
@@ -61,12 +139,6 @@ font = ImageFont.truetype(UserFont, 12)
 image = Image.new("RGBA", (display.width, display.height), color=(0, 0, 0))
 draw = ImageDraw.Draw(image)
 
-logging.basicConfig(
-    format="%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s",
-    level=logging.INFO,
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
 
 def handle_button(pin):
     global mode, last_dose, dose_time, dose_speed, dry_level
@@ -74,7 +146,7 @@ def handle_button(pin):
     label = LABELS[index]
     if label == "A":  # Test
         logging.info("Manual watering triggered.")
-        p.dose(dose_speed, dose_time, blocking=False)
+        p.dose(dose_speed, dose_time, blocking=False, source="calibrate").add_done_callback(test_done)
         last_dose = time.time()
 
     if label == "B":  # Switch setting
@@ -104,6 +176,34 @@ def handle_button(pin):
             logging.info("Dry level decreased to: {:.2f}".format(dry_level))
 
 
+def test_done(dose):
+    global last_run
+    if dose.cancelled() or dose.exception() is not None:
+        return
+    last_run = (dose.speed, dose.result())
+    logging.info("Test dose ran for {:.3f}s at speed {:.2f}, enter the ml delivered:".format(
+        last_run[1], last_run[0]))
+
+
+def read_volumes():
+    """Record the ml typed in for each test dose as a calibration run, and refit"""
+    global last_run, flow_model
+    for line in sys.stdin:
+        try:
+            volume = float(line)
+        except ValueError:
+            logging.warning("Enter the ml the last test dose delivered")
+            continue
+        if last_run is None:
+            logging.warning("Run a test dose (A) first")
+            continue
+        log_run(pump_channel, Run(last_run[0], last_run[1], volume))
+        last_run = None
+        flow_model = fit_runs(pump_channel) or flow_model
+
+
+threading.Thread(target=read_volumes, daemon=True).start()
+
 # Bind the button handler (above) to all buttons
 for pin in BUTTONS:
     GPIO.add_event_detect(pin, GPIO.FALLING, handle_button, bouncetime=150)
@@ -174,6 +274,14 @@ try:
             fill=(255, 255, 255) if mode == 2 else (128, 128, 128),
         )
 
+        if flow_model is not None:
+            draw.text(
+                (5 + display.width // 2, 48),
+                "{:.1f} ml/s".format(flow_model.flow_rate(dose_speed)),
+                font=font,
+                fill=(128, 128, 128),
+            )
+
         # Button label backgrounds
         draw.rectangle((0, 0, 42, 14), (255, 255, 255))
         draw.rectangle((display.width - 15, 0, display.width, 14), (255, 255, 255))
@@ -200,3 +308,5 @@ except KeyboardInterrupt:
             dose_time, dose_speed, dry_level
         )
     )
+    if flow_model is not None:
+        save_flow_model(pump_channel, flow_model)
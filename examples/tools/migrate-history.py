@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+import sys
+
+from grow.migrate import Migration
+
+"""
+Convert JSON sensor history from older versions of the monitor.
+
+Run from the monitor's directory, with the monitor stopped:
+
+    python3 tools/migrate-history.py
+
+The sensor_history/YYYY/MM/*.json day files are converted to compressed
+columnar archives alongside them and indexed, and sensor_data.json becomes
+the sensor_data.bin ring log. The JSON files are left untouched.
+
+Days that already have an archive, written by the new monitor, are merged
+with the JSON rather than replaced. An existing sensor_data.bin is only
+replaced with --force.
+
+Progress is checkpointed after every file, if the migration is interrupted
+just run it again and it carries on from where it stopped.
+"""
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+parser = argparse.ArgumentParser(description="Migrate JSON sensor history to the binary formats")
+parser.add_argument('--history-dir', default='sensor_history', help="JSON day files to convert")
+parser.add_argument('--output-dir', default=None, help="Archive tree to write, defaults to --history-dir")
+parser.add_argument('--sensor-json', default='sensor_data.json', help="Live JSON file to convert")
+parser.add_argument('--sensor-log', default='sensor_data.bin', help="Ring log to create from --sensor-json")
+parser.add_argument('--channels', type=int, default=3, help="Number of moisture channels")
+parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to one per CPU")
+parser.add_argument('--compression', choices=['none', 'zlib', 'lzma'], default='zlib')
+parser.add_argument('--encoding', choices=['plain', 'gorilla'], default='plain')
+parser.add_argument('--force', action='store_true', help="Replace an existing --sensor-log")
+args = parser.parse_args()
+
+migration = Migration(args.history_dir, args.output_dir, args.channels, args.compression, args.encoding)
+
+convert_sensor_json = os.path.exists(args.sensor_json) and migration.checkpoint['sensor_log'] is None
+if convert_sensor_json and os.path.exists(args.sensor_log) and not args.force:
+    logging.error(f"{args.sensor_log} already exists, it holds readings from the new monitor. "
+                  f"Run with --force to replace it with {args.sensor_json}")
+    sys.exit(1)
+
+pending = migration.pending()
+logging.info(f"{len(pending)} day files to convert")
+
+
+def progress(day, entry):
+    logging.info(f"{day}: {entry['records']} records -> {entry['file']}")
+
+
+migration.run_days(args.workers, progress)
+
+if os.path.exists(args.sensor_json):
+    if convert_sensor_json and os.path.exists(args.sensor_log):
+        logging.warning(f"{args.sensor_log} already exists and will be replaced")
+    count = migration.run_sensor_log(args.sensor_json, args.sensor_log)
+    if count is None:
+        logging.info(f"{args.sensor_json} was already converted")
+    else:
+        logging.info(f"{args.sensor_json}: {count} records -> {args.sensor_log}")
+
+logging.info("Migration complete")
@@ -1,19 +1,19 @@
 __version__ = '0.0.2'
 
 import atexit
-import threading
 import time
 
-import RPi.GPIO as GPIO
+from .gpio import get_backend
+from .scheduler import get_scheduler
 
 
 class Piezo():
     def __init__(self, gpio_pin=13):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(gpio_pin, GPIO.OUT, initial=GPIO.LOW)
-        self.pwm = GPIO.PWM(gpio_pin, 440)
+        gpio = get_backend()
+        gpio.setup_output(gpio_pin, 0)
+        self.pwm = gpio.pwm(gpio_pin, 440)
         self.pwm.start(0)
+        self._scheduler = get_scheduler()
         self._timeout = None
         atexit.register(self._exit)
 
@@ -23,7 +23,7 @@ class Piezo():
         Loosely corresponds to musical pitch, if you suspend disbelief.
 
         """
-        self.pwm.ChangeFrequency(value)
+        self.pwm.set_frequency(value)
 
     def start(self, frequency=None):
         """Start the piezo.
@@ -33,7 +33,7 @@ class Piezo():
         """
         if frequency is not None:
             self.frequency(frequency)
-        self.pwm.ChangeDutyCycle(1)
+        self.pwm.set_duty(1)
 
     def stop(self):
         """Stop the piezo.
@@ -41,7 +41,7 @@ class Piezo():
         Sets the Duty Cycle to 0%
 
         """
-        self.pwm.ChangeDutyCycle(0)
+        self.pwm.set_duty(0)
 
     def beep(self, frequency=440, timeout=0.1, blocking=True, force=False):
         """Beep the piezo for time seconds.
@@ -57,16 +57,27 @@ class Piezo():
             self.stop()
             return True
         else:
-            if self._timeout is not None:
-                if self._timeout.is_alive():
-                    if force:
-                        self._timeout.cancel()
-                    else:
-                        return False
-            self._timeout = threading.Timer(timeout, self.stop)
+            if self._timeout is not None and self._timeout.pending and not force:
+                return False
             self.start(frequency=frequency)
-            self._timeout.start()
+            self._timeout = self._scheduler.call_later(timeout, self.stop, key=self, replace=True)
             return True
 
+    def beeps(self, frequency=440, timeout=0.1, count=3, interval=0.3):
+        """Beep the piezo count times without blocking, replacing any beeps still pending.
+
+        :param frequency: Frequency, in hertz, of the piezo
+        :param timeout: Time, in seconds, of each beep
+        :param count: Number of beeps
+        :param interval: Time, in seconds, from the start of one beep to the start of the next
+
+        """
+        self._scheduler.cancel_key(self)
+        self.start(frequency=frequency)
+        for beep in range(count):
+            if beep > 0:
+                self._scheduler.call_later(beep * interval, self.start, frequency, key=self)
+            self._timeout = self._scheduler.call_later(beep * interval + timeout, self.stop, key=self)
+
     def _exit(self):
         self.pwm.stop()
@@ -0,0 +1,444 @@
+"""Compressed, columnar daily archives of sensor history.
+
+An archive file is a short header naming its fields followed by any number
+of chunks. Each chunk stores its rows column by column, each column
+compressed on its own, with a table of column sizes up front. Appending
+writes a new chunk to the end of the file and never rewrites existing data,
+and a single column can be read by skipping over the others unread.
+
+Timestamps are stored as millisecond deltas, which compress to almost
+nothing for regularly sampled data.
+
+An ArchiveIndex kept alongside the tree records each day's file, record
+count, time span and per-field min/max, so range queries only open the
+files they need and summaries open none.
+
+"""
+import array
+import datetime
+import json
+import lzma
+import math
+import os
+import struct
+import sys
+import zlib
+
+from . import gorilla
+
+MAGIC = b'GRWA'
+CHUNK_MAGIC = b'CHNK'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHI')  # magic, version, field count, names length
+_CHUNK = struct.Struct('<4sI')  # magic, rows
+_COLUMN = struct.Struct('<BBI')  # compression, encoding, size
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+ENCODING_FLOAT = 0
+ENCODING_DELTA_MS = 1
+ENCODING_GORILLA_TIME = 2
+ENCODING_GORILLA_FLOAT = 3
+
+# Column encodings for (timestamp, other) columns
+ENCODINGS = {
+    'plain': (ENCODING_DELTA_MS, ENCODING_FLOAT),
+    'gorilla': (ENCODING_GORILLA_TIME, ENCODING_GORILLA_FLOAT),
+}
+
+INDEX_FILE = 'index.json'
+
+COMPRESSION = {
+    'none': COMPRESSION_NONE,
+    'zlib': COMPRESSION_ZLIB,
+    'lzma': COMPRESSION_LZMA,
+}
+
+_COMPRESS = {
+    COMPRESSION_NONE: bytes,
+    COMPRESSION_ZLIB: lambda data: zlib.compress(data, 9),
+    COMPRESSION_LZMA: lzma.compress,
+}
+
+_DECOMPRESS = {
+    COMPRESSION_NONE: bytes,
+    COMPRESSION_ZLIB: zlib.decompress,
+    COMPRESSION_LZMA: lzma.decompress,
+}
+
+
+def archive_path(directory, day):
+    """Return the archive file for a day, eg: sensor_history/2024/05/sensor_data_2024-05-01.col
+
+    :param directory: Root of the archive tree
+    :param day: datetime.date of the day
+
+    """
+    return os.path.join(str(directory), str(day.year), '{:02d}'.format(day.month),
+                        'sensor_data_{}.col'.format(day.isoformat()))
+
+
+def _to_bytes(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_column(values, encoding):
+    """Pack a column of floats into bytes ready for compression."""
+    if encoding == ENCODING_GORILLA_TIME:
+        return gorilla.encode_timestamps(values)
+    if encoding == ENCODING_GORILLA_FLOAT:
+        return gorilla.encode_floats(values)
+    if encoding == ENCODING_DELTA_MS:
+        last = 0
+        deltas = array.array('q')
+        for value in values:
+            value = int(round(value * 1000))
+            deltas.append(value - last)
+            last = value
+        return _to_bytes(deltas)
+    return _to_bytes(array.array('d', values))
+
+
+def decode_column(data, encoding):
+    """Unpack bytes produced by encode_column back into a list of floats."""
+    if encoding == ENCODING_GORILLA_TIME:
+        return gorilla.decode_timestamps(data)
+    if encoding == ENCODING_GORILLA_FLOAT:
+        return gorilla.decode_floats(data)
+    if encoding == ENCODING_DELTA_MS:
+        total = 0
+        values = []
+        for delta in _from_bytes('q', data):
+            total += delta
+            values.append(total / 1000.0)
+        return values
+    return _from_bytes('d', data).tolist()
+
+
+def _read_header(path, file):
+    header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError("{} is not an archive".format(path))
+    magic, version, field_count, names_length = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("{} is not an archive".format(path))
+    if version != VERSION:
+        raise ValueError("{} has unsupported version {}".format(path, version))
+    return file.read(names_length).decode('utf-8').split('\n')[:field_count]
+
+
+def _scan(file, field_count):
+    """Yield (offset, rows, columns) for each complete chunk, columns being (compression, encoding, offset, size)."""
+    table_size = _CHUNK.size + _COLUMN.size * field_count
+    end = os.fstat(file.fileno()).st_size
+    offset = file.tell()
+
+    while offset + table_size <= end:
+        file.seek(offset)
+        magic, rows = _CHUNK.unpack(file.read(_CHUNK.size))
+        if magic != CHUNK_MAGIC:
+            break
+
+        columns = []
+        position = offset + table_size
+        for compression, encoding, size in _COLUMN.iter_unpack(file.read(_COLUMN.size * field_count)):
+            columns.append((compression, encoding, position, size))
+            position += size
+
+        if position > end:
+            break  # Chunk cut short by a crash mid-append
+
+        yield offset, rows, columns
+        offset = position
+
+
+class ArchiveWriter(object):
+    """Append-only writer for a columnar archive."""
+
+    def __init__(self, path, fields, compression='zlib', encoding='plain'):
+        """Open or create an archive for appending.
+
+        A chunk left incomplete by an interrupted append is discarded. Chunks
+        record their own compression and encoding, so both can be changed
+        between appends.
+
+        :param path: File to store the archive in, parent directories are created if needed
+        :param fields: List of column names, the "timestamp" column is delta encoded
+        :param compression: One of "none", "zlib" or "lzma"
+        :param encoding: "plain" for millisecond deltas and raw floats, or "gorilla"
+            for delta-of-delta timestamps and XOR floats, which is compact without compression
+
+        """
+        self.path = str(path)
+        self.fields = list(fields)
+        self.compression = COMPRESSION[compression]
+        time_encoding, float_encoding = ENCODINGS[encoding]
+        self._encodings = [time_encoding if name == 'timestamp' else float_encoding for name in self.fields]
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self._file = open(self.path, 'r+b')
+            fields = _read_header(self.path, self._file)
+            if fields != self.fields:
+                self._file.close()
+                raise ValueError("{} has fields {}, expected {}".format(self.path, fields, self.fields))
+            end = self._file.tell()
+            for _, _, columns in _scan(self._file, len(self.fields)):
+                end = columns[-1][2] + columns[-1][3]
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            names = '\n'.join(self.fields).encode('utf-8')
+            self._file = open(self.path, 'w+b')
+            self._file.write(_HEADER.pack(MAGIC, VERSION, len(self.fields), len(names)))
+            self._file.write(names)
+
+    def append(self, records):
+        """Append records as a new chunk.
+
+        :param records: Sequence of records, each a sequence of floats in field order
+
+        """
+        if not records:
+            return
+
+        columns = zip(*records)
+        blobs = []
+        for values, encoding in zip(columns, self._encodings):
+            blobs.append((encoding, _COMPRESS[self.compression](encode_column(values, encoding))))
+
+        chunk = [_CHUNK.pack(CHUNK_MAGIC, len(records))]
+        chunk += [_COLUMN.pack(self.compression, encoding, len(blob)) for encoding, blob in blobs]
+        chunk += [blob for _, blob in blobs]
+        self._file.write(b''.join(chunk))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Archive(object):
+    """Reader for a columnar archive."""
+
+    def __init__(self, path):
+        """Open an archive for reading.
+
+        :param path: File the archive is stored in
+
+        """
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        self.fields = _read_header(self.path, self._file)
+        self._index = dict((name, i) for i, name in enumerate(self.fields))
+        self._chunks = [(rows, columns) for _, rows, columns in _scan(self._file, len(self.fields))]
+
+    def __len__(self):
+        return sum(rows for rows, _ in self._chunks)
+
+    @property
+    def chunks(self):
+        """Return the number of rows in each chunk."""
+        return [rows for rows, _ in self._chunks]
+
+    def _column(self, columns, index):
+        compression, encoding, offset, size = columns[index]
+        self._file.seek(offset)
+        return decode_column(_DECOMPRESS[compression](self._file.read(size)), encoding)
+
+    def column(self, name):
+        """Return every value of one column, leaving the other columns compressed and unread."""
+        index = self._index[name]
+        values = []
+        for _, columns in self._chunks:
+            values += self._column(columns, index)
+        return values
+
+    def columns(self, names=None):
+        """Return a dictionary of the named columns, defaulting to all of them."""
+        names = self.fields if names is None else names
+        return dict((name, self.column(name)) for name in names)
+
+    def records(self):
+        """Yield every row as a tuple in field order."""
+        for _, columns in self._chunks:
+            for record in zip(*[self._column(columns, index) for index in range(len(self.fields))]):
+                yield record
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def merge_stats(entry, fields, records):
+    """Fold records into a day's index entry."""
+    if not records:
+        return entry
+    entry['records'] += len(records)
+
+    timestamps = [record[0] for record in records]
+    entry['first'] = min([entry['first']] + timestamps) if entry['first'] is not None else min(timestamps)
+    entry['last'] = max([entry['last']] + timestamps) if entry['last'] is not None else max(timestamps)
+
+    for index, name in enumerate(fields):
+        if name == 'timestamp':
+            continue
+        values = [record[index] for record in records if not math.isnan(record[index])]
+        if not values:
+            continue
+        low, high = entry['min'].get(name), entry['max'].get(name)
+        entry['min'][name] = min(values) if low is None else min(low, min(values))
+        entry['max'][name] = max(values) if high is None else max(high, max(values))
+
+    return entry
+
+
+class ArchiveIndex(object):
+    """Day by day summary of an archive tree, kept in a small JSON file at its root."""
+
+    def __init__(self, directory, filename=INDEX_FILE):
+        """Load the index for an archive tree, if one exists.
+
+        :param directory: Root of the archive tree
+        :param filename: Name of the index file within the tree
+
+        """
+        self.directory = str(directory)
+        self.path = os.path.join(self.directory, filename)
+        self.days = {}
+        self._mtime = None
+        self.refresh()
+
+    def refresh(self):
+        """Reload the index if another handle has saved it since it was last read."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self.path, 'r') as f:
+                self.days = json.load(f)['days']
+            self._mtime = mtime
+
+    def save(self):
+        """Write the index, replacing the old one atomically."""
+        os.makedirs(self.directory, exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'days': self.days}, f, indent=1, sort_keys=True)
+        os.replace(temp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def add(self, day, path, fields, records):
+        """Update a day's entry with records just appended to its archive, then save.
+
+        :param day: datetime.date the records belong to
+        :param path: Archive file the records were written to
+        :param fields: Field names of the records
+        :param records: The records appended
+
+        """
+        entry = self.days.get(day.isoformat())
+        if entry is None:
+            entry = {'file': os.path.relpath(str(path), self.directory), 'records': 0,
+                     'first': None, 'last': None, 'min': {}, 'max': {}}
+        self.days[day.isoformat()] = merge_stats(entry, fields, records)
+        self.save()
+
+    def rebuild(self):
+        """Recreate the index from scratch by reading every archive in the tree."""
+        days = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in sorted(files):
+                if not (filename.startswith('sensor_data_') and filename.endswith('.col')):
+                    continue
+                path = os.path.join(root, filename)
+                day = filename[len('sensor_data_'):-len('.col')]
+                with Archive(path) as archive:
+                    entry = {'file': os.path.relpath(path, self.directory), 'records': 0,
+                             'first': None, 'last': None, 'min': {}, 'max': {}}
+                    days[day] = merge_stats(entry, archive.fields, list(archive.records()))
+        self.days = days
+        self.save()
+
+    def entries(self, start_time=None, stop_time=None):
+        """Return (day, entry) pairs, in date order, for days overlapping a time range."""
+        self.refresh()
+        entries = []
+        for day in sorted(self.days):
+            entry = self.days[day]
+            if entry['first'] is None:
+                continue
+            if start_time is not None and entry['last'] < start_time:
+                continue
+            if stop_time is not None and entry['first'] >= stop_time:
+                continue
+            entries.append((datetime.date.fromisoformat(day), entry))
+        return entries
+
+    def files(self, start_time=None, stop_time=None):
+        """Return the archive files holding records within a time range."""
+        return [os.path.join(self.directory, entry['file']) for _, entry in self.entries(start_time, stop_time)]
+
+    def summary(self, start_time=None, stop_time=None):
+        """Summarise the days overlapping a time range without opening any archives.
+
+        Whole days are summarised, so min/max may include records just outside the range.
+
+        """
+        summary = {'days': 0, 'records': 0, 'first': None, 'last': None, 'min': {}, 'max': {}}
+        for _, entry in self.entries(start_time, stop_time):
+            summary['days'] += 1
+            summary['records'] += entry['records']
+            summary['first'] = entry['first'] if summary['first'] is None else min(summary['first'], entry['first'])
+            summary['last'] = entry['last'] if summary['last'] is None else max(summary['last'], entry['last'])
+            for name, value in entry['min'].items():
+                summary['min'][name] = min(summary['min'].get(name, value), value)
+            for name, value in entry['max'].items():
+                summary['max'][name] = max(summary['max'].get(name, value), value)
+        return summary
+
+    def columns(self, start_time=None, stop_time=None, fields=None):
+        """Read columns for a time range, opening only the archives that overlap it.
+
+        :param fields: Field names to return, defaults to every field. Timestamps are always read.
+
+        """
+        result = None
+        for path in self.files(start_time, stop_time):
+            with Archive(path) as archive:
+                names = archive.fields if fields is None else list(fields)
+                if result is None:
+                    result = dict((name, []) for name in names)
+                timestamps = archive.column('timestamp')
+                keep = [i for i, ts in enumerate(timestamps)
+                        if (start_time is None or ts >= start_time) and (stop_time is None or ts < stop_time)]
+                for name in names:
+                    values = timestamps if name == 'timestamp' else archive.column(name)
+                    result[name] += [values[i] for i in keep]
+        return result if result is not None else dict((name, []) for name in (fields or []))
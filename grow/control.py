@@ -0,0 +1,221 @@
+"""Closed loop watering control.
+
+A fixed dose every time the soil dries past a level keeps pulsing water in
+until the sensor sees it, and the sensor is slow to see it: water takes
+minutes to soak through to the probe. WateringController instead sizes each
+dose from how far the soil is from its target, and keeps track of the water
+still soaking in so it doesn't dose again for dryness that is already fixed.
+
+Watering starts when saturation falls below level and stops once it reaches
+level + hysteresis, the target. While watering, each dose is::
+
+    dose = kp * error + ki * integral(error) + kd * drying rate
+
+where error is the target less the predicted saturation, the measured
+saturation plus the rise still expected from recent doses. Each dose is
+expected to raise saturation by response per unit dose, arriving over
+soak_time seconds (an exponential lag with that time constant).
+
+Doses are in units of the channel's normal dose, pump_time seconds or
+pump_volume ml, so tuning carries across channels and pumps. The integral,
+in error hours, only builds while nothing is soaking in, is limited to
+integral_limit doses and is cleared once the target is reached, so it can't
+wind up while waiting for the sensor.
+
+Each channel can be tuned in its settings, every value is optional::
+
+    controller:
+      kp: 10.0
+      ki: 2.0
+      kd: 0.0
+      hysteresis: 0.05
+      soak_time: 300
+      response: 0.1
+      min_dose: 0.2
+      max_dose: 3.0
+      integral_limit: 2.0
+
+"""
+import math
+import time
+
+MAX_STEP = 60.0  # Longest gap, in seconds, integrated between two updates
+SLOPE_TIME = 600.0  # Time constant, in seconds, of the smoothing of the drying rate used by the derivative term
+SOAKED = 0.01  # Expected rise still to arrive, below which the soil is treated as soaked
+
+IDLE = 'idle'
+WATERING = 'watering'
+
+
+class WateringController(object):
+    """Size doses to bring soil saturation up to a target."""
+
+    def __init__(self, level, kp=10.0, ki=2.0, kd=0.0, hysteresis=0.05, soak_time=300.0, response=0.1,
+                 min_dose=0.2, max_dose=3.0, integral_limit=2.0):
+        """Create a watering controller.
+
+        :param level: Saturation, from 0.0 to 1.0, below which watering starts
+        :param kp: Doses per unit of saturation error
+        :param ki: Doses per unit of saturation error per hour
+        :param kd: Doses per unit of saturation lost per hour
+        :param hysteresis: Saturation above level that watering continues up to
+        :param soak_time: Seconds for a dose to soak through to the sensor
+        :param response: Expected rise in saturation per dose
+        :param min_dose: Smallest dose worth giving, smaller doses are skipped
+        :param max_dose: Largest single dose
+        :param integral_limit: Largest dose the integral term can add
+
+        """
+        if soak_time <= 0:
+            raise ValueError("Soak time must be greater than 0")
+        if response <= 0:
+            raise ValueError("Response must be greater than 0")
+        if min_dose > max_dose:
+            raise ValueError("Minimum dose must not be more than the maximum dose")
+
+        self.level = level
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.hysteresis = hysteresis
+        self.soak_time = soak_time
+        self.response = response
+        self.min_dose = min_dose
+        self.max_dose = max_dose
+        self.integral_limit = integral_limit
+
+        self.state = IDLE
+        self.integral = 0.0
+        self.slope = 0.0
+        self.last_saturation = None
+        self.last_error = 0.0
+        self.last_dose = 0.0
+        self.doses = 0
+        self._soaking = []  # (time, expected rise) of recent doses
+        self._last_update = None
+
+    @classmethod
+    def from_config(cls, level, config, previous=None):
+        """Create a controller from a channel's controller settings, which may be None.
+
+        :param level: Saturation below which watering starts
+        :param config: Dictionary of keyword arguments, eg: the channel's "controller" settings
+        :param previous: Optional controller being retuned, whose doses still soaking in,
+            integral and drying rate carry over so a settings change doesn't trigger a dose
+
+        """
+        controller = cls(level, **(config or {}))
+        if previous is not None:
+            controller.state = previous.state
+            controller.slope = previous.slope
+            controller.last_saturation = previous.last_saturation
+            controller.last_error = previous.last_error
+            controller.last_dose = previous.last_dose
+            controller.doses = previous.doses
+            controller._soaking = list(previous._soaking)
+            controller._last_update = previous._last_update
+            if controller.ki > 0:
+                controller.integral = min(previous.integral * previous.ki / controller.ki,
+                                          controller.integral_limit / controller.ki)
+        return controller
+
+    @property
+    def target(self):
+        return self.level + self.hysteresis
+
+    def pending(self, now=None):
+        """Return the rise in saturation still expected from recent doses."""
+        now = time.time() if now is None else now
+        rise = 0.0
+        soaking = []
+        for when, expected in self._soaking:
+            remaining = expected * math.exp(-(now - when) / self.soak_time)
+            if remaining >= SOAKED / 10:
+                soaking.append((when, expected))
+                rise += remaining
+        self._soaking = soaking
+        return rise
+
+    def update(self, saturation, now=None):
+        """Take a saturation reading and return the dose to give now, 0.0 for none.
+
+        The dose is only expected, not recorded, call dosed() once it is given.
+
+        :param saturation: Current soil saturation, from 0.0 to 1.0
+        :param now: Time of the reading, defaults to now
+
+        """
+        now = time.time() if now is None else now
+        elapsed = 0.0 if self._last_update is None else max(now - self._last_update, 0.0)
+        step = min(elapsed, MAX_STEP)
+        if self.last_saturation is not None and elapsed > 0:
+            # Drying rate, in saturation per hour, positive while the soil dries. Smoothed by
+            # elapsed time, so it doesn't depend on how often readings arrive
+            slope = (self.last_saturation - saturation) * 3600.0 / elapsed
+            self.slope += (1.0 - math.exp(-elapsed / SLOPE_TIME)) * (slope - self.slope)
+        self.last_saturation = saturation
+        self._last_update = now
+
+        pending = self.pending(now)
+        predicted = saturation + pending
+        error = self.target - predicted
+        self.last_error = error
+
+        if saturation >= self.target:
+            self.state = IDLE
+            self.integral = 0.0
+            return 0.0
+        if self.state == IDLE:
+            if predicted >= self.level:
+                return 0.0
+            self.state = WATERING
+
+        if error <= 0:
+            return 0.0
+
+        if pending < SOAKED and self.ki > 0:
+            # Only integrate error the doses so far have had time to fix
+            self.integral += error * step / 3600.0
+            self.integral = min(max(self.integral, 0.0), self.integral_limit / self.ki)
+
+        dose = self.kp * error + self.ki * self.integral + self.kd * max(self.slope, 0.0)
+        dose = min(dose, self.max_dose)
+        if dose < self.min_dose:
+            return 0.0
+        return dose
+
+    def dosed(self, dose, now=None):
+        """Record a dose given, in units of the channel's normal dose.
+
+        Water given any other way, eg: by hand, should be recorded too, so it isn't topped up
+        again while it soaks in.
+
+        """
+        now = time.time() if now is None else now
+        self._soaking.append((now, dose * self.response))
+        self.last_dose = dose
+        self.doses += 1
+
+    def reset(self):
+        """Forget doses soaking in, the integral and the drying rate, eg: after moving the sensor."""
+        self.state = IDLE
+        self.integral = 0.0
+        self.slope = 0.0
+        self.last_saturation = None
+        self._soaking = []
+        self._last_update = None
+
+    def stats(self):
+        """Return a dictionary of the controller's state."""
+        return {
+            'state': self.state,
+            'level': self.level,
+            'target': self.target,
+            'saturation': self.last_saturation,
+            'pending': self.pending(),
+            'error': self.last_error,
+            'integral': self.integral,
+            'slope': self.slope,
+            'last_dose': self.last_dose,
+            'doses': self.doses,
+        }
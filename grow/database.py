@@ -0,0 +1,153 @@
+"""SQLite storage engine for sensor history.
+
+An alternative to the ring log and daily archives for setups that want to
+run ad-hoc SQL over their history. Readings are stored one row per channel
+in a WAL mode database, so readers never block the writer, with an index on
+(channel, ts) for range scans. Old rows are expired with a retention DELETE
+and the freed pages returned with an incremental vacuum.
+
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from .history import CHANNELS, SensorRecords, sensor_fields
+
+DEFAULT_RETENTION = 365 * 24 * 60 * 60
+EXPIRE_INTERVAL = 60 * 60
+VACUUM_PAGES = 1000
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS light (ts REAL PRIMARY KEY, lux REAL, proximity REAL)',
+    'CREATE TABLE IF NOT EXISTS readings ('
+    'channel INTEGER NOT NULL, ts REAL NOT NULL, moisture REAL, alarm INTEGER, enabled INTEGER)',
+    'CREATE INDEX IF NOT EXISTS readings_channel_ts ON readings (channel, ts)',
+    'CREATE INDEX IF NOT EXISTS readings_ts ON readings (ts)',  # For the retention DELETE
+)
+
+_INSERT_LIGHT = 'INSERT OR REPLACE INTO light (ts, lux, proximity) VALUES (?, ?, ?)'
+_INSERT_READING = 'INSERT INTO readings (channel, ts, moisture, alarm, enabled) VALUES (?, ?, ?, ?, ?)'
+
+
+class SQLiteStore(SensorRecords):
+    """Sensor history stored in a SQLite database.
+
+    Records and readings use the same layout as SensorLog, so the two can be
+    swapped behind the storage writer. Unlike SensorLog, ranges are given as
+    timestamps rather than log positions.
+
+    Each thread gets its own connection, so a single store can be shared by
+    the storage writer and web server threads.
+
+    """
+
+    def __init__(self, path, channels=CHANNELS, retention=DEFAULT_RETENTION):
+        """Open or create a sensor database.
+
+        :param path: Database file
+        :param channels: Number of moisture channels stored
+        :param retention: Age, in seconds, after which readings are deleted
+
+        """
+        self.path = str(path)
+        self.fields = sensor_fields(channels)
+        self.retention = retention
+        self._local = threading.local()
+        self._last_expire = 0
+
+        connection = self._connection()
+        if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # A database created without incremental vacuum only switches over when rebuilt
+            connection.execute('VACUUM')
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            # auto_vacuum only takes effect if set before anything is written, even the switch to WAL
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def write(self, records):
+        """Insert a batch of sensor log records in a single transaction.
+
+        Expires old readings at most once every EXPIRE_INTERVAL seconds.
+
+        """
+        light = []
+        readings = []
+        for record in records:
+            light.append((record[0], record[1], record[2]))
+            for channel in range(self.channels):
+                moisture, alarm, enabled = record[3 + channel * 3:6 + channel * 3]
+                if not math.isnan(moisture):
+                    readings.append((channel + 1, record[0], moisture, int(alarm), int(enabled)))
+
+        connection = self._connection()
+        with connection:
+            connection.executemany(_INSERT_LIGHT, light)
+            connection.executemany(_INSERT_READING, readings)
+
+        if records and records[-1][0] - self._last_expire >= EXPIRE_INTERVAL:
+            self.expire(records[-1][0])
+
+    def expire(self, now=None):
+        """Delete readings older than the retention period and vacuum the freed pages.
+
+        Returns the number of rows deleted.
+
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.retention
+        connection = self._connection()
+        with connection:
+            deleted = connection.execute('DELETE FROM readings WHERE ts < ?', (cutoff,)).rowcount
+            deleted += connection.execute('DELETE FROM light WHERE ts < ?', (cutoff,)).rowcount
+        # execute() only steps the pragma once, freeing a single page, executescript() runs it to completion
+        connection.executescript('PRAGMA incremental_vacuum({});'.format(VACUUM_PAGES))
+        self._last_expire = now
+        return deleted
+
+    def channel_range(self, channel, start_time=None, stop_time=None):
+        """Return (ts, moisture, alarm, enabled) rows for one channel using the (channel, ts) index."""
+        start_time = -math.inf if start_time is None else start_time
+        stop_time = math.inf if stop_time is None else stop_time
+        return self._connection().execute(
+            'SELECT ts, moisture, alarm, enabled FROM readings WHERE channel = ? AND ts >= ? AND ts < ? ORDER BY ts',
+            (channel, start_time, stop_time)).fetchall()
+
+    def records(self, start_time=None, stop_time=None):
+        """Return records between two timestamps, in SensorLog field order."""
+        start_time = -math.inf if start_time is None else start_time
+        stop_time = math.inf if stop_time is None else stop_time
+        rows = self._connection().execute(
+            'SELECT ts, lux, proximity FROM light WHERE ts >= ? AND ts < ? ORDER BY ts',
+            (start_time, stop_time)).fetchall()
+
+        records = dict((ts, [ts, lux, proximity] + [math.nan, 0.0, 0.0] * self.channels) for ts, lux, proximity in rows)
+        for channel in range(self.channels):
+            for ts, moisture, alarm, enabled in self.channel_range(channel + 1, start_time, stop_time):
+                if ts in records:
+                    records[ts][3 + channel * 3:6 + channel * 3] = [moisture, float(alarm), float(enabled)]
+
+        return [tuple(records[ts]) for ts, _, _ in rows]
+
+    def latest(self):
+        """Return the most recent record, or None if the database is empty."""
+        row = self._connection().execute('SELECT MAX(ts) FROM light').fetchone()
+        if row[0] is None:
+            return None
+        return self.records(row[0], math.nextafter(row[0], math.inf))[0]
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
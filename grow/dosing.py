@@ -0,0 +1,284 @@
+"""Pump dose arbitration.
+
+Doses can be requested at any time by auto-watering, the web API or the
+buttons. Running every pump at once could overload the power supply, so
+all requests go through one DoseQueue, which runs at most max_active pumps
+at a time and starts queued doses as soon as a slot is free. A dose is
+never dropped because another pump is running, it just waits its turn.
+
+Each request is a Dose, a concurrent.futures.Future resolved with the
+seconds the pump ran for, which also records when it was requested,
+started and finished. Listeners added with add_listener() are called with
+every finished dose before its Future is resolved, so anyone waiting on the
+dose sees the listeners' work, eg: its journal entry, already done.
+Listeners read the outcome from the dose's ran and error attributes.
+
+Doses are run with the pump's _pulse(speed, duration) method, which must
+return a Future resolved with the seconds the pump ran for. No thread is
+needed to wait for them: each dose finishing starts the next.
+
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+MAX_ACTIVE_PUMPS = 1  # Pumps allowed to run at once, by default
+
+_MANUAL = object()  # Marks a pump running under manual control, outside the queue
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class Dose(Future):
+    """A requested pump dose, resolved with the seconds the pump ran for."""
+
+    def __init__(self, pump, speed, duration, source=None, volume=None):
+        Future.__init__(self)
+        self.pump = pump
+        self.channel = getattr(pump, 'channel', None)
+        self.speed = speed
+        self.duration = duration
+        self.source = source
+        self.volume = volume
+        self.requested = time.time()
+        self.started = None
+        self.finished = None
+        self.ran = None  # Seconds the pump ran for, set once the dose has finished
+        self.error = None  # Exception the dose failed with, if it did
+        self._requested = time.monotonic()
+        self._started = None
+
+    @property
+    def wait(self):
+        """Return the seconds the dose waited in the queue, so far if it has yet to start."""
+        started = self._started if self._started is not None else time.monotonic()
+        return started - self._requested
+
+    @property
+    def delivered(self):
+        """Return the ml of water the dose delivered, estimated by the pump's flow model, or None."""
+        flow_model = getattr(self.pump, 'flow_model', None)
+        if flow_model is None or self.ran is None:
+            return None
+        return flow_model.volume(self.speed, self.ran)
+
+    def as_dict(self):
+        """Return the dose's details as a dictionary, eg: for JSON."""
+        return {
+            'channel': self.channel,
+            'source': self.source,
+            'speed': self.speed,
+            'duration': self.duration,
+            'requested': self.requested,
+            'started': self.started,
+            'finished': self.finished,
+            'wait': self.wait,
+            'ran': self.ran,
+            'volume': self.volume,
+            'delivered': self.delivered,
+        }
+
+    def __repr__(self):
+        return "<Dose channel={} speed={} duration={} source={}>".format(
+            self.channel, self.speed, self.duration, self.source)
+
+
+class DoseQueue(object):
+    """Run requested pump doses in order, with a limit on pumps running at once."""
+
+    def __init__(self, max_active=MAX_ACTIVE_PUMPS):
+        """Create a dose queue.
+
+        :param max_active: Number of pumps allowed to run at once
+
+        """
+        self.max_active = max_active
+        self._pending = collections.deque()
+        self._active = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self._total_wait = 0.0
+
+    def submit(self, pump, speed, duration, source=None, callback=None, volume=None):
+        """Queue a dose, returning its Dose.
+
+        :param pump: Pump to run, with a _pulse(speed, duration) method
+        :param speed: Speed of the pump, from 0.0 to 1.0
+        :param duration: Length of the dose, in seconds
+        :param source: Optional label for what requested the dose, eg: "auto" or "web"
+        :param callback: Optional callable, called with the Dose once it has finished
+        :param volume: Optional ml of water the duration was worked out to deliver
+
+        """
+        if speed > 1.0 or speed <= 0:
+            raise ValueError("Speed must be greater than 0 and no more than 1")
+        if duration < 0:
+            raise ValueError("Duration must not be negative")
+
+        dose = Dose(pump, speed, duration, source, volume)
+        if callback is not None:
+            dose.add_done_callback(callback)
+        with self._lock:
+            self._pending.append(dose)
+            self.submitted += 1
+        self._dispatch()
+        return dose
+
+    def acquire(self, pump):
+        """Claim a slot for a pump run manually, eg: with set_speed(), without waiting.
+
+        Returns False if every slot is taken.
+
+        """
+        with self._lock:
+            if pump not in self._active and len(self._active) >= self.max_active:
+                return False
+            self._active[pump] = _MANUAL
+            return True
+
+    def release(self, pump):
+        """Release a slot claimed with acquire(), letting queued doses start."""
+        with self._lock:
+            if self._active.get(pump) is _MANUAL:
+                del self._active[pump]
+        self._dispatch()
+
+    def cancel(self, pump):
+        """Cancel all of a pump's queued doses that have yet to start, returns the number cancelled."""
+        with self._lock:
+            doses = [dose for dose in self._pending if dose.pump is pump]
+            for dose in doses:
+                self._pending.remove(dose)
+        for dose in doses:
+            dose.cancel()
+            dose.set_running_or_notify_cancel()
+        with self._lock:
+            self.cancelled += len(doses)
+        return len(doses)
+
+    def pending(self, pump=None):
+        """Return the doses waiting to start, optionally only those for one pump."""
+        with self._lock:
+            return [dose for dose in self._pending if pump is None or dose.pump is pump]
+
+    def active(self):
+        """Return the doses currently running."""
+        with self._lock:
+            return [dose for dose in self._active.values() if dose is not _MANUAL]
+
+    def running(self, pump):
+        """Check whether a pump is running, from the queue or under manual control."""
+        with self._lock:
+            return pump in self._active
+
+    def add_listener(self, listener):
+        """Call listener(dose) with every dose once it has finished, before its Future is resolved."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def set_max_active(self, max_active):
+        """Change the number of pumps allowed to run at once, starting queued doses if there is room."""
+        if max_active < 1:
+            raise ValueError("At least one pump must be allowed to run")
+        with self._lock:
+            self.max_active = max_active
+        self._dispatch()
+
+    def stats(self):
+        """Return a dictionary of queue and wait time counters."""
+        with self._lock:
+            started = self.completed + self.errors + sum(1 for dose in self._active.values() if dose is not _MANUAL)
+            return {
+                'max_active': self.max_active,
+                'running': len(self._active),
+                'depth': len(self._pending),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'errors': self.errors,
+                'last_wait': self.last_wait,
+                'max_wait': self.max_wait,
+                'mean_wait': self._total_wait / started if started else 0.0,
+            }
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            for dose in list(self._pending):
+                if len(self._active) >= self.max_active:
+                    break
+                if dose.pump in self._active:
+                    continue
+                self._pending.remove(dose)
+                if not dose.set_running_or_notify_cancel():
+                    self.cancelled += 1
+                    continue
+                dose._started = time.monotonic()
+                dose.started = time.time()
+                self._active[dose.pump] = dose
+                self.last_wait = dose.wait
+                self.max_wait = max(self.max_wait, self.last_wait)
+                self._total_wait += self.last_wait
+                started.append(dose)
+
+        # Pumps are started outside the lock, a pulse may finish, and call back in, straight away
+        for dose in started:
+            try:
+                pulse = dose.pump._pulse(dose.speed, dose.duration)
+            except Exception as e:
+                self._finish(dose, exception=e)
+                continue
+            pulse.add_done_callback(lambda pulse, dose=dose: self._finish(dose, pulse))
+
+    def _finish(self, dose, pulse=None, exception=None):
+        if exception is None:
+            exception = pulse.exception()
+        with self._lock:
+            if self._active.get(dose.pump) is dose:
+                del self._active[dose.pump]
+            if exception is None:
+                self.completed += 1
+            else:
+                self.errors += 1
+
+        dose.finished = time.time()
+        if exception is None:
+            dose.ran = pulse.result()
+        else:
+            logging.error("Dose {!r} failed: {}".format(dose, exception))
+            dose.error = exception
+
+        # Listeners run first, so the dose's outcome is recorded before anyone waiting on it wakes
+        for listener in list(self._listeners):
+            try:
+                listener(dose)
+            except Exception as e:
+                logging.error("Dose listener {!r} failed: {}".format(listener, e))
+
+        if exception is None:
+            dose.set_result(dose.ran)
+        else:
+            dose.set_exception(exception)
+
+        self._dispatch()
+
+
+def get_dose_queue():
+    """Return the dose queue shared by all pumps, creating it on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = DoseQueue()
+        return _queue
@@ -0,0 +1,93 @@
+"""Shape preserving downsampling for charting long series.
+
+Both methods return indices into the original series, so any number of
+parallel columns can be reduced the same way.
+
+"""
+import math
+
+
+def finite(xs, ys):
+    """Return the x and y values where y is not NaN."""
+    pairs = [(x, y) for x, y in zip(xs, ys) if not math.isnan(y)]
+    return [x for x, _ in pairs], [y for _, y in pairs]
+
+
+def lttb(xs, ys, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last points and, from each bucket in between, the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket. Returns the indices of the kept points.
+
+    :param xs: X values, in ascending order
+    :param ys: Y values
+    :param threshold: Maximum number of points to return
+
+    """
+    length = len(xs)
+    if threshold >= length:
+        return list(range(length))
+    if threshold < 3:
+        return [0, length - 1][:max(threshold, 0)]
+
+    every = (length - 2) / float(threshold - 2)
+    indices = [0]
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket, used as the third point of the triangle
+        next_start = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, length)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        ax, ay = xs[a], ys[a]
+
+        best = start
+        best_area = -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        indices.append(best)
+        a = best
+
+    indices.append(length - 1)
+    return indices
+
+
+def minmax(xs, ys, threshold):
+    """Min/max bucket downsampling.
+
+    Splits the series into threshold / 2 buckets and keeps the lowest and
+    highest point of each, in order, so peaks and troughs always survive.
+    Returns the indices of the kept points.
+
+    """
+    length = len(xs)
+    if threshold >= length:
+        return list(range(length))
+
+    buckets = max(1, threshold // 2)
+    indices = []
+    for bucket in range(buckets):
+        start = bucket * length // buckets
+        end = (bucket + 1) * length // buckets
+        if start >= end:
+            continue
+        low = min(range(start, end), key=ys.__getitem__)
+        high = max(range(start, end), key=ys.__getitem__)
+        indices += sorted({low, high})
+    return indices
+
+
+METHODS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
@@ -0,0 +1,266 @@
+"""Streaming filters for conditioning moisture readings.
+
+Each filter takes one sample at a time through update(value, timestamp) and
+returns the filtered value. Windowed filters keep their samples in fixed
+size arrays, so time and memory per sample depend only on the window size.
+
+Filters are chained with a Pipeline, which can be built from a list of
+settings such as::
+
+    filters:
+    - {type: hampel, window: 7, threshold: 3.0}
+    - {type: median, window: 5}
+    - {type: ema, alpha: 0.3}
+    - {type: rate_limit, max_rate: 0.5}
+
+"""
+import math
+import time
+from array import array
+from bisect import bisect_left, insort
+
+MAD_SCALE = 1.4826  # Scales the median absolute deviation to a standard deviation for normal noise
+
+
+class _Window(object):
+    """The last n samples, kept both in arrival order and sorted."""
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Window size must be at least 1")
+        self.size = size
+        self._ring = array('d', [0.0]) * size
+        self._sorted = array('d')
+        self._head = 0
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def push(self, value):
+        if len(self._sorted) == self.size:
+            del self._sorted[bisect_left(self._sorted, self._ring[self._head])]
+        self._ring[self._head] = value
+        self._head = (self._head + 1) % self.size
+        insort(self._sorted, value)
+
+    @property
+    def sorted(self):
+        """Return the samples in the window in ascending order."""
+        return self._sorted
+
+    def median(self):
+        values = self._sorted
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2.0
+
+    def clear(self):
+        del self._sorted[:]
+        self._head = 0
+
+
+class Filter(object):
+    """Base for streaming filters."""
+
+    def update(self, value, timestamp=None):
+        """Filter a sample.
+
+        :param value: The new sample
+        :param timestamp: Time of the sample in seconds, defaults to now
+
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget all previous samples."""
+        pass
+
+
+class Median(Filter):
+    """Rolling median, removes short spikes without smearing steps."""
+
+    def __init__(self, window=5):
+        """Create a rolling median.
+
+        :param window: Number of samples the median is taken over
+
+        """
+        self._window = _Window(int(window))
+
+    def update(self, value, timestamp=None):
+        self._window.push(value)
+        return self._window.median()
+
+    def reset(self):
+        self._window.clear()
+
+
+class EMA(Filter):
+    """Exponential moving average."""
+
+    def __init__(self, alpha=0.3):
+        """Create an exponential moving average.
+
+        :param alpha: Weight of each new sample, from 0.0 (ignore new samples) to 1.0 (no smoothing)
+
+        """
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("alpha must be greater than 0.0 and no more than 1.0")
+        self.alpha = alpha
+        self._value = None
+
+    def update(self, value, timestamp=None):
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += self.alpha * (value - self._value)
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+
+class Hampel(Filter):
+    """Hampel outlier filter.
+
+    A sample further than threshold scaled median absolute deviations from
+    the median of the window is replaced by that median.
+
+    """
+
+    def __init__(self, window=7, threshold=3.0):
+        """Create a Hampel filter.
+
+        :param window: Number of samples the median and deviation are taken over
+        :param threshold: Deviations from the median beyond which a sample is an outlier
+
+        """
+        self._window = _Window(int(window))
+        self._deviations = [0.0] * int(window)
+        self.threshold = threshold
+
+    def update(self, value, timestamp=None):
+        window = self._window
+        window.push(value)
+        count = len(window)
+        if count < 3:
+            return value
+
+        median = window.median()
+        deviations = self._deviations
+        values = window.sorted
+        for i in range(count):
+            deviations[i] = abs(values[i] - median)
+        for i in range(count, window.size):
+            deviations[i] = math.inf
+        deviations.sort()
+        middle = count // 2
+        mad = deviations[middle] if count % 2 else (deviations[middle - 1] + deviations[middle]) / 2.0
+
+        if abs(value - median) > self.threshold * MAD_SCALE * mad:
+            return median
+        return value
+
+    def reset(self):
+        self._window.clear()
+
+
+class RateLimit(Filter):
+    """Limit how quickly the output can change."""
+
+    def __init__(self, max_rate=1.0):
+        """Create a rate of change limit.
+
+        :param max_rate: Largest change allowed per second
+
+        """
+        self.max_rate = max_rate
+        self._value = None
+        self._time = None
+
+    def update(self, value, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self._value is None:
+            self._value = value
+        else:
+            step = self.max_rate * max(0.0, timestamp - self._time)
+            self._value += max(-step, min(step, value - self._value))
+        self._time = timestamp
+        return self._value
+
+    def reset(self):
+        self._value = None
+        self._time = None
+
+
+FILTERS = {
+    'median': Median,
+    'ema': EMA,
+    'hampel': Hampel,
+    'rate_limit': RateLimit,
+}
+
+
+class Pipeline(Filter):
+    """A chain of filters, applied in order."""
+
+    def __init__(self, filters=None):
+        """Create a pipeline.
+
+        :param filters: List of Filter instances, an empty pipeline passes samples through
+
+        """
+        self.filters = list(filters or [])
+        self.value = None
+        self._sequence = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a pipeline from a list of settings dictionaries.
+
+        Each dictionary has a "type", one of the FILTERS keys, and the filter's
+        keyword arguments.
+
+        """
+        filters = []
+        for settings in config or []:
+            settings = dict(settings)
+            kind = settings.pop('type', None)
+            if kind not in FILTERS:
+                raise ValueError("Unknown filter type {!r}, expected one of {}".format(kind, sorted(FILTERS)))
+            filters.append(FILTERS[kind](**settings))
+        return cls(filters)
+
+    def update(self, value, timestamp=None):
+        """Filter a sample, NaN samples are ignored and the last output returned."""
+        if math.isnan(value):
+            return self.value
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        for stage in self.filters:
+            value = stage.update(value, timestamp)
+        self.value = value
+        return value
+
+    def update_snapshot(self, snapshot):
+        """Filter a sensor's grow.snapshot.Snapshot, once per snapshot.
+
+        Sensors are polled more often than they take readings. Filtering every
+        poll would feed the same reading in again and again, filling windows
+        with copies of it, which lets outliers through. Returns None if the
+        snapshot has already been filtered, and 0.0, without filtering, if it
+        holds no reading or the sensor is inactive.
+
+        """
+        if snapshot.sequence == self._sequence:
+            return None
+        self._sequence = snapshot.sequence
+        if snapshot.moisture <= 0 or not snapshot.active:
+            return 0.0
+        return self.update(snapshot.moisture, snapshot.timestamp)
+
+    def reset(self):
+        for stage in self.filters:
+            stage.reset()
+        self.value = None
+        self._sequence = None
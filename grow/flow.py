@@ -0,0 +1,145 @@
+"""Pump flow models, for dosing by volume.
+
+How much water a dose delivers depends on the pump, its tubing and how far
+the water is lifted, so each pump is calibrated by running it at a few
+speeds and times and measuring the water delivered. Those runs are fitted
+with least squares to::
+
+    volume = (rate + rate_speed * speed) * seconds + offset + offset_speed * speed
+
+The first term is the steady flow, in ml/s, which rises with speed. The
+second is the water gained or lost getting the flow going, eg: while the
+tubing fills, which matters most for short doses. Terms the runs can't
+separate, such as the effect of speed when every run used the same speed,
+are left at zero.
+
+A fitted model is stored in each channel's settings::
+
+    flow_model:
+      rate: [-2.1, 14.6]
+      offset: [-0.8, 0.3]
+      speed: 0.6
+
+"""
+from collections import namedtuple
+
+Run = namedtuple('Run', ('speed', 'seconds', 'volume'))
+Run.__doc__ = """A calibration run: the pump speed, the seconds it ran for and the ml of water it delivered."""
+
+DEFAULT_SPEED = 0.5
+
+
+def _solve(matrix, vector):
+    """Solve a small linear system by Gaussian elimination with partial pivoting."""
+    size = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            raise ValueError("Calibration runs don't determine the flow model")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            for i in range(column, size + 1):
+                rows[row][i] -= factor * rows[column][i]
+    solution = [0.0] * size
+    for row in reversed(range(size)):
+        total = rows[row][size] - sum(rows[row][i] * solution[i] for i in range(row + 1, size))
+        solution[row] = total / rows[row][row]
+    return solution
+
+
+class FlowModel(object):
+    """Water delivered by a pump as a function of speed and time."""
+
+    def __init__(self, rate=(0.0, 0.0), offset=(0.0, 0.0), speed=DEFAULT_SPEED):
+        """Create a flow model.
+
+        :param rate: (ml/s, ml/s per unit speed) of steady flow
+        :param offset: (ml, ml per unit speed) gained or lost getting the flow going
+        :param speed: Speed to dose at when none is given
+
+        """
+        self.rate = tuple(float(value) for value in rate)
+        self.offset = tuple(float(value) for value in offset)
+        self.speed = speed
+
+    @classmethod
+    def fit(cls, runs, speed=None):
+        """Fit a model to calibration runs.
+
+        :param runs: Sequence of Run, or (speed, seconds, volume) tuples
+        :param speed: Speed to dose at, defaults to the median speed of the runs
+
+        """
+        runs = [Run(*run) for run in runs]
+        if not runs:
+            raise ValueError("At least one calibration run is needed")
+
+        speeds = set(run.speed for run in runs)
+        times = set(run.seconds for run in runs)
+        # Each term as (name, feature). Only terms the runs vary enough to tell apart are
+        # fitted: the offset needs runs of different lengths, the speed terms different speeds.
+        terms = [('rate', lambda run: run.seconds)]
+        if len(speeds) > 1:
+            terms.append(('rate_speed', lambda run: run.speed * run.seconds))
+        if len(times) > 1:
+            terms.append(('offset', lambda run: 1.0))
+        if len(speeds) > 1 and len(times) > 1:
+            terms.append(('offset_speed', lambda run: run.speed))
+        terms = terms[:len(runs)]
+
+        features = [[feature(run) for _, feature in terms] for run in runs]
+        matrix = [[sum(row[i] * row[j] for row in features) for j in range(len(terms))] for i in range(len(terms))]
+        vector = [sum(row[i] * run.volume for row, run in zip(features, runs)) for i in range(len(terms))]
+        coefficients = dict(zip((name for name, _ in terms), _solve(matrix, vector)))
+
+        if speed is None:
+            ordered = sorted(run.speed for run in runs)
+            speed = ordered[len(ordered) // 2]
+        return cls((coefficients.get('rate', 0.0), coefficients.get('rate_speed', 0.0)),
+                   (coefficients.get('offset', 0.0), coefficients.get('offset_speed', 0.0)), speed)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a model from a channel's flow_model settings, or return None if there are none."""
+        if not config:
+            return None
+        return cls(config.get('rate', (0.0, 0.0)), config.get('offset', (0.0, 0.0)),
+                   config.get('speed', DEFAULT_SPEED))
+
+    def to_config(self):
+        """Return the model as settings, for settings.yml."""
+        return {
+            'rate': [round(value, 4) for value in self.rate],
+            'offset': [round(value, 4) for value in self.offset],
+            'speed': self.speed,
+        }
+
+    def flow_rate(self, speed):
+        """Return the steady flow at a speed, in ml/s."""
+        return self.rate[0] + self.rate[1] * speed
+
+    def volume(self, speed, seconds):
+        """Return the ml delivered by running at speed for seconds."""
+        if seconds <= 0:
+            return 0.0
+        return max(0.0, self.flow_rate(speed) * seconds + self.offset[0] + self.offset[1] * speed)
+
+    def seconds(self, volume, speed=None):
+        """Return the seconds to run at speed to deliver a volume in ml.
+
+        :param volume: Volume of water, in ml
+        :param speed: Pump speed, defaults to the model's speed
+
+        """
+        speed = self.speed if speed is None else speed
+        rate = self.flow_rate(speed)
+        if rate <= 0:
+            raise ValueError("The pump delivers no water at speed {:.2f}".format(speed))
+        if volume <= 0:
+            return 0.0
+        return max(0.0, (volume - self.offset[0] - self.offset[1] * speed) / rate)
+
+    def __repr__(self):
+        return "FlowModel(rate={}, offset={}, speed={})".format(self.rate, self.offset, self.speed)
@@ -0,0 +1,89 @@
+"""Frequency estimates with confidence intervals.
+
+A moisture sensor's frequency is measured as the number of whole periods
+between two edges divided by the time between them. The spread of the
+individual periods gives the uncertainty of their mean, which shrinks with
+the square root of the number of periods. Sampling can therefore stop as
+soon as enough periods have been seen to meet a target relative precision,
+which takes longer for slow, wet readings than fast, dry ones.
+
+"""
+import math
+from collections import namedtuple
+
+Z_95 = 1.96  # Standard normal quantile for a 95% confidence interval
+DEFAULT_PRECISION = 0.02  # Target half width of the confidence interval, relative to the reading
+MIN_PERIODS = 2
+
+Reading = namedtuple('Reading', ('frequency', 'low', 'high', 'edges'))
+Reading.__doc__ = """A frequency in Hz with the bounds of its confidence interval and the number of edges it was measured from."""
+
+NO_READING = Reading(0.0, 0.0, 0.0, 0)
+
+
+def interval(frequency, relative):
+    """Return the (low, high) frequency bounds for a relative uncertainty in the mean period."""
+    if relative >= 1.0:
+        return frequency / (1.0 + relative), math.inf
+    return frequency / (1.0 + relative), frequency / (1.0 - relative)
+
+
+def periods_needed(cv, precision=DEFAULT_PRECISION, z=Z_95):
+    """Return the number of periods needed for a relative precision, given the periods' coefficient of variation."""
+    return max(MIN_PERIODS, int(math.ceil((z * cv / precision) ** 2)))
+
+
+class PeriodStats(object):
+    """Running mean and variance of edge periods (Welford's method)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, period):
+        self.count += 1
+        delta = period - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (period - self.mean)
+
+    @property
+    def cv(self):
+        """Return the coefficient of variation of the periods, or infinity with fewer than two."""
+        if self.count < MIN_PERIODS or self.mean <= 0:
+            return math.inf
+        return math.sqrt(self._m2 / (self.count - 1)) / self.mean
+
+    def relative_error(self, z=Z_95):
+        """Return the relative half width of the confidence interval for the mean period."""
+        if self.count < MIN_PERIODS:
+            return math.inf
+        return z * self.cv / math.sqrt(self.count)
+
+    def reading(self, frequency, edges, z=Z_95):
+        """Return a Reading for a frequency measured over these periods."""
+        low, high = interval(frequency, self.relative_error(z))
+        return Reading(frequency, low, high, edges)
+
+
+def from_timestamps(timestamps, scale=1.0, z=Z_95):
+    """Estimate frequency from a sequence of edge timestamps.
+
+    Returns a (Reading, coefficient of variation) tuple.
+
+    :param timestamps: Ascending edge times
+    :param scale: Seconds per timestamp unit, eg: 1e-9 for nanoseconds
+
+    """
+    if len(timestamps) < 2 or timestamps[-1] <= timestamps[0]:
+        return NO_READING, math.inf
+    stats = PeriodStats()
+    previous = timestamps[0]
+    for timestamp in timestamps[1:]:
+        stats.add((timestamp - previous) * scale)
+        previous = timestamp
+    frequency = (len(timestamps) - 1) / ((timestamps[-1] - timestamps[0]) * scale)
+    return stats.reading(frequency, len(timestamps), z), stats.cv
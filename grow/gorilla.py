@@ -0,0 +1,304 @@
+"""Gorilla style compression for time series.
+
+Timestamps are stored as millisecond delta-of-deltas and values as the XOR
+of each float with the one before it, following Facebook's Gorilla paper.
+Regularly sampled timestamps cost one bit each and an unchanged reading
+costs one bit, which suits slowly changing moisture and light readings.
+
+Encoders are streaming: values can be appended one at a time and the
+encoded bytes taken at any point. NumPy is used to precompute deltas and
+XORs in bulk when it is installed, but is not required.
+
+"""
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_COUNT = struct.Struct('<I')
+_DOUBLE = struct.Struct('<d')
+_UINT64 = struct.Struct('<Q')
+
+# Delta-of-delta buckets: (prefix bits, prefix length, value bits)
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+_MASK64 = (1 << 64) - 1
+
+
+def _float_bits(value):
+    return _UINT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_float(bits):
+    return _DOUBLE.unpack(_UINT64.pack(bits))[0]
+
+
+class BitWriter(object):
+    """Append bits to a growing byte string."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, bits):
+        """Write the low bits of value, most significant first."""
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buffer.append((self._acc >> self._bits) & 0xff)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        """Return the bits written so far, zero padded to a whole byte."""
+        if self._bits:
+            return bytes(self._buffer) + bytes([(self._acc << (8 - self._bits)) & 0xff])
+        return bytes(self._buffer)
+
+
+class BitReader(object):
+    """Read bits back from a byte string written by BitWriter."""
+
+    def __init__(self, data, offset=0):
+        self._data = data
+        self._position = offset
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, bits):
+        while self._bits < bits:
+            self._acc = (self._acc << 8) | self._data[self._position]
+            self._position += 1
+            self._bits += 8
+        self._bits -= bits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+    def read_signed(self, bits):
+        value = self.read(bits)
+        return value - (1 << bits) if value >> (bits - 1) else value
+
+
+class TimestampEncoder(object):
+    """Streaming delta-of-delta encoder for timestamps in seconds, stored to the millisecond."""
+
+    def __init__(self):
+        self._writer = BitWriter()
+        self.count = 0
+        self._last = 0
+        self._delta = 0
+
+    def append(self, timestamp):
+        self.append_ms(int(round(timestamp * 1000)))
+
+    def append_ms(self, value):
+        if self.count == 0:
+            self._writer.write(value, 64)
+        else:
+            delta = value - self._last
+            self._write_dod(delta - self._delta)
+            self._delta = delta
+        self._last = value
+        self.count += 1
+
+    def _write_dod(self, dod):
+        if dod == 0:
+            self._writer.write(0, 1)
+            return
+        for prefix, length, bits in _DOD_BUCKETS:
+            if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                self._writer.write(prefix, length)
+                self._writer.write(dod, bits)
+                return
+        self._writer.write(0b1111, 4)
+        self._writer.write(dod, 64)
+
+    def extend(self, timestamps):
+        """Append many timestamps, using NumPy for the delta-of-deltas when available."""
+        if numpy is None or len(timestamps) < 3 or self.count:
+            for timestamp in timestamps:
+                self.append(timestamp)
+            return
+
+        values = numpy.rint(numpy.asarray(timestamps, dtype=numpy.float64) * 1000).astype(numpy.int64)
+        self.append_ms(int(values[0]))
+        self.append_ms(int(values[1]))
+        for dod in numpy.diff(values, 2).tolist():
+            self._write_dod(dod)
+            self._delta += dod
+            self._last += self._delta
+            self.count += 1
+
+    def getvalue(self):
+        """Return the encoded series, prefixed with its length."""
+        return _COUNT.pack(self.count) + self._writer.getvalue()
+
+
+class FloatEncoder(object):
+    """Streaming XOR encoder for float64 values."""
+
+    def __init__(self):
+        self._writer = BitWriter()
+        self.count = 0
+        self._last = 0
+        self._leading = 65
+        self._trailing = 0
+
+    def append(self, value):
+        self._append_xor(_float_bits(value))
+
+    def _append_xor(self, bits, xor=None):
+        if self.count == 0:
+            self._writer.write(bits, 64)
+        else:
+            self._write_xor(bits ^ self._last if xor is None else xor)
+        self._last = bits
+        self.count += 1
+
+    def _write_xor(self, xor):
+        writer = self._writer
+        if xor == 0:
+            writer.write(0, 1)
+            return
+
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+
+        if leading >= self._leading and trailing >= self._trailing:
+            # Meaningful bits fit inside the previous window
+            writer.write(0b10, 2)
+            writer.write(xor >> self._trailing, 64 - self._leading - self._trailing)
+            return
+
+        length = 64 - leading - trailing
+        writer.write(0b11, 2)
+        writer.write(leading, 5)
+        writer.write(length - 1, 6)
+        writer.write(xor >> trailing, length)
+        self._leading = leading
+        self._trailing = trailing
+
+    def extend(self, values):
+        """Append many values, using NumPy for the XORs when available."""
+        if numpy is None or len(values) < 2:
+            for value in values:
+                self.append(value)
+            return
+
+        bits = numpy.asarray(values, dtype=numpy.float64).view(numpy.uint64)
+        xors = numpy.bitwise_xor(bits[1:], bits[:-1]) if self.count == 0 else None
+        bits = bits.tolist()
+        if xors is None:
+            for value in bits:
+                self._append_xor(value)
+            return
+
+        self._append_xor(bits[0])
+        for value, xor in zip(bits[1:], xors.tolist()):
+            self._append_xor(value, xor)
+
+    def getvalue(self):
+        """Return the encoded series, prefixed with its length."""
+        return _COUNT.pack(self.count) + self._writer.getvalue()
+
+
+def iter_timestamps(data):
+    """Yield timestamps, in seconds, from bytes produced by TimestampEncoder."""
+    count = _COUNT.unpack_from(data)[0]
+    if count == 0:
+        return
+    reader = BitReader(data, _COUNT.size)
+    value = reader.read_signed(64)
+    delta = 0
+    yield value / 1000.0
+
+    for _ in range(count - 1):
+        if reader.read(1) == 0:
+            dod = 0
+        elif reader.read(1) == 0:
+            dod = reader.read_signed(7)
+        elif reader.read(1) == 0:
+            dod = reader.read_signed(9)
+        elif reader.read(1) == 0:
+            dod = reader.read_signed(12)
+        else:
+            dod = reader.read_signed(64)
+        delta += dod
+        value += delta
+        yield value / 1000.0
+
+
+def iter_floats(data):
+    """Yield values from bytes produced by FloatEncoder."""
+    count = _COUNT.unpack_from(data)[0]
+    if count == 0:
+        return
+    reader = BitReader(data, _COUNT.size)
+    bits = reader.read(64)
+    leading = trailing = 0
+    yield _bits_float(bits)
+
+    for _ in range(count - 1):
+        if reader.read(1) == 1:
+            if reader.read(1) == 1:
+                leading = reader.read(5)
+                trailing = 64 - leading - (reader.read(6) + 1)
+            bits ^= (reader.read(64 - leading - trailing) << trailing) & _MASK64
+        yield _bits_float(bits)
+
+
+def encode_timestamps(timestamps):
+    encoder = TimestampEncoder()
+    encoder.extend(timestamps)
+    return encoder.getvalue()
+
+
+def decode_timestamps(data):
+    return list(iter_timestamps(data))
+
+
+def encode_floats(values):
+    encoder = FloatEncoder()
+    encoder.extend(values)
+    return encoder.getvalue()
+
+
+def decode_floats(data):
+    return list(iter_floats(data))
+
+
+class CompressedSeries(object):
+    """In-memory (timestamp, value) history held in Gorilla encoded form.
+
+    Appending is streaming and cheap. Reading decodes the whole series, so
+    this suits long histories that are read far less often than written.
+
+    """
+
+    def __init__(self):
+        self._timestamps = TimestampEncoder()
+        self._values = FloatEncoder()
+
+    def append(self, timestamp, value):
+        self._timestamps.append(timestamp)
+        self._values.append(value)
+
+    def __len__(self):
+        return self._values.count
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes the encoded series occupies."""
+        return len(self._timestamps.getvalue()) + len(self._values.getvalue())
+
+    def timestamps(self):
+        return decode_timestamps(self._timestamps.getvalue())
+
+    def values(self):
+        return decode_floats(self._values.getvalue())
+
+    def __iter__(self):
+        return zip(iter_timestamps(self._timestamps.getvalue()), iter_floats(self._values.getvalue()))
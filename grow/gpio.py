@@ -0,0 +1,437 @@
+"""GPIO backends for the Grow drivers.
+
+The moisture, pump and piezo drivers talk to GPIO through one small driver
+API, implemented for:
+
+* lgpio - the gpiochip character device, used on the Pi 5 and any Pi with a
+  recent kernel. Edges are timestamped by the kernel and delivered by
+  lgpio's own thread, PWM and timed pulses are generated by lgpio rather
+  than a Python thread.
+* RPi.GPIO - the original library, for older installs.
+* mock - records pin states and lets edges be injected, for tests and
+  development away from a Pi.
+
+All drivers in a process share one backend, and so one gpiochip handle.
+The backend is chosen by the GROW_GPIO_BACKEND environment variable, one of
+"lgpio", "rpi" or "mock", or else the first of lgpio and RPi.GPIO that can
+be imported. Code that opens the chip itself can share it with the drivers::
+
+    from grow.gpio import get_backend
+    h = get_backend('lgpio').handle
+
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from .scheduler import get_scheduler
+
+BACKEND_ENV = 'GROW_GPIO_BACKEND'
+DEFAULT_CHIP = 0
+PULSE_POLL = 0.002  # Seconds between checks that an lgpio pulse has finished, if it hadn't when expected
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class Backend(object):
+    """Driver API implemented by each GPIO backend.
+
+    Pins are numbered BCM, levels are 0 or 1 and PWM duty cycles are
+    percentages from 0 to 100.
+
+    """
+
+    name = None
+
+    def setup_input(self, pin):
+        """Claim a pin as an input."""
+        raise NotImplementedError
+
+    def setup_output(self, pin, value=0):
+        """Claim a pin as an output.
+
+        :param value: Initial level
+
+        """
+        raise NotImplementedError
+
+    def release(self, pin):
+        """Return a pin to a safe, unclaimed state."""
+        raise NotImplementedError
+
+    def write(self, pin, value):
+        """Set the level of an output pin."""
+        raise NotImplementedError
+
+    def pwm(self, pin, frequency):
+        """Return a PWM for an output pin, stopped.
+
+        :param frequency: PWM frequency in Hz
+
+        """
+        raise NotImplementedError
+
+    def add_edge_callback(self, pin, callback):
+        """Call callback(pin, tick) on each rising edge of an input pin.
+
+        tick is the time of the edge in nanoseconds, from a clock that is only
+        meaningful for differences between ticks.
+
+        Returns an object with a cancel() method to stop the callbacks.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the backend."""
+        pass
+
+
+class _Callback(object):
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+
+class PWM(object):
+    """PWM on an output pin, timed by the backend."""
+
+    hardware_pulses = False  # True if pulse() is timed by the backend rather than the scheduler thread
+
+    def __init__(self, backend, pin, frequency):
+        self._backend = backend
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0
+        self._pulse = None
+        self._pulse_lock = threading.Lock()
+
+    def start(self, duty=0):
+        """Start the PWM with a duty cycle in percent."""
+        self._end_pulse()
+        self.duty = duty
+        self._start()
+
+    def set_duty(self, duty):
+        """Change the duty cycle, in percent."""
+        self._end_pulse()
+        self.duty = duty
+        self._set_duty()
+
+    def set_frequency(self, frequency):
+        """Change the frequency, in Hz."""
+        self.frequency = frequency
+        self._set_frequency()
+
+    def stop(self):
+        """Stop the PWM and leave the pin low."""
+        self._end_pulse()
+        self.duty = 0
+        self._stop()
+
+    def pulse(self, duty, duration):
+        """Output a duty cycle for duration seconds then go low, without blocking.
+
+        Any change to the PWM before the pulse ends cuts it short.
+
+        Returns a concurrent.futures.Future resolved with the time, in seconds, the
+        pulse ran for.
+
+        :param duty: Duty cycle, in percent
+        :param duration: Length of the pulse, in seconds
+
+        """
+        self.set_duty(duty)
+        future = self._begin_pulse()
+        get_scheduler().call_later(duration, self._stop_pulse, key=self, replace=True)
+        return future
+
+    def _stop_pulse(self):
+        # Turn off before the pulse's future resolves, and whatever is waiting on it runs
+        self.duty = 0
+        self._set_duty()
+        self._end_pulse()
+
+    def _begin_pulse(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._pulse_lock:
+            self._pulse = (future, time.monotonic())
+        return future
+
+    def _end_pulse(self, length=None):
+        with self._pulse_lock:
+            pulse, self._pulse = self._pulse, None
+        if pulse is not None:
+            get_scheduler().cancel_key(self)
+            future, started = pulse
+            future.set_result(time.monotonic() - started if length is None else length)
+
+    def _start(self):
+        self._apply()
+
+    def _set_duty(self):
+        self._apply()
+
+    def _set_frequency(self):
+        self._apply()
+
+    def _stop(self):
+        self._apply()
+
+    def _apply(self):
+        raise NotImplementedError
+
+
+class _LgpioPWM(PWM):
+    hardware_pulses = True
+
+    def _apply(self):
+        lgpio = self._backend.lgpio
+        lgpio.tx_pwm(self._backend.handle, self.pin, self.frequency, self.duty)
+
+    def pulse(self, duty, duration):
+        # lgpio times the whole pulse as a count of PWM cycles, the scheduler thread only
+        # wakes once it should have finished to resolve the future
+        lgpio = self._backend.lgpio
+        self._end_pulse()
+        period = int(round(1000000.0 / self.frequency))
+        on = int(round(period * min(max(duty, 0), 100) / 100.0))
+        cycles = int(round(duration * 1000000.0 / period))
+        if on == 0 or cycles == 0:
+            self.stop()
+            future = Future()
+            future.set_result(0.0)
+            return future
+
+        lgpio.tx_pulse(self._backend.handle, self.pin, on, period - on, 0, cycles)
+        self.duty = duty
+        future = self._begin_pulse()
+        length = cycles * period / 1000000.0
+        get_scheduler().call_later(length, self._poll_pulse, future, length, key=self, replace=True)
+        return future
+
+    def _poll_pulse(self, future, length):
+        lgpio = self._backend.lgpio
+        if self._pulse is None or self._pulse[0] is not future:
+            return
+        if lgpio.tx_busy(self._backend.handle, self.pin, lgpio.TX_PWM):
+            get_scheduler().call_later(PULSE_POLL, self._poll_pulse, future, length, key=self)
+            return
+        self.duty = 0
+        self._end_pulse(length)
+
+
+class LgpioBackend(Backend):
+    """GPIO through lgpio and a single gpiochip handle."""
+
+    name = 'lgpio'
+
+    def __init__(self, chip=DEFAULT_CHIP, handle=None):
+        """Create an lgpio backend.
+
+        :param chip: gpiochip number to open
+        :param handle: An already open gpiochip handle to use, it will not be closed by this backend
+
+        """
+        import lgpio
+        self.lgpio = lgpio
+        self.chip = chip
+        self._handle = handle
+        self._owns_handle = handle is None
+
+    @property
+    def handle(self):
+        """Return the gpiochip handle, opening the chip on first use."""
+        if self._handle is None:
+            self._handle = self.lgpio.gpiochip_open(self.chip)
+        return self._handle
+
+    def _call(self, function, *args):
+        try:
+            return getattr(self.lgpio, function)(self.handle, *args)
+        except self.lgpio.error as e:
+            raise RuntimeError("{} failed: {}".format(function, e))
+
+    def setup_input(self, pin):
+        self._call('gpio_claim_input', pin)
+
+    def setup_output(self, pin, value=0):
+        self._call('gpio_claim_output', pin, value)
+
+    def release(self, pin):
+        self._call('gpio_free', pin)
+
+    def write(self, pin, value):
+        self._call('gpio_write', pin, value)
+
+    def pwm(self, pin, frequency):
+        return _LgpioPWM(self, pin, frequency)
+
+    def add_edge_callback(self, pin, callback):
+        lgpio = self.lgpio
+        self._call('gpio_claim_alert', pin, lgpio.RISING_EDGE)
+
+        def edge(chip, gpio, level, tick):
+            callback(gpio, tick)
+
+        return lgpio.callback(self.handle, pin, lgpio.RISING_EDGE, edge)
+
+    def close(self):
+        if self._handle is not None and self._owns_handle:
+            self.lgpio.gpiochip_close(self._handle)
+        self._handle = None
+
+
+class _RPiPWM(PWM):
+    def __init__(self, backend, pin, frequency):
+        PWM.__init__(self, backend, pin, frequency)
+        self._pwm = backend.GPIO.PWM(pin, frequency)
+
+    def _start(self):
+        self._pwm.start(self.duty)
+
+    def _set_duty(self):
+        self._pwm.ChangeDutyCycle(self.duty)
+
+    def _set_frequency(self):
+        self._pwm.ChangeFrequency(self.frequency)
+
+    def _stop(self):
+        self._pwm.stop()
+
+
+class RPiGPIOBackend(Backend):
+    """GPIO through RPi.GPIO."""
+
+    name = 'rpi'
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN)
+
+    def setup_output(self, pin, value=0):
+        self.GPIO.setup(pin, self.GPIO.OUT, initial=self.GPIO.HIGH if value else self.GPIO.LOW)
+
+    def release(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN)
+
+    def write(self, pin, value):
+        self.GPIO.output(pin, self.GPIO.HIGH if value else self.GPIO.LOW)
+
+    def pwm(self, pin, frequency):
+        return _RPiPWM(self, pin, frequency)
+
+    def add_edge_callback(self, pin, callback):
+        GPIO = self.GPIO
+
+        def edge(channel):
+            callback(channel, time.monotonic_ns())
+
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=edge, bouncetime=1)
+        return _Callback(lambda: GPIO.remove_event_detect(pin))
+
+
+class _MockPWM(PWM):
+    def _apply(self):
+        self._backend.duty[self.pin] = self.duty
+        self._backend.frequency[self.pin] = self.frequency
+
+
+class MockBackend(Backend):
+    """In memory GPIO, for tests and development away from a Pi."""
+
+    name = 'mock'
+
+    def __init__(self):
+        self.modes = {}
+        self.levels = {}
+        self.duty = {}
+        self.frequency = {}
+        self._callbacks = {}
+
+    def setup_input(self, pin):
+        self.modes[pin] = 'in'
+
+    def setup_output(self, pin, value=0):
+        self.modes[pin] = 'out'
+        self.levels[pin] = value
+
+    def release(self, pin):
+        self.modes.pop(pin, None)
+        self.levels.pop(pin, None)
+        self.duty.pop(pin, None)
+
+    def write(self, pin, value):
+        self.levels[pin] = 1 if value else 0
+
+    def pwm(self, pin, frequency):
+        return _MockPWM(self, pin, frequency)
+
+    def add_edge_callback(self, pin, callback):
+        self._callbacks[pin] = callback
+        return _Callback(lambda: self._callbacks.pop(pin, None))
+
+    def edge(self, pin, tick=None):
+        """Simulate a rising edge on an input pin.
+
+        :param tick: Time of the edge in nanoseconds, defaults to now
+
+        """
+        callback = self._callbacks.get(pin)
+        if callback is not None:
+            callback(pin, time.monotonic_ns() if tick is None else tick)
+
+
+BACKENDS = {
+    'lgpio': LgpioBackend,
+    'rpi': RPiGPIOBackend,
+    'mock': MockBackend,
+}
+
+
+def _create(name):
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError("Unknown GPIO backend {!r}, expected one of {}".format(name, sorted(BACKENDS)))
+        return BACKENDS[name]()
+
+    for backend in (LgpioBackend, RPiGPIOBackend):
+        try:
+            return backend()
+        except ImportError:
+            pass
+    raise ImportError("No GPIO library found, install lgpio or RPi.GPIO, or set {}=mock".format(BACKEND_ENV))
+
+
+def get_backend(name=None):
+    """Return the backend shared by all drivers, creating it on first use.
+
+    :param name: One of "lgpio", "rpi" or "mock". Leave as None to use the GROW_GPIO_BACKEND environment variable, or the first available library.
+
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _create(name or os.environ.get(BACKEND_ENV) or None)
+        elif name is not None and name != _backend.name:
+            raise RuntimeError("GPIO backend {!r} is already in use".format(_backend.name))
+        return _backend
+
+
+def set_backend(backend):
+    """Use an existing backend for all drivers, eg: LgpioBackend(handle=h) to share an open gpiochip.
+
+    Returns the backend that was previously in use, or None.
+
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
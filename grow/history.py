@@ -0,0 +1,457 @@
+"""Fixed-record, append-only sensor history.
+
+History is kept in a single file laid out as a ring buffer of float64
+records. Appending a reading writes one record and the write cursor, so the
+cost of an append does not grow with the amount of history kept.
+
+Readers in other threads or processes can map the same file with RingView
+and slice columns straight out of the mapping without parsing or copying.
+
+"""
+import math
+import mmap
+import os
+import struct
+from datetime import datetime
+
+MAGIC = b'GRWL'
+VERSION = 1
+DEFAULT_CAPACITY = 24 * 60 * 60
+CHANNELS = 3
+
+# magic, version, field count, capacity, data offset, written, mark
+_HEADER = struct.Struct('<4sHxxIII4xQQ24x')
+_CURSOR = struct.Struct('<QQ')
+_CURSOR_OFFSET = 24
+
+
+def _parse_header(path, buf):
+    """Return fields, capacity, data offset, written and mark from a log header."""
+    if len(buf) < _HEADER.size:
+        raise ValueError("{} is not a ring log".format(path))
+
+    magic, version, field_count, capacity, data_offset, written, mark = _HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("{} is not a ring log".format(path))
+    if version != VERSION:
+        raise ValueError("{} has unsupported version {}".format(path, version))
+
+    names = bytes(buf[_HEADER.size:data_offset]).rstrip(b'\0').decode('utf-8')
+    return names.split('\n')[:field_count], capacity, data_offset, written, mark
+
+
+class RingLog(object):
+    """Fixed-capacity, append-only log of float64 records."""
+
+    def __init__(self, path, fields=None, capacity=DEFAULT_CAPACITY, readonly=False):
+        """Open or create a ring log.
+
+        :param path: File to store the log in
+        :param fields: List of column names, required when creating a new log
+        :param capacity: Number of records kept before the oldest is overwritten
+        :param readonly: If true, open an existing log for reading only
+
+        """
+        self.path = str(path)
+
+        if readonly or (os.path.exists(self.path) and os.path.getsize(self.path) > 0):
+            self._file = open(self.path, 'rb' if readonly else 'r+b', buffering=0)
+            self._read_header()
+            if fields is not None and list(fields) != self.fields:
+                self._file.close()
+                raise ValueError("{} has fields {}, expected {}".format(self.path, self.fields, list(fields)))
+        else:
+            if not fields:
+                raise ValueError("fields are required to create a new log")
+            self._create(list(fields), capacity)
+
+        self.readonly = readonly
+        self._record = struct.Struct('<{}d'.format(len(self.fields)))
+
+    def _create(self, fields, capacity):
+        names = '\n'.join(fields).encode('utf-8')
+        names += b'\0' * (-len(names) % 8)
+
+        self.fields = fields
+        self.capacity = capacity
+        self._data_offset = _HEADER.size + len(names)
+        self._written = 0
+        self._mark = 0
+
+        self._file = open(self.path, 'w+b', buffering=0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION, len(fields), capacity, self._data_offset, 0, 0))
+        self._file.write(names)
+        self._file.truncate(self._data_offset + capacity * len(fields) * 8)
+
+    def _read_header(self):
+        self._file.seek(0)
+        header = self._file.read(_HEADER.size)
+        data_offset = _HEADER.unpack(header)[4] if len(header) == _HEADER.size else _HEADER.size
+        header += self._file.read(data_offset - _HEADER.size)
+        self.fields, self.capacity, self._data_offset, self._written, self._mark = _parse_header(self.path, header)
+
+    def _sync(self):
+        """Re-read the cursor, picking up appends made through another handle."""
+        if self.readonly:
+            self._file.seek(_CURSOR_OFFSET)
+            self._written, self._mark = _CURSOR.unpack(self._file.read(_CURSOR.size))
+
+    def _write_cursor(self):
+        self._file.seek(_CURSOR_OFFSET)
+        self._file.write(_CURSOR.pack(self._written, self._mark))
+
+    @property
+    def written(self):
+        """Return the total number of records ever appended."""
+        self._sync()
+        return self._written
+
+    @property
+    def mark(self):
+        """Return the caller-defined checkpoint position, eg: the last archived record."""
+        self._sync()
+        return self._mark
+
+    @mark.setter
+    def mark(self, position):
+        self._mark = position
+        self._write_cursor()
+
+    def __len__(self):
+        self._sync()
+        return min(self._written, self.capacity)
+
+    def append(self, values):
+        """Append a single record.
+
+        :param values: Sequence of floats, one for each field
+
+        """
+        self.extend([values])
+
+    def extend(self, records):
+        """Append several records, writing each contiguous run and the cursor once.
+
+        :param records: Sequence of records, each a sequence of floats
+
+        """
+        # Records that would be overwritten within this call are skipped but still counted
+        skipped = max(0, len(records) - self.capacity)
+        self._written += skipped
+        records = records[skipped:]
+        position = 0
+        while position < len(records):
+            slot = self._written % self.capacity
+            run = records[position:position + self.capacity - slot]
+            self._file.seek(self._data_offset + slot * self._record.size)
+            self._file.write(b''.join(self._record.pack(*values) for values in run))
+            self._written += len(run)
+            position += len(run)
+        self._write_cursor()
+
+    def update_latest(self, values):
+        """Overwrite the most recent record in place.
+
+        :param values: Sequence of floats, one for each field
+
+        """
+        if self._written == 0:
+            raise ValueError("cannot update the latest record of an empty log")
+        slot = (self._written - 1) % self.capacity
+        self._file.seek(self._data_offset + slot * self._record.size)
+        self._file.write(self._record.pack(*values))
+
+    def latest(self):
+        """Return the most recent record as a tuple, or None if the log is empty."""
+        self._sync()
+        if self._written == 0:
+            return None
+        slot = (self._written - 1) % self.capacity
+        self._file.seek(self._data_offset + slot * self._record.size)
+        return self._record.unpack(self._file.read(self._record.size))
+
+    def records(self, start=None, stop=None):
+        """Yield records between two absolute positions.
+
+        Positions count every record ever appended, so records that have been
+        overwritten are silently skipped.
+
+        :param start: First position to return, defaults to the oldest record held
+        :param stop: Position to stop before, defaults to the end of the log
+
+        """
+        self._sync()
+        oldest = max(0, self._written - self.capacity)
+        start = oldest if start is None else max(start, oldest)
+        stop = self._written if stop is None else min(stop, self._written)
+
+        while start < stop:
+            slot = start % self.capacity
+            run = min(stop - start, self.capacity - slot)
+            self._file.seek(self._data_offset + slot * self._record.size)
+            for record in self._record.iter_unpack(self._file.read(run * self._record.size)):
+                yield record
+            start += run
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RingView(object):
+    """Read-only, memory-mapped view of a ring log.
+
+    Columns are returned as strided memoryviews over the mapping, so slicing
+    a day of history costs the same as slicing a minute. Segments returned by
+    the view must be released (or dropped) before calling close().
+
+    """
+
+    def __init__(self, path):
+        """Map a ring log for reading.
+
+        :param path: File the log is stored in
+
+        """
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("{} is not a ring log".format(self.path))
+
+        self.fields, self.capacity, data_offset, _, _ = _parse_header(self.path, self._map)
+        stat = os.fstat(self._file.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        self._data_offset = data_offset
+        self.width = len(self.fields)
+        self._index = dict((name, i) for i, name in enumerate(self.fields))
+        self._values = memoryview(self._map)[data_offset:data_offset + self.capacity * self.width * 8].cast('d')
+
+    @property
+    def written(self):
+        """Return the total number of records ever appended."""
+        return _CURSOR.unpack_from(self._map, _CURSOR_OFFSET)[0]
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def bounds(self, start=None, stop=None):
+        """Clamp a pair of absolute positions to the records currently held."""
+        written = self.written
+        oldest = max(0, written - self.capacity)
+        start = oldest if start is None else max(start, oldest)
+        stop = written if stop is None else min(stop, written)
+        return start, max(start, stop)
+
+    def _runs(self, start, stop):
+        """Yield (slot, count) pairs covering positions start to stop without wrapping."""
+        while start < stop:
+            slot = start % self.capacity
+            run = min(stop - start, self.capacity - slot)
+            yield slot, run
+            start += run
+
+    def column(self, name, start=None, stop=None):
+        """Return a column as a list of zero-copy memoryview segments.
+
+        A range that wraps around the end of the ring is returned as two segments.
+
+        :param name: Field name, eg: "channel1_moisture"
+        :param start: First absolute position, defaults to the oldest record held
+        :param stop: Position to stop before, defaults to the end of the log
+
+        """
+        offset = self._index[name]
+        width = self.width
+        return [self._values[slot * width + offset:(slot + run) * width:width]
+                for slot, run in self._runs(*self.bounds(start, stop))]
+
+    def rows(self, start=None, stop=None):
+        """Return records between two positions as a list of lists of floats."""
+        width = self.width
+        rows = []
+        for slot, run in self._runs(*self.bounds(start, stop)):
+            segment = self._values[slot * width:(slot + run) * width]
+            rows += segment.cast('B').cast('d', shape=[run, width]).tolist()
+        return rows
+
+    def records(self, start=None, stop=None):
+        """Return an iterator over records between two positions, as with RingLog.records."""
+        return iter(self.rows(start, stop))
+
+    def latest(self):
+        """Return the most recent record as a tuple, or None if the log is empty."""
+        written = self.written
+        if written == 0:
+            return None
+        slot = (written - 1) % self.capacity
+        return tuple(self._values[slot * self.width:(slot + 1) * self.width])
+
+    def _timestamp(self, position):
+        return self._values[(position % self.capacity) * self.width]
+
+    def search(self, timestamp):
+        """Return the position of the first record at or after a timestamp.
+
+        Records must be appended in timestamp order, which lets this bisect the ring.
+
+        """
+        low, high = self.bounds()
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def between(self, start_time=None, stop_time=None):
+        """Return the (start, stop) positions of records between two timestamps."""
+        start, stop = self.bounds()
+        if start_time is not None:
+            start = self.search(start_time)
+        if stop_time is not None:
+            stop = self.search(stop_time)
+        return start, max(start, stop)
+
+    def stale(self):
+        """Check whether the log has been replaced, or recreated with another layout, since it was mapped.
+
+        eg: by a migration or a capacity change. A stale view should be dropped and the log mapped again.
+
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        if (stat.st_dev, stat.st_ino) != self._identity or stat.st_size < len(self._map):
+            return True
+        try:
+            fields, capacity, data_offset, _, _ = _parse_header(self.path, self._map)
+        except ValueError:
+            return True
+        return (fields, capacity, data_offset) != (self.fields, self.capacity, self._data_offset)
+
+    def close(self):
+        self._values.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def sensor_fields(channels=CHANNELS):
+    """Return the record fields used to store readings from a number of channels."""
+    fields = ['timestamp', 'lux', 'proximity']
+    for channel in range(1, channels + 1):
+        fields += ['channel{}_{}'.format(channel, name) for name in ('moisture', 'alarm', 'enabled')]
+    return fields
+
+
+class SensorRecords(object):
+    """Conversion between monitor readings and sensor log records.
+
+    Readings use the same shape as the monitor's JSON output::
+
+        {'timestamp': ..., 'sensors': {'channel1': {'moisture': ..., 'alarm': ..., 'enabled': ...}},
+         'light': {'lux': ..., 'proximity': ...}}
+
+    Channels missing from a reading are stored as NaN and left out again when read back.
+
+    Classes using this mixin provide fields, latest() and records(start, stop).
+
+    """
+
+    @property
+    def channels(self):
+        return (len(self.fields) - 3) // 3
+
+    def encode(self, reading):
+        """Convert a reading dictionary into a record."""
+        timestamp = reading['timestamp']
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+
+        light = reading.get('light', {})
+        values = [timestamp, light.get('lux', 0.0), light.get('proximity', 0.0)]
+
+        sensors = reading.get('sensors', {})
+        for channel in range(1, self.channels + 1):
+            sensor = sensors.get('channel{}'.format(channel))
+            if sensor is None:
+                values += [math.nan, 0.0, 0.0]
+            else:
+                values += [sensor['moisture'], float(sensor['alarm']), float(sensor['enabled'])]
+
+        return values
+
+    def decode(self, record):
+        """Convert a record back into a reading dictionary."""
+        sensors = {}
+        for channel in range(self.channels):
+            moisture, alarm, enabled = record[3 + channel * 3:6 + channel * 3]
+            if not math.isnan(moisture):
+                sensors['channel{}'.format(channel + 1)] = {
+                    'moisture': moisture,
+                    'alarm': bool(alarm),
+                    'enabled': bool(enabled)
+                }
+
+        return {
+            'timestamp': datetime.fromtimestamp(record[0]).isoformat(),
+            'sensors': sensors,
+            'light': {
+                'lux': record[1],
+                'proximity': record[2]
+            }
+        }
+
+    def unstored(self, records):
+        """Return the records newer than the latest one stored.
+
+        A batch retried after a failure part way through storing it is then only stored once,
+        and records stay in time order for searching.
+
+        """
+        latest = self.latest()
+        if latest is None:
+            return list(records)
+        return [record for record in records if record[0] > latest[0]]
+
+    def latest_reading(self):
+        """Return the most recent reading dictionary, or None if the log is empty."""
+        record = self.latest()
+        return None if record is None else self.decode(record)
+
+    def readings(self, start=None, stop=None):
+        """Yield reading dictionaries between two absolute positions."""
+        for record in self.records(start, stop):
+            yield self.decode(record)
+
+
+class SensorLog(SensorRecords, RingLog):
+    """Ring log of monitor readings."""
+
+    def __init__(self, path, channels=CHANNELS, capacity=DEFAULT_CAPACITY, readonly=False):
+        RingLog.__init__(self, path, None if readonly else sensor_fields(channels), capacity, readonly)
+
+    def append_reading(self, reading):
+        """Append a reading dictionary."""
+        self.append(self.encode(reading))
+
+
+class SensorView(SensorRecords, RingView):
+    """Read-only, memory-mapped view of a sensor log."""
@@ -0,0 +1,215 @@
+"""Pump dose journal and daily watering totals.
+
+Every finished dose is appended to a ring log of fixed float64 records,
+so the journal stays the same size however long the monitor runs. Alongside
+it a second ring log keeps one record per day with each channel's dose
+count, seconds pumped and ml delivered. The day's record is updated in
+place as each dose finishes, just like the bucket being filled in a rollup
+tier, so totals for a week are read from seven records rather than by
+scanning the journal.
+
+A DoseJournal is added to the dose queue as a listener::
+
+    journal = DoseJournal('dose_journal')
+    get_dose_queue().add_listener(journal.record)
+
+and JournalView maps both logs for reading from other threads or processes.
+
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from .history import RingLog, RingView, CHANNELS
+
+SOURCES = ('other', 'auto', 'web', 'manual', 'calibrate')  # Stored as their index
+JOURNAL_FIELDS = ('timestamp', 'channel', 'source', 'speed', 'requested', 'ran', 'wait', 'volume', 'delivered')
+TOTALS = ('doses', 'seconds', 'volume')
+DEFAULT_CAPACITY = 100000  # Doses kept in the journal
+DEFAULT_DAYS = 10 * 366  # Days of totals kept
+
+
+def journal_path(directory):
+    return os.path.join(str(directory), 'doses.bin')
+
+
+def totals_path(directory):
+    return os.path.join(str(directory), 'daily_totals.bin')
+
+
+def totals_fields(channels=CHANNELS):
+    """Return the record fields of the daily totals for a number of channels."""
+    fields = ['day']
+    for channel in range(1, channels + 1):
+        fields += ['channel{}_{}'.format(channel, total) for total in TOTALS]
+    return fields
+
+
+def source_code(source):
+    """Return the code a dose source is stored as, unknown sources are stored as "other"."""
+    return float(SOURCES.index(source)) if source in SOURCES else 0.0
+
+
+def day_start(timestamp):
+    """Return the local midnight starting the day a timestamp falls in, in epoch seconds."""
+    return datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def _optional(value):
+    return math.nan if value is None else float(value)
+
+
+class DoseJournal(object):
+    """Append-only journal of pump doses, with per-channel daily totals kept as they finish."""
+
+    def __init__(self, directory, channels=CHANNELS, capacity=DEFAULT_CAPACITY, days=DEFAULT_DAYS):
+        """Open or create a dose journal in a directory.
+
+        :param directory: Directory to store the journal and totals in, created if needed
+        :param channels: Number of pump channels
+        :param capacity: Number of doses kept before the oldest is overwritten
+        :param days: Number of days of totals kept
+
+        """
+        os.makedirs(str(directory), exist_ok=True)
+        self.directory = directory
+        self.channels = channels
+        self.log = RingLog(journal_path(directory), JOURNAL_FIELDS, capacity)
+        self.totals = RingLog(totals_path(directory), totals_fields(channels), days)
+        self._lock = threading.Lock()
+
+        latest = self.log.latest()
+        self._last = latest[0] if latest is not None else 0.0
+        latest = self.totals.latest()
+        self._day = latest[0] if latest is not None else None
+        self._today = list(latest[1:]) if latest is not None else None
+
+    def record(self, dose):
+        """Append a finished grow.dosing.Dose, and add it to its channel's total for the day."""
+        ran = dose.ran
+        delivered = dose.delivered
+
+        with self._lock:
+            # Doses finish on different threads, the journal is kept in time order for searching
+            timestamp = max(dose.finished or 0.0, self._last)
+            self._last = timestamp
+            self.log.append((timestamp, _optional(dose.channel), source_code(dose.source), dose.speed,
+                             dose.duration, _optional(ran), dose.wait, _optional(dose.volume),
+                             _optional(delivered)))
+
+            if ran is None or dose.channel is None or not 1 <= dose.channel <= self.channels:
+                return
+            day = day_start(timestamp)
+            if day != self._day:
+                self._day = day
+                self._today = [0.0] * (self.channels * len(TOTALS))
+                new_day = True
+            else:
+                new_day = False
+
+            offset = (dose.channel - 1) * len(TOTALS)
+            self._today[offset] += 1
+            self._today[offset + 1] += ran
+            if delivered is not None:
+                self._today[offset + 2] += delivered
+
+            if new_day:
+                self.totals.append([day] + self._today)
+            else:
+                self.totals.update_latest([day] + self._today)
+
+    def close(self):
+        with self._lock:
+            self.log.close()
+            self.totals.close()
+
+
+class JournalView(object):
+    """Read-only, memory-mapped view of a dose journal and its daily totals."""
+
+    def __init__(self, directory):
+        """Map a dose journal for reading.
+
+        :param directory: Directory the journal is stored in
+
+        """
+        self.log = RingView(journal_path(directory))
+        self.totals = RingView(totals_path(directory))
+        self.channels = (len(self.totals.fields) - 1) // len(TOTALS)
+
+    def stale(self):
+        """Check whether either log has been replaced since it was mapped, see RingView.stale()."""
+        return self.log.stale() or self.totals.stale()
+
+    def doses(self, start_time=None, stop_time=None, channel=None):
+        """Return the doses finished between two timestamps as a list of dicts.
+
+        :param start_time: Earliest time, in epoch seconds, defaults to the oldest dose held
+        :param stop_time: Time to stop before, defaults to now
+        :param channel: Optional channel to return doses for
+
+        """
+        doses = []
+        for row in self.log.rows(*self.log.between(start_time, stop_time)):
+            dose = dict(zip(JOURNAL_FIELDS, (None if math.isnan(value) else value for value in row)))
+            if dose['channel'] is not None:
+                dose['channel'] = int(dose['channel'])
+            if channel is not None and dose['channel'] != channel:
+                continue
+            dose['source'] = SOURCES[int(dose['source'])]
+            doses.append(dose)
+        return doses
+
+    def daily(self, start_time=None, stop_time=None):
+        """Return the daily totals of days starting between two timestamps.
+
+        Each day is a dict of its start time and, for each channel, a dict of doses, seconds and volume.
+
+        """
+        if start_time is not None:
+            start_time = day_start(start_time)
+        days = []
+        for row in self.totals.rows(*self.totals.between(start_time, stop_time)):
+            channels = {}
+            for channel in range(1, self.channels + 1):
+                offset = 1 + (channel - 1) * len(TOTALS)
+                channels[channel] = dict(zip(TOTALS, row[offset:offset + len(TOTALS)]))
+            days.append({'day': row[0], 'channels': channels})
+        return days
+
+    def summary(self, start_time=None, stop_time=None):
+        """Return each channel's doses, seconds, volume and pump duty over the days between two timestamps.
+
+        Whole days are counted, so the start time is rounded down to the start of its day. Duty is
+        the fraction of that range, from the start of the start day (or of the oldest day held)
+        to the stop time (or now), that the pump ran for.
+
+        """
+        days = self.daily(start_time, stop_time)
+        summary = dict((channel, dict((total, 0.0) for total in TOTALS + ('duty',)))
+                       for channel in range(1, self.channels + 1))
+        for day in days:
+            for channel, totals in day['channels'].items():
+                for total in TOTALS:
+                    summary[channel][total] += totals[total]
+
+        # Over the range asked for, not just the days something was pumped on
+        now = time.time()
+        first = day_start(start_time) if start_time is not None else (days[0]['day'] if days else now)
+        span = (now if stop_time is None else min(stop_time, now)) - first
+        if span > 0:
+            for totals in summary.values():
+                totals['duty'] = totals['seconds'] / span
+        return summary
+
+    def close(self):
+        self.log.close()
+        self.totals.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
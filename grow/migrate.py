@@ -0,0 +1,355 @@
+"""Migrate JSON sensor history to the ring log and columnar archives.
+
+Older monitors kept everything in JSON: a ``sensor_data.json`` holding up to
+a day of readings, and ``sensor_history/YYYY/MM/sensor_data_YYYY-MM-DD.json``
+files that the last day's readings were appended to whenever the live file
+filled up.
+
+The JSON is parsed incrementally, one reading at a time, and converted
+readings are written out in fixed size chunks, so memory use does not
+depend on file size. Day files are converted in parallel on a process pool.
+Each finished file is recorded in a checkpoint, so an interrupted migration
+picks up where it left off.
+
+Each live file kept the last hour of readings after archiving, so each day
+file starts with an hour already held by the one before it. Readings no
+newer than the previous file's last reading are dropped.
+
+A day the new monitor has already archived is merged with the JSON rather
+than replaced, keeping the archive's reading where both have one.
+
+"""
+import datetime
+import heapq
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .archive import Archive, ArchiveIndex, ArchiveWriter, archive_path, merge_stats
+from .history import CHANNELS, SensorLog, SensorRecords, sensor_fields
+
+CHECKPOINT_FILE = 'migrate.json'
+READ_SIZE = 64 * 1024  # Characters of JSON read at a time
+CHUNK_ROWS = 4096  # Records per archive chunk
+TAIL_SIZE = 8 * 1024  # Bytes read from the end of a file to find its last timestamp
+
+_DAY_FILE = re.compile(r'^sensor_data_(\d{4}-\d{2}-\d{2})\.json$')
+_TIMESTAMP = re.compile(r'"timestamp"\s*:\s*"([^"]+)"')
+
+
+class _Reader(object):
+    """Pull JSON values out of a text file a piece at a time."""
+
+    def __init__(self, file, read_size=READ_SIZE):
+        self._file = file
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            raise ValueError("Unexpected end of JSON")
+        data = self._file.read(self._read_size)
+        if not data:
+            self._eof = True
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n':
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            self._fill()
+
+    def expect(self, characters):
+        """Consume the next non-whitespace character, which must be one of characters."""
+        character = self.peek()
+        if character not in characters:
+            raise ValueError("Expected one of {!r} in JSON, found {!r}".format(characters, character))
+        self._position += 1
+        return character
+
+    def value(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                self._fill()
+                continue
+            # A number at the end of the buffer may continue in the next read
+            if end == len(self._buffer) and not self._eof:
+                self._fill()
+                continue
+            self._position = end
+            return value
+
+
+def iter_array(file, key='history', read_size=READ_SIZE):
+    """Yield the items of one array member of a top level JSON object, without loading the file.
+
+    :param file: Text file positioned at the start of the JSON
+    :param key: Name of the array member
+    :param read_size: Characters read at a time
+
+    """
+    reader = _Reader(file, read_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name != key:
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.value()
+                if reader.expect(',]') == ']':
+                    return
+        if reader.expect(',}') == '}':
+            return
+
+
+def last_timestamp(path, tail=TAIL_SIZE):
+    """Return the last reading's timestamp in a JSON history file, reading only its tail.
+
+    Returns None if no timestamp is found.
+
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - tail))
+        text = f.read().decode('utf-8', 'replace')
+    found = _TIMESTAMP.findall(text)
+    if not found:
+        return None
+    return datetime.datetime.fromisoformat(found[-1]).timestamp()
+
+
+def day_files(directory):
+    """Return (day, path) pairs for the JSON day files in a history tree, in date order."""
+    found = []
+    for root, _, files in os.walk(str(directory)):
+        for filename in files:
+            match = _DAY_FILE.match(filename)
+            if match:
+                found.append((datetime.date.fromisoformat(match.group(1)), os.path.join(root, filename)))
+    return sorted(found)
+
+
+class _Readings(SensorRecords):
+    def __init__(self, channels):
+        self.fields = sensor_fields(channels)
+
+
+def iter_records(path, after=None, channels=CHANNELS):
+    """Yield sensor records from a JSON history file in time order.
+
+    :param path: sensor_data.json or a daily history file
+    :param after: Skip readings at or before this timestamp
+    :param channels: Number of moisture channels to convert
+
+    """
+    readings = _Readings(channels)
+    with open(path, 'r') as f:
+        for reading in iter_array(f):
+            record = readings.encode(reading)
+            if after is not None and record[0] <= after:
+                continue
+            after = record[0]
+            yield record
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _archived_records(archive, fields):
+    """Yield an archive's records rearranged to fields, NaN filling fields it doesn't have."""
+    if archive.fields == fields:
+        return archive.records()
+    columns = [archive.fields.index(name) if name in archive.fields else None for name in fields]
+    return (tuple(math.nan if column is None else record[column] for column in columns)
+            for record in archive.records())
+
+
+def merge_records(archived, converted):
+    """Merge two streams of records in time order, keeping the archived record where both have a timestamp."""
+    last = None
+    for record in heapq.merge(archived, converted, key=lambda record: record[0]):
+        if record[0] == last:
+            continue
+        last = record[0]
+        yield record
+
+
+def convert_day_file(source, destination, after=None, channels=CHANNELS, compression='zlib', encoding='plain'):
+    """Convert one JSON day file to a columnar archive.
+
+    The archive is written alongside the destination and moved into place
+    once complete, so an interrupted conversion leaves no partial archive.
+    An existing archive for the day, eg: written by the monitor since it was
+    upgraded, is merged with the converted readings rather than replaced.
+    Returns the day index entry for the archive, without its file name.
+
+    :param source: JSON day file
+    :param destination: Archive file to create, or merge into if it exists
+    :param after: Skip readings at or before this timestamp
+    :param channels: Number of moisture channels to convert
+    :param compression: Archive compression, see ArchiveWriter
+    :param encoding: Archive encoding, see ArchiveWriter
+
+    """
+    fields = sensor_fields(channels)
+    entry = {'records': 0, 'first': None, 'last': None, 'min': {}, 'max': {}}
+    temp = str(destination) + '.part'
+    if os.path.exists(temp):
+        os.remove(temp)
+
+    existing = Archive(destination) if os.path.exists(str(destination)) else None
+    try:
+        records = iter_records(source, after, channels)
+        if existing is not None:
+            records = merge_records(_archived_records(existing, fields), records)
+        with ArchiveWriter(temp, fields, compression, encoding) as archive:
+            for batch in _batches(records, CHUNK_ROWS):
+                archive.append(batch)
+                merge_stats(entry, fields, batch)
+    finally:
+        if existing is not None:
+            existing.close()
+
+    os.replace(temp, str(destination))
+    return entry
+
+
+def convert_sensor_log(source, destination, after=None, channels=CHANNELS):
+    """Convert a live sensor_data.json to a sensor ring log.
+
+    Returns the number of records written.
+
+    :param source: The sensor_data.json file
+    :param destination: Ring log file to create, replacing any existing one
+    :param after: Skip readings at or before this timestamp, eg: those already archived
+    :param channels: Number of moisture channels to convert
+
+    """
+    temp = str(destination) + '.part'
+    if os.path.exists(temp):
+        os.remove(temp)
+
+    count = 0
+    with SensorLog(temp, channels) as log:
+        for batch in _batches(iter_records(source, after, channels), CHUNK_ROWS):
+            log.extend(batch)
+            count += len(batch)
+
+    os.replace(temp, str(destination))
+    return count
+
+
+class Migration(object):
+    """Resumable migration of a JSON history tree, and optionally the live JSON file."""
+
+    def __init__(self, history_dir, output_dir=None, channels=CHANNELS, compression='zlib', encoding='plain'):
+        """Prepare a migration.
+
+        :param history_dir: Root of the sensor_history/YYYY/MM/ JSON day files
+        :param output_dir: Root of the archive tree to write, defaults to history_dir
+        :param channels: Number of moisture channels to convert
+        :param compression: Archive compression, see ArchiveWriter
+        :param encoding: Archive encoding, see ArchiveWriter
+
+        """
+        self.history_dir = str(history_dir)
+        self.output_dir = str(output_dir if output_dir is not None else history_dir)
+        self.channels = channels
+        self.compression = compression
+        self.encoding = encoding
+        self.checkpoint_path = os.path.join(self.output_dir, CHECKPOINT_FILE)
+        self.checkpoint = {'days': {}, 'sensor_log': None}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                self.checkpoint.update(json.load(f))
+
+    def _save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp = self.checkpoint_path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.checkpoint, f, indent=1, sort_keys=True)
+        os.replace(temp, self.checkpoint_path)
+
+    def pending(self):
+        """Return (day, source, destination, after) for each day file not yet converted."""
+        pending = []
+        previous = None
+        for day, path in day_files(self.history_dir):
+            if day.isoformat() not in self.checkpoint['days']:
+                after = last_timestamp(previous) if previous else None
+                pending.append((day, path, archive_path(self.output_dir, day), after))
+            previous = path
+        return pending
+
+    def run_days(self, workers=None, progress=None):
+        """Convert every pending day file on a pool of worker processes.
+
+        Returns the number of files converted.
+
+        :param workers: Number of processes, defaults to one per CPU
+        :param progress: Called with (day, entry) as each file completes
+
+        """
+        pending = self.pending()
+        if not pending:
+            return 0
+
+        index = ArchiveIndex(self.output_dir)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = dict((pool.submit(convert_day_file, source, destination, after,
+                                        self.channels, self.compression, self.encoding), (day, destination))
+                           for day, source, destination, after in pending)
+            for future in as_completed(futures):
+                day, destination = futures[future]
+                entry = future.result()
+                entry['file'] = os.path.relpath(destination, self.output_dir)
+                index.days[day.isoformat()] = entry
+                index.save()
+                self.checkpoint['days'][day.isoformat()] = entry['last']
+                self._save()
+                if progress is not None:
+                    progress(day, entry)
+        return len(pending)
+
+    def run_sensor_log(self, source, destination):
+        """Convert the live sensor_data.json to a ring log, skipping readings already archived.
+
+        Returns the number of records written, or None if it was converted by an earlier run.
+
+        """
+        if self.checkpoint['sensor_log'] is not None:
+            return None
+        days = day_files(self.history_dir)
+        after = last_timestamp(days[-1][1]) if days else None
+        count = convert_sensor_log(source, destination, after, self.channels)
+        self.checkpoint['sensor_log'] = count
+        self._save()
+        return count
@@ -1,45 +1,77 @@
 import time
+from array import array
 
-import RPi.GPIO as GPIO
+from .frequency import DEFAULT_PRECISION, NO_READING, PeriodStats
+from .gpio import get_backend
+from .snapshot import SnapshotPublisher
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 MOISTURE_1_PIN = 23
 MOISTURE_2_PIN = 8
 MOISTURE_3_PIN = 25
 MOISTURE_INT_PIN = 4
 
+HISTORY_LENGTH = 200
+MIN_GATE = 1.0  # Shortest time a reading is measured over, in seconds
+MAX_GATE = 10.0  # Longest time a reading is measured over, however imprecise
+
+
+class Moisture(SnapshotPublisher):
+    """Grow moisture sensor driver.
 
-class Moisture(object):
-    """Grow moisture sensor driver."""
+    Each new reading, and each wet/dry point change, is published as an immutable
+    grow.snapshot.Snapshot, which other threads can read with snapshot() without locking.
 
-    def __init__(self, channel=1, wet_point=None, dry_point=None):
+    """
+
+    def __init__(self, channel=1, wet_point=None, dry_point=None, precision=DEFAULT_PRECISION,
+                 min_gate=MIN_GATE, max_gate=MAX_GATE):
         """Create a new moisture sensor.
 
-        Uses an interrupt to count pulses on the GPIO pin corresponding to the selected channel.
+        Uses an interrupt to count pulses on the GPIO pin corresponding to the selected channel,
+        through the GPIO backend returned by grow.gpio.get_backend().
 
-        The moisture reading is given as pulses per second.
+        The moisture reading is given as pulses per second. Each reading is measured over at
+        least min_gate seconds, extended until the spread of the pulse periods gives the
+        target precision or max_gate seconds have passed.
 
         :param channel: One of 1, 2 or 3. 4 can optionally be used to set up a sensor on the Int pin (BCM4)
         :param wet_point: Wet point in pulses/sec
         :param dry_point: Dry point in pulses/sec
+        :param precision: Target half width of the 95% confidence interval, relative to the reading
+        :param min_gate: Shortest time a reading is measured over, in seconds
+        :param max_gate: Longest time a reading is measured over, in seconds
 
         """
         self._gpio_pin = [MOISTURE_1_PIN, MOISTURE_2_PIN, MOISTURE_3_PIN, MOISTURE_INT_PIN][channel - 1]
 
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self._gpio_pin, GPIO.IN)
+        self._gpio = get_backend()
 
         self._count = 0
         self._reading = 0
-        self._history = []
-        self._history_length = 200
+        self._precision = precision
+        self._min_gate = min_gate
+        self._max_gate = max_gate
+        self._periods = PeriodStats()
+        self._last_edge = None
+        self._estimate = NO_READING
+        # Readings in pulses/sec, in a fixed size ring. _history_head is the next slot written.
+        self._history_length = HISTORY_LENGTH
+        self._history = array('f', [0.0]) * self._history_length
+        self._history_head = 0
+        self._history_size = 0
         self._last_pulse = time.time()
         self._new_data = False
         self._wet_point = wet_point if wet_point is not None else 0.7
         self._dry_point = dry_point if dry_point is not None else 27.6
         self._time_last_reading = time.time()
         try:
-            GPIO.add_event_detect(self._gpio_pin, GPIO.RISING, callback=self._event_handler, bouncetime=1)
+            self._gpio.setup_input(self._gpio_pin)
+            self._callback = self._gpio.add_edge_callback(self._gpio_pin, self._event_handler)
         except RuntimeError as e:
             if self._gpio_pin == 8:
                 raise RuntimeError("""Unable to set up edge detection on BCM8.
@@ -54,27 +86,69 @@ dtoverlay=spi0-cs,cs0_pin=14 # Re-assign CS0 from BCM 8 so that Grow can use it
 
         self._time_start = time.time()
 
-    def _event_handler(self, pin):
+    def _event_handler(self, pin, tick=None):
+        now = time.time()
+        # Periods come from the backend's edge timestamps where it has them, which
+        # lgpio takes in the kernel, unaffected by callback latency
+        edge = now if tick is None else tick * 1e-9
         self._count += 1
-        self._last_pulse = time.time()
-        if self._time_elapsed >= 1.0:
-            self._reading = self._count / self._time_elapsed
-            self._history.insert(0, self._reading)
-            self._history = self._history[:self._history_length]
+        self._last_pulse = now
+        if self._last_edge is not None:
+            self._periods.add(edge - self._last_edge)
+        self._last_edge = edge
+
+        elapsed = now - self._time_last_reading
+        if elapsed >= self._min_gate and (elapsed >= self._max_gate or
+                                          self._periods.relative_error() <= self._precision):
+            self._reading = self._count / elapsed
+            self._estimate = self._periods.reading(self._reading, self._count)
+            self._periods.reset()
+            self._history[self._history_head] = self._reading
+            self._history_head = (self._history_head + 1) % self._history_length
+            self._history_size = min(self._history_size + 1, self._history_length)
             self._count = 0
-            self._time_last_reading = time.time()
+            self._time_last_reading = now
             self._new_data = True
+            self._update_snapshot()
 
     @property
     def history(self):
-        history = []
+        """Return the saturation history, newest first.
+
+        Computed once per reading or wet/dry point change, as part of the latest snapshot.
+
+        """
+        return self.snapshot().history
+
+    def _update_snapshot(self):
+        return self._publish(self._snapshot_fields)
+
+    def _snapshot_fields(self):
+        reading = self._reading
+        return reading, self._saturation(reading), self._active(reading), self._estimate, self._saturations()
 
-        for moisture in self._history:
-            saturation = float(moisture - self._dry_point) / self.range
-            saturation = round(saturation, 3)
-            history.append(max(0.0, min(1.0, saturation)))
+    def snapshot(self):
+        """Return the latest Snapshot of the sensor's state.
 
-        return history
+        Once pulses stop arriving, a snapshot that was active is republished as inactive.
+
+        """
+        snapshot = self._snapshot
+        if snapshot.active and not self._active(snapshot.moisture):
+            snapshot = self._update_snapshot()
+        return snapshot
+
+    def _saturations(self):
+        head, size = self._history_head, self._history_size
+        if numpy is not None:
+            readings = numpy.frombuffer(self._history, dtype=numpy.float32).astype(numpy.float64)
+            readings = numpy.concatenate((readings[head:size], readings[:head]))[::-1]
+            saturation = numpy.round((readings - self._dry_point) / self.range, 3)
+            return numpy.clip(saturation, 0.0, 1.0).tolist()
+
+        readings = list(self._history[head:size]) + list(self._history[:head])
+        return [max(0.0, min(1.0, round(float(moisture - self._dry_point) / self.range, 3)))
+                for moisture in reversed(readings)]
 
     @property
     def _time_elapsed(self):
@@ -91,6 +165,7 @@ dtoverlay=spi0-cs,cs0_pin=14 # Re-assign CS0 from BCM 8 so that Grow can use it
 
         """
         self._wet_point = value if value is not None else self._reading
+        self._update_snapshot()
 
     def set_dry_point(self, value=None):
         """Set the sensor dry point.
@@ -103,6 +178,7 @@ dtoverlay=spi0-cs,cs0_pin=14 # Re-assign CS0 from BCM 8 so that Grow can use it
 
         """
         self._dry_point = value if value is not None else self._reading
+        self._update_snapshot()
 
     @property
     def moisture(self):
@@ -120,10 +196,23 @@ dtoverlay=spi0-cs,cs0_pin=14 # Re-assign CS0 from BCM 8 so that Grow can use it
         self._new_data = False
         return self._reading
 
+    @property
+    def reading(self):
+        """Return the last reading as a grow.frequency.Reading.
+
+        This gives the moisture level in pulses/sec, the bounds of its 95% confidence
+        interval and the number of pulses it was measured from.
+
+        """
+        return self._estimate
+
     @property
     def active(self):
         """Check if the moisture sensor is producing a valid reading."""
-        return (time.time() - self._last_pulse) < 1.0 and self._reading > 0 and self._reading < 28
+        return self._active(self._reading)
+
+    def _active(self, reading):
+        return (time.time() - self._last_pulse) < 1.0 and 0 < reading < 28
 
     @property
     def new_data(self):
@@ -146,6 +235,9 @@ dtoverlay=spi0-cs,cs0_pin=14 # Re-assign CS0 from BCM 8 so that Grow can use it
         This value is calculated using the wet and dry points.
 
         """
-        saturation = float(self.moisture - self._dry_point) / self.range
+        return self._saturation(self.moisture)
+
+    def _saturation(self, moisture):
+        saturation = float(moisture - self._dry_point) / self.range
         saturation = round(saturation, 3)
         return max(0.0, min(1.0, saturation))
@@ -1,8 +1,7 @@
 import atexit
-import threading
-import time
 
-import RPi.GPIO as GPIO
+from .dosing import get_dose_queue
+from .gpio import get_backend
 
 PUMP_1_PIN = 17
 PUMP_2_PIN = 27
@@ -11,49 +10,57 @@ PUMP_PWM_FREQ = 10000
 PUMP_MAX_DUTY = 90
 
 
-global_lock = threading.Lock()
-
-
 class Pump(object):
     """Grow pump driver."""
 
-    def __init__(self, channel=1):
+    def __init__(self, channel=1, queue=None, flow_model=None):
         """Create a new pump.
 
-        Uses soft PWM to drive a Grow pump.
+        Uses PWM from the GPIO backend returned by grow.gpio.get_backend() to drive a Grow pump.
+        Doses go through a grow.dosing.DoseQueue, which limits how many pumps run at once.
 
         :param channel: One of 1, 2 or 3.
+        :param queue: DoseQueue to run doses through, defaults to the queue shared by all pumps
+        :param flow_model: Optional grow.flow.FlowModel, from calibration, for dosing by volume
 
         """
 
+        self.channel = channel
         self._gpio_pin = [PUMP_1_PIN, PUMP_2_PIN, PUMP_3_PIN][channel - 1]
 
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self._gpio_pin, GPIO.OUT, initial=GPIO.LOW)
-        self._pwm = GPIO.PWM(self._gpio_pin, PUMP_PWM_FREQ)
+        self._gpio = get_backend()
+        self._gpio.setup_output(self._gpio_pin, 0)
+        self._pwm = self._gpio.pwm(self._gpio_pin, PUMP_PWM_FREQ)
         self._pwm.start(0)
 
-        self._timeout = None
+        self._queue = queue if queue is not None else get_dose_queue()
+        self._speed = 0
+        self.flow_model = flow_model
 
         atexit.register(self._stop)
 
     def _stop(self):
-        self._pwm.stop(0)
-        GPIO.setup(self._gpio_pin, GPIO.IN)
+        self._queue.cancel(self)
+        self._pwm.stop()
+        self._gpio.release(self._gpio_pin)
 
     def set_speed(self, speed):
-        """Set pump speed (PWM duty cycle)."""
+        """Set pump speed (PWM duty cycle).
+
+        Runs the pump outside the dose queue. Returns False, leaving the pump off,
+        if as many pumps as the queue allows are already running.
+
+        """
         if speed > 1.0 or speed < 0:
             raise ValueError("Speed must be between 0 and 1")
 
-        if speed == 0:
-            global_lock.release()
-        elif not global_lock.acquire(blocking=False):
+        if speed > 0 and not self._queue.acquire(self):
             return False
 
-        self._pwm.ChangeDutyCycle(int(PUMP_MAX_DUTY * speed))
+        self._pwm.set_duty(int(PUMP_MAX_DUTY * speed))
         self._speed = speed
+        if speed == 0:
+            self._queue.release(self)
         return True
 
     def get_speed(self):
@@ -61,36 +68,79 @@ class Pump(object):
         return self._speed
 
     def stop(self):
-        """Stop the pump."""
-        if self._timeout is not None:
-            self._timeout.cancel()
-            self._timeout = None
+        """Stop the pump, and cancel any of its doses still queued."""
+        self._queue.cancel(self)
         self.set_speed(0)
 
-    def dose(self, speed, timeout=0.1, blocking=True, force=False):
+    def dose(self, speed, timeout=0.1, blocking=True, force=False, source=None):
         """Pulse the pump for timeout seconds.
 
+        The dose is queued until the pump, and a slot in the dose queue, are free.
+
+        Returns the grow.dosing.Dose, a concurrent.futures.Future resolved with the seconds
+        the pump ran for.
+
         :param timeout: Timeout, in seconds, of the pump pulse
         :param blocking: If true, function will block until pump has stopped
-        :param force: Applies only to non-blocking. If true, any previous dose will be replaced
+        :param force: If true, any previous dose will be replaced
+        :param source: Optional label for what requested the dose, eg: "auto" or "web"
 
         """
+        if force:
+            self.stop()
 
+        dose = self._queue.submit(self, speed, timeout, source)
         if blocking:
-            if self.set_speed(speed):
-                time.sleep(timeout)
-                self.stop()
-                return True
-
-        else:
-            if self._timeout is not None:
-                if self._timeout.is_alive():
-                    if force:
-                        self._timeout.cancel()
-
-            self._timeout = threading.Timer(timeout, self.stop)
-            if self.set_speed(speed):
-                self._timeout.start()
-                return True
-
-        return False
+            dose.result()
+        return dose
+
+    def dose_pulse(self, speed, timeout=0.1, callback=None, source=None):
+        """Pulse the pump for timeout seconds without blocking.
+
+        The pulse is timed by the GPIO backend where it can be (lgpio), otherwise by the
+        shared scheduler thread, so no thread waits for the dose to finish.
+
+        Returns the grow.dosing.Dose, a concurrent.futures.Future resolved with the seconds
+        the pump ran for.
+
+        :param speed: Speed of the pump, from 0.0 to 1.0
+        :param timeout: Timeout, in seconds, of the pump pulse
+        :param callback: Optional callable, called with the Dose once it has finished
+        :param source: Optional label for what requested the dose, eg: "auto" or "web"
+
+        """
+        return self._queue.submit(self, speed, timeout, source, callback)
+
+    def dose_volume(self, volume, speed=None, blocking=False, callback=None, source=None):
+        """Dose a volume of water, timed using the pump's flow model.
+
+        Returns the grow.dosing.Dose, a concurrent.futures.Future resolved with the seconds
+        the pump ran for.
+
+        :param volume: Volume of water, in ml
+        :param speed: Speed of the pump, defaults to the speed the flow model was calibrated for
+        :param blocking: If true, function will block until pump has stopped
+        :param callback: Optional callable, called with the Dose once it has finished
+        :param source: Optional label for what requested the dose, eg: "auto" or "web"
+
+        """
+        if self.flow_model is None:
+            raise ValueError("Pump {} has no flow model, calibrate it to dose by volume".format(self.channel))
+
+        speed = self.flow_model.speed if speed is None else speed
+        timeout = self.flow_model.seconds(volume, speed)
+        dose = self._queue.submit(self, speed, timeout, source, callback, volume)
+        if blocking:
+            dose.result()
+        return dose
+
+    def _pulse(self, speed, duration):
+        """Run a dose from the queue."""
+        self._speed = speed
+        pulse = self._pwm.pulse(int(PUMP_MAX_DUTY * speed), duration)
+        pulse.add_done_callback(self._pulse_done)
+        return pulse
+
+    def _pulse_done(self, pulse):
+        if self._pwm.duty == 0:
+            self._speed = 0
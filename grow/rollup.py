@@ -0,0 +1,212 @@
+"""Multi-resolution rollups of sensor history.
+
+Each reading updates a min/max/mean/count bucket in every tier as it is
+ingested. A tier is a ring log of its own, so every tier is bounded and can
+be mapped by readers with RingView just like the raw sensor log. The bucket
+currently being filled is kept up to date in place as the latest record.
+
+"""
+import logging
+import math
+import os
+
+from .history import RingLog, CHANNELS
+
+# (bucket seconds, buckets kept): one day of seconds, 30 days of minutes, 5 years of hours
+DEFAULT_TIERS = ((1, 24 * 60 * 60), (60, 30 * 24 * 60), (60 * 60, 5 * 365 * 24))
+STATS = ('count', 'min', 'max', 'mean')
+CONVERT_BATCH = 10000  # Records copied at a time when converting a tier to new fields
+
+
+def sensor_series(channels=CHANNELS):
+    """Return the sensor log fields worth rolling up.
+
+    The mean of an alarm series is the fraction of the bucket spent in alarm.
+
+    """
+    series = ['lux', 'proximity']
+    for channel in range(1, channels + 1):
+        series += ['channel{}_moisture'.format(channel), 'channel{}_alarm'.format(channel)]
+    return series
+
+
+def rollup_fields(series):
+    """Return the record fields of a tier rolling up the given series."""
+    fields = ['timestamp']
+    for name in series:
+        fields += ['{}_{}'.format(name, stat) for stat in STATS]
+    return fields
+
+
+def tier_path(directory, resolution):
+    """Return the file a tier of the given resolution is stored in."""
+    return os.path.join(str(directory), 'rollup_{}s.bin'.format(resolution))
+
+
+def choose_tier(resolutions, start_time, stop_time, points):
+    """Pick the finest resolution that covers a time range in no more than points buckets.
+
+    Falls back to the coarsest resolution if none are coarse enough.
+
+    """
+    span = max(0.0, stop_time - start_time)
+    for resolution in sorted(resolutions):
+        if span / resolution <= points:
+            return resolution
+    return max(resolutions)
+
+
+def convert_tier(path, fields, capacity):
+    """Rewrite a tier file stored with other fields, eg: before a series was added.
+
+    Columns are copied across by name, new series start with a count of 0 and
+    NaN stats. Returns True if the file was rewritten.
+
+    """
+    path = str(path)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    old = RingLog(path, readonly=True)
+    try:
+        if old.fields == list(fields):
+            return False
+        columns = [old.fields.index(name) if name in old.fields else None for name in fields]
+        missing = [0.0 if name.endswith('_count') else math.nan for name in fields]
+
+        temp = path + '.tmp'
+        if os.path.exists(temp):
+            os.remove(temp)
+        new = RingLog(temp, fields, capacity)
+        try:
+            batch = []
+            for record in old.records():
+                batch.append([missing[i] if column is None else record[column] for i, column in enumerate(columns)])
+                if len(batch) >= CONVERT_BATCH:
+                    new.extend(batch)
+                    batch = []
+            new.extend(batch)
+        finally:
+            new.close()
+    finally:
+        old.close()
+
+    os.replace(temp, path)
+    logging.info("Converted {} to fields {}".format(path, list(fields)))
+    return True
+
+
+class Tier(object):
+    """A single rollup resolution."""
+
+    def __init__(self, path, series, resolution, capacity):
+        """Open or create a rollup tier.
+
+        :param path: File to store the tier in
+        :param series: Names of the series to roll up
+        :param resolution: Bucket width in seconds
+        :param capacity: Number of buckets kept
+
+        """
+        self.series = list(series)
+        self.resolution = resolution
+        fields = rollup_fields(self.series)
+        convert_tier(path, fields, capacity)
+        self.log = RingLog(path, fields, capacity)
+        self._bucket = None
+        self._stats = None
+        self.last = None  # Time of the last reading folded in
+
+        latest = self.log.latest()
+        if latest is not None:
+            self._bucket = latest[0]
+            self._stats = [list(latest[1 + i * 4:5 + i * 4]) for i in range(len(self.series))]
+            for stats in self._stats:
+                # Resume the running sum from the stored mean, which is NaN for a series with no samples yet
+                stats[3] = stats[3] * stats[0] if stats[0] else 0.0
+
+    def _record(self, bucket, stats):
+        values = [bucket]
+        for count, low, high, total in stats:
+            values += [count, low, high, total / count if count else math.nan]
+        return values
+
+    def add(self, timestamp, values):
+        """Fold a reading into its bucket.
+
+        Readings at or before the last one folded in are skipped, so a batch retried
+        after a failure is only counted once.
+
+        :param timestamp: Reading time in epoch seconds
+        :param values: Mapping of series name to value, NaN or missing values are skipped
+
+        """
+        if self.last is not None and timestamp <= self.last:
+            return
+
+        bucket = math.floor(timestamp / self.resolution) * self.resolution
+        new_bucket = bucket != self._bucket
+        if new_bucket:
+            stats = [[0, math.nan, math.nan, 0.0] for _ in self.series]
+        else:
+            stats = [list(series) for series in self._stats]
+
+        for series, name in zip(stats, self.series):
+            value = values.get(name, math.nan)
+            if math.isnan(value):
+                continue
+            if series[0] == 0:
+                series[1] = series[2] = value
+            else:
+                series[1] = min(series[1], value)
+                series[2] = max(series[2], value)
+            series[0] += 1
+            series[3] += value
+
+        # Only kept once written, so a failed write leaves the bucket as it was stored
+        record = self._record(bucket, stats)
+        if new_bucket:
+            self.log.append(record)
+        else:
+            self.log.update_latest(record)
+        self._bucket = bucket
+        self._stats = stats
+        self.last = timestamp
+
+    def close(self):
+        self.log.close()
+
+
+class Rollups(object):
+    """A set of rollup tiers updated together on ingest."""
+
+    def __init__(self, directory, series=None, tiers=DEFAULT_TIERS):
+        """Open or create rollup tiers in a directory.
+
+        :param directory: Directory to store tier files in, created if needed
+        :param series: Names of the series to roll up, defaults to light and moisture
+        :param tiers: Sequence of (resolution, capacity) pairs
+
+        """
+        os.makedirs(str(directory), exist_ok=True)
+        series = sensor_series() if series is None else series
+        self.directory = directory
+        self.tiers = [Tier(tier_path(directory, resolution), series, resolution, capacity)
+                      for resolution, capacity in tiers]
+
+    @property
+    def resolutions(self):
+        return [tier.resolution for tier in self.tiers]
+
+    def add(self, timestamp, values):
+        """Fold a reading into every tier.
+
+        :param timestamp: Reading time in epoch seconds
+        :param values: Mapping of series name to value, eg: a sensor log record zipped with its fields
+
+        """
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
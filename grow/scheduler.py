@@ -0,0 +1,192 @@
+"""Timed actuator events on a single thread.
+
+Turning a pump or piezo off after a delay used to cost a thread, or a
+threading.Timer, per dose or beep. Instead, every actuator schedules its
+timed events on one shared Scheduler, which keeps them in a heap ordered
+by due time and runs them, one after another, on its single scheduler
+thread as they fall due. However many doses are requested, there is one
+thread, and an event added while it is waiting wakes it immediately if the
+new event is due sooner.
+
+Events can be cancelled, and can be given a key, such as the actuator they
+belong to, so that scheduling with replace=True first cancels anything
+still pending for that key.
+
+Event actions should be quick, eg: a GPIO write. Long running actions
+delay every event behind them.
+
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class Event(object):
+    """An action scheduled to run at a time.monotonic() time."""
+
+    def __init__(self, scheduler, when, action, args, key):
+        self._scheduler = scheduler
+        self.when = when
+        self.action = action
+        self.args = args
+        self.key = key
+        self.cancelled = False
+        self.done = False
+
+    @property
+    def pending(self):
+        """Check if the event has yet to run, and has not been cancelled."""
+        return not (self.cancelled or self.done)
+
+    def cancel(self):
+        """Cancel the event, returns False if it has already run."""
+        return self._scheduler.cancel(self)
+
+
+class Scheduler(object):
+    """Run timed events from a heap on one background thread."""
+
+    def __init__(self, name='Scheduler'):
+        """Create a scheduler, its thread starts with the first event.
+
+        :param name: Name of the scheduler thread
+
+        """
+        self.name = name
+        self._heap = []
+        self._keys = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = True
+
+        self.runs = 0
+        self.errors = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def call_later(self, delay, action, *args, key=None, replace=False):
+        """Schedule action(*args) to run after delay seconds.
+
+        :param delay: Delay, in seconds
+        :param action: Callable to run on the scheduler thread
+        :param key: Optional key to group events by, eg: the actuator they control
+        :param replace: If true, cancel any pending events with the same key first
+
+        """
+        return self.call_at(time.monotonic() + delay, action, *args, key=key, replace=replace)
+
+    def call_at(self, when, action, *args, key=None, replace=False):
+        """Schedule action(*args) to run at a time.monotonic() time.
+
+        Takes the same keyword arguments as call_later().
+
+        """
+        event = Event(self, when, action, args, key)
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Scheduler has been stopped")
+            if replace and key is not None:
+                self._cancel_key(key)
+            heapq.heappush(self._heap, (when, next(self._counter), event))
+            if key is not None:
+                self._keys.setdefault(key, set()).add(event)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._heap[0][2] is event:
+                self._condition.notify()
+        return event
+
+    def cancel(self, event):
+        """Cancel a pending event, returns False if it has already run."""
+        with self._condition:
+            if event.done:
+                return False
+            self._cancel(event)
+            return True
+
+    def cancel_key(self, key):
+        """Cancel all pending events with a key, returns the number cancelled."""
+        with self._condition:
+            return self._cancel_key(key)
+
+    def pending(self, key=None):
+        """Return pending events in the order they will run, optionally only those with a key."""
+        with self._condition:
+            events = self._keys.get(key, ()) if key is not None else [entry[2] for entry in self._heap]
+            return sorted((event for event in events if event.pending), key=lambda event: event.when)
+
+    def _cancel(self, event):
+        # Cancelled events stay in the heap and are skipped when they reach the top
+        event.cancelled = True
+        self._forget(event)
+
+    def _cancel_key(self, key):
+        events = self._keys.pop(key, ())
+        for event in events:
+            event.cancelled = True
+        return len(events)
+
+    def _forget(self, event):
+        events = self._keys.get(event.key)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del self._keys[event.key]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._running:
+                        return
+                    if self._heap:
+                        delay = self._heap[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+                when, _, event = heapq.heappop(self._heap)
+                event.done = True
+                self._forget(event)
+
+            lateness = time.monotonic() - when
+            try:
+                event.action(*event.args)
+            except Exception as e:
+                logging.error("Scheduled event {!r} failed: {}".format(event.action, e))
+                self.errors += 1
+            self.runs += 1
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+
+    def stop(self, timeout=1.0):
+        """Stop the scheduler thread, discarding any pending events."""
+        with self._condition:
+            self._running = False
+            for _, _, event in self._heap:
+                event.cancelled = True
+            self._heap = []
+            self._keys = {}
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def get_scheduler():
+    """Return the scheduler shared by all actuators, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
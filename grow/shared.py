@@ -0,0 +1,146 @@
+"""Latest sensor readings shared between processes.
+
+One process writes records into a named shared memory block, any number of
+others read them without locks. The block holds a ring of recent records
+guarded by a sequence counter (a seqlock): the writer makes the counter
+odd, writes, then makes it even again. A reader copies what it needs and
+retries if the counter was odd or changed while it was copying, so readers
+never block the writer and never see a half written record.
+
+Layout, all little-endian::
+
+    header   magic, version, field count, capacity, names length, sequence, written
+    names    field names, '\n' separated, padded to 8 bytes
+    records  capacity * field count float64
+
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+MAGIC = b'GRWS'
+VERSION = 1
+DEFAULT_CAPACITY = 600
+
+_HEADER = struct.Struct('<4sHHIIQQ')  # magic, version, field count, capacity, names length, sequence, written
+_COUNTERS = struct.Struct('<QQ')  # sequence, written
+_COUNTERS_OFFSET = 16
+_RETRY_DELAY = 0.0001
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource tracker,
+        # which would unlink it when this process exits
+        memory = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        except Exception:
+            pass
+        return memory
+
+
+class SharedReadings(object):
+    """Ring of recent records in shared memory, written by one process and read by many."""
+
+    def __init__(self, name, fields=None, capacity=DEFAULT_CAPACITY):
+        """Create or attach to a shared readings block.
+
+        :param name: Name of the shared memory block
+        :param fields: Field names, to create the block and become its writer. Leave as None to attach as a reader.
+        :param capacity: Number of records kept, when creating
+
+        """
+        self.name = name
+        self._owner = fields is not None
+
+        if self._owner:
+            self.fields = list(fields)
+            self.capacity = capacity
+            names = '\n'.join(self.fields).encode('utf-8')
+            self._offset = _HEADER.size + (len(names) + 7) // 8 * 8
+            size = self._offset + capacity * len(self.fields) * 8
+            try:
+                # Replace a block left behind by a writer that didn't shut down cleanly
+                stale = _attach(name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _HEADER.pack_into(self._memory.buf, 0, MAGIC, VERSION, len(self.fields), capacity, len(names), 0, 0)
+            self._memory.buf[_HEADER.size:_HEADER.size + len(names)] = names
+        else:
+            self._memory = _attach(name)
+            magic, version, count, self.capacity, length, _, _ = _HEADER.unpack_from(self._memory.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                self._memory.close()
+                raise ValueError("{} is not a shared readings block".format(name))
+            self.fields = bytes(self._memory.buf[_HEADER.size:_HEADER.size + length]).decode('utf-8').split('\n')
+            self._offset = _HEADER.size + (length + 7) // 8 * 8
+
+        self._record = struct.Struct('<{}d'.format(len(self.fields)))
+
+    def _counters(self):
+        return _COUNTERS.unpack_from(self._memory.buf, _COUNTERS_OFFSET)
+
+    def write(self, values):
+        """Publish a record, only the process that created the block may write.
+
+        :param values: Sequence of floats in field order
+
+        """
+        sequence, written = self._counters()
+        buf = self._memory.buf
+        _COUNTERS.pack_into(buf, _COUNTERS_OFFSET, sequence + 1, written)
+        self._record.pack_into(buf, self._offset + (written % self.capacity) * self._record.size, *values)
+        _COUNTERS.pack_into(buf, _COUNTERS_OFFSET, sequence + 2, written + 1)
+
+    def _read(self, count):
+        """Copy the last count records, retrying until a consistent copy is made."""
+        buf = self._memory.buf
+        while True:
+            sequence, written = self._counters()
+            if sequence % 2:
+                time.sleep(_RETRY_DELAY)
+                continue
+            count = min(count, written, self.capacity)
+            records = []
+            for position in range(written - count, written):
+                records.append(self._record.unpack_from(buf, self._offset + (position % self.capacity) * self._record.size))
+            if self._counters()[0] == sequence:
+                return records
+
+    @property
+    def written(self):
+        """Return the number of records written since the block was created."""
+        return self._counters()[1]
+
+    def latest(self):
+        """Return the most recent record, or None if nothing has been written."""
+        records = self._read(1)
+        return records[0] if records else None
+
+    def history(self, count=None):
+        """Return up to count of the most recent records, oldest first.
+
+        :param count: Number of records, defaults to the whole ring
+
+        """
+        return self._read(self.capacity if count is None else count)
+
+    def close(self):
+        """Detach from the block, the writer also removes it."""
+        self._record = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,65 @@
+"""Immutable snapshots of sensor state.
+
+Drivers update their state from GPIO callback threads. Rather than have
+readers lock, or read fields one at a time while they change underneath
+them, each update is published as a new Snapshot and swapped in with a
+single assignment. A reader holding a snapshot sees a consistent set of
+values however far the driver has moved on, and can compare sequence
+numbers to see if anything has changed since it last looked.
+
+"""
+import threading
+import time
+from collections import namedtuple
+
+from .frequency import NO_READING
+
+Snapshot = namedtuple('Snapshot', ('sequence', 'timestamp', 'moisture', 'saturation', 'active', 'reading', 'history'))
+Snapshot.__doc__ = """Sensor state at one update.
+
+sequence increases by one with every update, timestamp is the time.time()
+of the update, reading is a grow.frequency.Reading and history is a tuple
+of saturation readings, newest first.
+
+"""
+
+EMPTY = Snapshot(0, None, 0.0, 0.0, False, NO_READING, ())
+
+
+class SnapshotPublisher(object):
+    """Mixin publishing a driver's state as a sequence of Snapshots.
+
+    Writers call _publish() with a function returning the snapshot's fields,
+    which is called under a lock. Readers call snapshot(), which never blocks.
+
+    """
+
+    _snapshot = EMPTY
+
+    def _publish(self, fields):
+        """Publish a new snapshot of the sensor's state and return it.
+
+        :param fields: Function returning moisture, saturation, active, reading and history. It is
+            called with the lock held, so a snapshot numbered later is never built from older state
+
+        """
+        lock = self.__dict__.setdefault('_publish_lock', threading.Lock())
+        with lock:
+            moisture, saturation, active, reading, history = fields()
+            snapshot = Snapshot(self._snapshot.sequence + 1, time.time(), moisture, saturation, active,
+                                reading, tuple(history))
+            self._snapshot = snapshot
+        return snapshot
+
+    def snapshot(self):
+        """Return the latest Snapshot of the sensor's state."""
+        return self._snapshot
+
+    @property
+    def sequence(self):
+        """Return the sequence number of the latest snapshot."""
+        return self.snapshot().sequence
+
+    def changed_since(self, sequence):
+        """Check whether the sensor's state has changed since a snapshot's sequence number."""
+        return self.snapshot().sequence != sequence
@@ -0,0 +1,211 @@
+"""Background storage writer.
+
+Readings are handed to a bounded queue and written out by a dedicated thread
+in batches, so the code producing them never waits on the disk. A batch is
+flushed once enough readings are queued or the oldest has waited long
+enough, whichever comes first. A batch the sink fails to write is retried
+a few times before it is given up on, and the time range it covered is
+logged so the gap can be found later.
+
+"""
+import collections
+import logging
+import threading
+import time
+
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_AGGREGATE = 'aggregate'
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_DELAY = 0.5
+
+
+def mean_record(older, newer):
+    """Combine two records by averaging them field by field."""
+    return [(a + b) / 2.0 for a, b in zip(older, newer)]
+
+
+def _span(batch):
+    """Describe the timestamps a batch of records covers, if their first field is one."""
+    try:
+        return " from {} to {}".format(batch[0][0], batch[-1][0])
+    except (IndexError, KeyError, TypeError):
+        return ""
+
+
+class StorageWriter(object):
+    """Batch records from a bounded queue into a sink on a background thread."""
+
+    def __init__(self, sink, batch_size=100, flush_interval=5.0, max_queue=1000,
+                 overflow=OVERFLOW_DROP_OLDEST, aggregate=mean_record, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY):
+        """Start a storage writer.
+
+        :param sink: Callable taking a list of records, called from the writer thread
+        :param batch_size: Number of queued records that triggers a flush
+        :param flush_interval: Maximum time, in seconds, a record waits before being flushed
+        :param max_queue: Number of records queued before the overflow policy applies
+        :param overflow: "drop-oldest" to discard the oldest queued record when full,
+            or "aggregate" to merge new records into the newest queued record
+        :param aggregate: Callable merging two records, used by the "aggregate" policy
+        :param retries: Number of times a batch the sink fails to write is retried
+        :param retry_delay: Time, in seconds, to wait before each retry
+
+        """
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_AGGREGATE):
+            raise ValueError("overflow must be one of {}, {}".format(OVERFLOW_DROP_OLDEST, OVERFLOW_AGGREGATE))
+
+        self._sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self._aggregate = aggregate
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._oldest = None
+        self._running = True
+        self._flush_requested = False
+
+        self.written = 0
+        self.dropped = 0
+        self.aggregated = 0
+        self.batches = 0
+        self.errors = 0
+        self.retried = 0
+        self.lost = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+        self._thread = threading.Thread(target=self._run, name='StorageWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, record):
+        """Queue a record for writing. Never blocks on the sink.
+
+        Returns False if the queue was full and the overflow policy was applied, or if
+        the writer has been closed, in which case the record is dropped and counted.
+
+        """
+        with self._condition:
+            if not self._running:
+                self.rejected += 1
+                return False
+            accepted = True
+            if len(self._queue) >= self.max_queue:
+                accepted = False
+                if self.overflow == OVERFLOW_AGGREGATE:
+                    self._queue[-1] = self._aggregate(self._queue[-1], record)
+                    self.aggregated += 1
+                    return accepted
+                self._queue.popleft()
+                self.dropped += 1
+
+            if not self._queue:
+                self._oldest = time.time()
+                self._condition.notify()  # Start the flush interval timer
+            self._queue.append(record)
+            self.max_depth = max(self.max_depth, len(self._queue))
+
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+            return accepted
+
+    @property
+    def depth(self):
+        """Return the number of records waiting to be written."""
+        return len(self._queue)
+
+    def stats(self):
+        """Return a dictionary of queue and flush counters."""
+        with self._condition:
+            return {
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'written': self.written,
+                'dropped': self.dropped,
+                'aggregated': self.aggregated,
+                'batches': self.batches,
+                'errors': self.errors,
+                'retried': self.retried,
+                'lost': self.lost,
+                'rejected': self.rejected,
+                'last_flush_latency': self.last_flush_latency,
+                'max_flush_latency': self.max_flush_latency,
+                'mean_flush_latency': self._total_flush_latency / self.batches if self.batches else 0.0,
+            }
+
+    def flush(self):
+        """Ask the writer thread to flush whatever is queued without waiting for a threshold."""
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify()
+
+    def _ready(self):
+        if self._flush_requested or not self._running:
+            return True
+        if len(self._queue) >= self.batch_size:
+            return True
+        return bool(self._queue) and time.time() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready():
+                    timeout = None
+                    if self._queue:
+                        timeout = max(0.0, self.flush_interval - (time.time() - self._oldest))
+                    self._condition.wait(timeout)
+
+                batch = list(self._queue)
+                self._queue.clear()
+                self._flush_requested = False
+                running = self._running
+
+            if batch:
+                self._write(batch)
+            if not running:
+                return
+
+    def _write(self, batch):
+        t_start = time.time()
+        attempt = 0
+        while True:
+            try:
+                self._sink(batch)
+                break
+            except Exception as e:
+                if attempt < self.retries:
+                    attempt += 1
+                    logging.error("Storage writer failed to write {} records, retry {} of {}: {}".format(
+                        len(batch), attempt, self.retries, e))
+                    with self._condition:
+                        self.retried += 1
+                    time.sleep(self.retry_delay)
+                    continue
+                logging.error("Storage writer lost {} records{}: {}".format(len(batch), _span(batch), e))
+                with self._condition:
+                    self.errors += 1
+                    self.lost += len(batch)
+                return
+
+        latency = time.time() - t_start
+        with self._condition:
+            self.written += len(batch)
+            self.batches += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self._total_flush_latency += latency
+
+    def close(self, timeout=5.0):
+        """Flush anything still queued and stop the writer thread."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(timeout)
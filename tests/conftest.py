@@ -2,6 +2,7 @@
 These allow the mocking of various Python modules
 that might otherwise have runtime side-effects.
 """
+import os
 import sys
 
 import mock
@@ -30,17 +31,27 @@ def cleanup():
         del sys.modules['grow.pump']
     except KeyError:
         pass
+    try:
+        del sys.modules['grow.gpio']
+    except KeyError:
+        pass
+    try:
+        del sys.modules['grow.dosing']
+    except KeyError:
+        pass
 
 
 @pytest.fixture(scope='function', autouse=False)
 def GPIO():
-    """Mock RPi.GPIO module."""
+    """Mock RPi.GPIO module, and select the RPi.GPIO backend."""
     GPIO = mock.MagicMock()
     # Fudge for Python < 37 (possibly earlier)
     sys.modules['RPi'] = mock.Mock()
     sys.modules['RPi'].GPIO = GPIO
     sys.modules['RPi.GPIO'] = GPIO
+    os.environ['GROW_GPIO_BACKEND'] = 'rpi'
     yield GPIO
+    del os.environ['GROW_GPIO_BACKEND']
     del sys.modules['RPi']
     del sys.modules['RPi.GPIO']
 
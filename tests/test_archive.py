@@ -0,0 +1,86 @@
+import datetime
+import os
+
+import pytest
+
+
+def test_archive_append_and_read(GPIO, tmp_path):
+    from grow.archive import Archive, ArchiveWriter
+
+    path = tmp_path / 'day.col'
+    with ArchiveWriter(path, ['timestamp', 'a', 'b']) as writer:
+        writer.append([(1714560000.1, 1.5, 2.0), (1714560001.1, 1.25, 2.0)])
+
+    with ArchiveWriter(path, ['timestamp', 'a', 'b'], compression='lzma') as writer:
+        writer.append([(1714560002.1, 1.0, 3.0)])
+
+    with Archive(path) as archive:
+        assert len(archive) == 3
+        assert archive.chunks == [2, 1]
+        assert archive.column('timestamp') == [1714560000.1, 1714560001.1, 1714560002.1]
+        assert archive.column('a') == [1.5, 1.25, 1.0]
+        assert list(archive.records())[2] == (1714560002.1, 1.0, 3.0)
+
+    with pytest.raises(ValueError):
+        ArchiveWriter(path, ['timestamp', 'c'])
+
+
+def test_archive_discards_partial_chunk(GPIO, tmp_path):
+    from grow.archive import Archive, ArchiveWriter
+
+    path = tmp_path / 'day.col'
+    with ArchiveWriter(path, ['timestamp', 'a']) as writer:
+        writer.append([(1.0, 1.0)])
+        writer.append([(2.0, 2.0)])
+
+    # Simulate power being lost part way through the second chunk
+    os.truncate(path, os.path.getsize(path) - 3)
+    assert len(Archive(path)) == 1
+
+    with ArchiveWriter(path, ['timestamp', 'a']) as writer:
+        writer.append([(3.0, 3.0)])
+
+    assert Archive(path).column('a') == [1.0, 3.0]
+
+
+def test_archive_path(GPIO):
+    from grow.archive import archive_path
+
+    path = archive_path('sensor_history', datetime.date(2024, 5, 1))
+    assert path == os.path.join('sensor_history', '2024', '05', 'sensor_data_2024-05-01.col')
+
+
+def test_archive_index(GPIO, tmp_path):
+    import math
+
+    from grow.archive import Archive, ArchiveIndex, ArchiveWriter, archive_path
+
+    fields = ['timestamp', 'a']
+    day1 = datetime.date(2024, 5, 1)
+    day2 = datetime.date(2024, 5, 2)
+    index = ArchiveIndex(tmp_path)
+
+    for day, records in ((day1, [(100.0, 1.0), (200.0, math.nan)]), (day2, [(300.0, 5.0), (400.0, 3.0)])):
+        path = archive_path(tmp_path, day)
+        with ArchiveWriter(path, fields) as writer:
+            writer.append(records)
+        index.add(day, path, fields, records)
+
+    assert index.files(250.0, 350.0) == [archive_path(tmp_path, day2)]
+    assert index.files(None, 150.0) == [archive_path(tmp_path, day1)]
+
+    summary = ArchiveIndex(tmp_path).summary()
+    assert summary['days'] == 2
+    assert summary['records'] == 4
+    assert (summary['first'], summary['last']) == (100.0, 400.0)
+    assert (summary['min']['a'], summary['max']['a']) == (1.0, 5.0)
+
+    columns = index.columns(150.0, 350.0, ['a'])
+    assert math.isnan(columns['a'][0])
+    assert columns['a'][1:] == [5.0]
+
+    saved = dict(index.days)
+    ArchiveIndex(tmp_path).rebuild()
+    index.refresh()
+    assert index.days == saved
+    assert len(Archive(index.files()[0])) == 2
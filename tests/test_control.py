@@ -0,0 +1,113 @@
+import math
+
+import pytest
+
+
+def test_hysteresis():
+    from grow.control import WateringController, IDLE, WATERING
+
+    controller = WateringController(0.4, hysteresis=0.1, ki=0)
+    assert controller.update(0.45, now=0) == 0.0
+    assert controller.state == IDLE
+
+    # Below level, the dose is sized from the error to the target
+    assert controller.update(0.38, now=1) == pytest.approx(10.0 * 0.12)
+    assert controller.state == WATERING
+
+    # Still watering above level, until the target is reached
+    assert controller.update(0.45, now=2) == pytest.approx(10.0 * 0.05)
+    assert controller.update(0.5, now=3) == 0.0
+    assert controller.state == IDLE
+
+
+def test_soak_time():
+    from grow.control import WateringController
+
+    controller = WateringController(0.4, hysteresis=0.1, soak_time=100, ki=0)
+    dose = controller.update(0.3, now=0)
+    assert dose == pytest.approx(2.0)
+    controller.dosed(dose, now=0)
+
+    # The dose is expected to bring saturation to the target, so no more water while it soaks in
+    assert controller.pending(now=0) == pytest.approx(0.2)
+    assert controller.update(0.3, now=1) == 0.0
+    assert controller.update(0.3 + 0.2 * (1 - math.exp(-1)), now=100) == 0.0
+
+    # It soaked in, but less than expected, and is forgotten once it has
+    assert controller.pending(now=1000) == 0.0
+    assert controller.update(0.4, now=1000) == pytest.approx(1.0, abs=0.01)
+
+
+def test_integral_limit():
+    from grow.control import WateringController
+
+    controller = WateringController(0.4, kp=0, ki=2.0, integral_limit=0.5, min_dose=0)
+    for hour in range(10):
+        dose = controller.update(0.2, now=hour * 3600)
+        for second in range(0, 3600, 60):
+            dose = controller.update(0.2, now=hour * 3600 + second)
+    assert dose == pytest.approx(0.5)
+    assert controller.integral == pytest.approx(0.25)
+
+    # Not integrated while a dose is soaking in
+    controller = WateringController(0.4, kp=0, ki=2.0, min_dose=0)
+    controller.update(0.2, now=0)
+    controller.dosed(1.0, now=0)
+    controller.update(0.2, now=60)
+    assert controller.integral == 0.0
+
+    # Cleared once the target is reached
+    controller.update(0.2, now=60000)
+    assert controller.integral > 0
+    controller.update(0.5, now=60060)
+    assert controller.integral == 0.0
+
+
+def test_limits():
+    from grow.control import WateringController
+
+    controller = WateringController(0.5, min_dose=0.5, max_dose=2.0)
+    assert controller.update(0.0, now=0) == 2.0
+
+    controller = WateringController(0.5, hysteresis=0.0, min_dose=0.5)
+    assert controller.update(0.48, now=0) == 0.0
+
+    controller = WateringController.from_config(0.5, {'kp': 5.0, 'soak_time': 60})
+    assert controller.kp == 5.0
+    assert controller.soak_time == 60
+    assert WateringController.from_config(0.5, None).kp == 10.0
+
+    with pytest.raises(ValueError):
+        WateringController(0.5, soak_time=0)
+
+
+def test_slope_independent_of_poll_rate():
+    from grow.control import WateringController
+
+    # Drying at 0.036 an hour, a new reading every second
+    def reading(now):
+        return 0.8 - 0.036 * int(now) / 3600.0
+
+    slopes = []
+    for interval in (1.0, 0.1):
+        controller = WateringController(0.4)
+        for i in range(int(3600 / interval)):
+            controller.update(reading(i * interval), now=i * interval)
+        slopes.append(controller.slope)
+    assert slopes[0] == pytest.approx(0.036, rel=0.05)
+    assert slopes[1] == pytest.approx(0.036, rel=0.05)
+
+
+def test_retune_keeps_state():
+    from grow.control import WateringController
+
+    controller = WateringController(0.4, hysteresis=0.1)
+    dose = controller.update(0.3, now=0)
+    controller.dosed(dose, now=0)
+    assert controller.update(0.3, now=10) == 0.0
+
+    retuned = WateringController.from_config(0.4, {'kp': 8.0, 'hysteresis': 0.1}, controller)
+    assert retuned.kp == 8.0
+    assert retuned.pending(now=10) == pytest.approx(controller.pending(now=10))
+    assert retuned.update(0.3, now=11) == 0.0
+    assert retuned.doses == 1
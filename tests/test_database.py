@@ -0,0 +1,92 @@
+import math
+import threading
+
+
+def make_record(store, timestamp, moisture):
+    return store.encode({
+        'timestamp': timestamp,
+        'sensors': {'channel1': {'moisture': moisture, 'alarm': moisture > 10, 'enabled': True}},
+        'light': {'lux': 1.0, 'proximity': 2.0}
+    })
+
+
+def test_sqlite_store_roundtrip(GPIO, tmp_path):
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db')
+    assert store.latest() is None
+
+    store.write([make_record(store, 1000.0 + i, 5.0 + i * 3) for i in range(3)])
+
+    assert store.channel_range(1, 1001.0, 1002.5) == [(1001.0, 8.0, 0, 1), (1002.0, 11.0, 1, 1)]
+    assert store.channel_range(2) == []
+
+    latest = store.latest()
+    assert latest[:4] == (1002.0, 1.0, 2.0, 11.0)
+    assert math.isnan(latest[6])
+    assert store.latest_reading()['sensors']['channel1'] == {'moisture': 11.0, 'alarm': True, 'enabled': True}
+    assert len(store.records(1000.5)) == 2
+
+
+def test_sqlite_store_uses_wal_and_index(GPIO, tmp_path):
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db')
+    connection = store._connection()
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    plan = connection.execute(
+        'EXPLAIN QUERY PLAN SELECT ts FROM readings WHERE channel = 1 AND ts >= 0 AND ts < 1').fetchall()
+    assert 'readings_channel_ts' in ' '.join(str(row) for row in plan)
+
+    plan = connection.execute('EXPLAIN QUERY PLAN DELETE FROM readings WHERE ts < 1').fetchall()
+    assert 'readings_ts' in ' '.join(str(row) for row in plan)
+
+
+def test_sqlite_store_incremental_vacuum(GPIO, tmp_path):
+    import sqlite3
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db')
+    assert store._connection().execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+    # A database created before incremental vacuum was enabled is rebuilt with it
+    connection = sqlite3.connect(str(tmp_path / 'old.db'))
+    connection.execute('CREATE TABLE light (ts REAL PRIMARY KEY, lux REAL, proximity REAL)')
+    connection.commit()
+    connection.close()
+    store = SQLiteStore(tmp_path / 'old.db')
+    assert store._connection().execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def test_sqlite_store_expires(GPIO, tmp_path):
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db', retention=10)
+    store.write([make_record(store, 1000.0, 5.0), make_record(store, 1020.0, 6.0)])
+
+    assert store.expire(now=1025.0) == 2
+    assert [record[0] for record in store.records()] == [1020.0]
+
+
+def test_sqlite_store_expire_shrinks(GPIO, tmp_path):
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db', retention=10000)
+    store.write([make_record(store, 1000.0 + i, 5.0) for i in range(5000)])
+    connection = store._connection()
+    pages = connection.execute('PRAGMA page_count').fetchone()[0]
+
+    assert store.expire(now=100000.0) == 10000
+    assert connection.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    assert connection.execute('PRAGMA page_count').fetchone()[0] < pages / 2
+
+
+def test_sqlite_store_threads(GPIO, tmp_path):
+    from grow.database import SQLiteStore
+
+    store = SQLiteStore(tmp_path / 'sensors.db')
+    writer = threading.Thread(target=store.write, args=([make_record(store, 1000.0, 5.0)],))
+    writer.start()
+    writer.join()
+    assert store.latest()[0] == 1000.0
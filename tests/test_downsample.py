@@ -0,0 +1,38 @@
+import math
+
+
+def test_lttb_keeps_ends_and_peaks(GPIO):
+    from grow.downsample import lttb
+
+    xs = [float(x) for x in range(1000)]
+    ys = [0.0] * 1000
+    ys[500] = 100.0
+    ys[750] = -50.0
+
+    indices = lttb(xs, ys, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert indices == sorted(indices)
+    assert 500 in indices and 750 in indices
+
+    assert lttb(xs[:10], ys[:10], 50) == list(range(10))
+    assert lttb(xs, ys, 2) == [0, 999]
+
+
+def test_minmax_keeps_extremes(GPIO):
+    from grow.downsample import minmax
+
+    xs = list(range(100))
+    ys = [math.sin(x / 5.0) for x in xs]
+
+    indices = minmax(xs, ys, 20)
+    assert len(indices) <= 20
+    assert indices == sorted(indices)
+    assert ys.index(max(ys)) in indices
+    assert ys.index(min(ys)) in indices
+
+
+def test_finite_drops_missing(GPIO):
+    from grow.downsample import finite
+
+    assert finite([1, 2, 3], [1.0, math.nan, 3.0]) == ([1, 3], [1.0, 3.0])
@@ -0,0 +1,80 @@
+import math
+
+import pytest
+
+
+def test_median_and_ema(GPIO):
+    from grow.filters import EMA, Median
+
+    median = Median(window=3)
+    assert [median.update(value) for value in [1.0, 9.0, 2.0, 3.0, 50.0, 4.0]] == [1.0, 5.0, 2.0, 3.0, 3.0, 4.0]
+
+    ema = EMA(alpha=0.5)
+    assert [ema.update(value) for value in [2.0, 4.0, 4.0]] == [2.0, 3.0, 3.5]
+    ema.reset()
+    assert ema.update(10.0) == 10.0
+
+    with pytest.raises(ValueError):
+        EMA(alpha=0.0)
+
+
+def test_hampel_rejects_outliers(GPIO):
+    from grow.filters import Hampel
+
+    hampel = Hampel(window=5, threshold=3.0)
+    readings = [10.0, 10.2, 9.9, 10.1, 30.0, 10.0, 9.8]
+    filtered = [hampel.update(value) for value in readings]
+    assert filtered[:4] == readings[:4]
+    assert filtered[4] == pytest.approx(10.1)
+    assert filtered[5:] == readings[5:]
+
+
+def test_rate_limit(GPIO):
+    from grow.filters import RateLimit
+
+    limit = RateLimit(max_rate=2.0)
+    assert limit.update(0.0, timestamp=0.0) == 0.0
+    assert limit.update(10.0, timestamp=1.0) == 2.0
+    assert limit.update(-10.0, timestamp=1.5) == 1.0
+
+
+def test_pipeline_from_config(GPIO):
+    from grow.filters import EMA, Hampel, Pipeline
+
+    pipeline = Pipeline.from_config([{'type': 'hampel', 'window': 5}, {'type': 'ema', 'alpha': 1.0}])
+    assert [type(stage) for stage in pipeline.filters] == [Hampel, EMA]
+    assert pipeline.update(1.0) == 1.0
+    assert pipeline.update(math.nan) == 1.0
+    assert Pipeline().update(3.0) == 3.0
+
+    with pytest.raises(ValueError):
+        Pipeline.from_config([{'type': 'kalman'}])
+
+
+def test_pipeline_repeated_polls(GPIO):
+    from grow.filters import Pipeline
+    from grow.frequency import NO_READING
+    from grow.snapshot import Snapshot
+
+    config = [{'type': 'hampel', 'window': 7, 'threshold': 3.0}, {'type': 'median', 'window': 5}]
+    readings = [10.0, 10.1, 9.9, 10.0, 10.2, 9.8, 10.1, 30.0, 10.0, 9.9, 10.1, 10.0]
+
+    # Polled about ten times per reading, each reading is only filtered once
+    pipeline = Pipeline.from_config(config)
+    polled = []
+    for sequence, moisture in enumerate(readings, 1):
+        snapshot = Snapshot(sequence, float(sequence), moisture, 0.0, True, NO_READING, ())
+        for _ in range(10):
+            value = pipeline.update_snapshot(snapshot)
+            if value is not None:
+                polled.append(value)
+    assert len(polled) == len(readings)
+    assert max(polled) < 10.5
+
+    # The same as filtering each reading once
+    once = Pipeline.from_config(config)
+    assert polled == [once.update(moisture, float(sequence)) for sequence, moisture in enumerate(readings, 1)]
+
+    # No reading, eg: the sensor is unplugged, is kept out of the filters
+    assert pipeline.update_snapshot(Snapshot(len(readings) + 1, 0.0, 0.0, 0.0, False, NO_READING, ())) == 0.0
+    assert pipeline.value == polled[-1]
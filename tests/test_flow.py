@@ -0,0 +1,69 @@
+import pytest
+
+
+def true_volume(speed, seconds):
+    return (-2.0 + 15.0 * speed) * seconds - 0.8 + 0.4 * speed
+
+
+def test_fit():
+    from grow.flow import FlowModel
+
+    runs = [(speed, seconds, true_volume(speed, seconds)) for speed in (0.4, 0.6, 0.8) for seconds in (0.5, 1.0, 2.0)]
+    model = FlowModel.fit(runs)
+    assert model.rate == pytest.approx((-2.0, 15.0))
+    assert model.offset == pytest.approx((-0.8, 0.4))
+    assert model.speed == 0.6
+
+    seconds = model.seconds(5.0)
+    assert model.volume(0.6, seconds) == pytest.approx(5.0)
+    assert model.seconds(0) == 0.0
+
+
+def test_fit_one_speed():
+    from grow.flow import FlowModel
+
+    # All at one speed, so the effect of speed can't be fitted
+    model = FlowModel.fit([(0.5, 1.0, 5.5), (0.5, 2.0, 10.5)])
+    assert model.rate == pytest.approx((5.0, 0.0))
+    assert model.offset == pytest.approx((0.5, 0.0))
+
+    # A single run gives only a rate
+    model = FlowModel.fit([(0.5, 2.0, 10.0)], speed=0.7)
+    assert model.rate == pytest.approx((5.0, 0.0))
+    assert model.offset == (0.0, 0.0)
+    assert model.speed == 0.7
+
+    with pytest.raises(ValueError):
+        FlowModel.fit([])
+
+
+def test_config():
+    from grow.flow import FlowModel
+
+    model = FlowModel((1.5, 10.0), (-0.5, 0.0), 0.6)
+    copy = FlowModel.from_config(model.to_config())
+    assert copy.rate == model.rate
+    assert copy.offset == model.offset
+    assert copy.speed == model.speed
+    assert FlowModel.from_config(None) is None
+
+    with pytest.raises(ValueError):
+        FlowModel((1.0, -10.0)).seconds(5.0, speed=0.5)
+
+
+def test_dose_volume(monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.dosing import DoseQueue
+    from grow.flow import FlowModel
+    from grow.pump import Pump
+
+    pump = Pump(channel=1, queue=DoseQueue())
+    with pytest.raises(ValueError):
+        pump.dose_volume(1.0)
+
+    pump.flow_model = FlowModel((20.0, 0.0), (0.0, 0.0), 0.5)
+    dose = pump.dose_volume(1.0, blocking=True, source='test')
+    assert dose.duration == pytest.approx(0.05)
+    assert dose.speed == 0.5
+    assert dose.as_dict()['volume'] == 1.0
+    assert dose.delivered == pytest.approx(1.0, abs=0.2)
@@ -0,0 +1,21 @@
+import math
+
+import pytest
+
+
+def test_from_timestamps(GPIO):
+    from grow.frequency import from_timestamps, periods_needed
+
+    reading, cv = from_timestamps([0, 100, 200, 300, 400], scale=1e-3)
+    assert reading.frequency == pytest.approx(10.0)
+    assert reading.edges == 5
+    assert cv == 0.0
+    assert reading.low == reading.high == pytest.approx(10.0)
+
+    reading, cv = from_timestamps([0.0, 0.4, 1.0, 1.4, 2.0])
+    assert reading.frequency == pytest.approx(2.0)
+    assert reading.low < 2.0 < reading.high
+    assert periods_needed(cv, precision=0.02) > 4
+
+    reading, cv = from_timestamps([5.0])
+    assert reading.frequency == 0.0 and math.isinf(cv)
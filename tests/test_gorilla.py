@@ -0,0 +1,67 @@
+import math
+
+import pytest
+
+
+@pytest.fixture(params=['numpy', 'pure'])
+def gorilla(request, GPIO, monkeypatch):
+    from grow import gorilla
+    if request.param == 'pure':
+        monkeypatch.setattr(gorilla, 'numpy', None)
+    elif gorilla.numpy is None:
+        pytest.skip('NumPy not installed')
+    yield gorilla
+
+
+def test_timestamps_roundtrip(gorilla):
+    timestamps = [1714560000.0, 1714560001.0, 1714560002.0, 1714560002.5, 1714560100.123, 1000.0, 1000.001]
+    data = gorilla.encode_timestamps(timestamps)
+    assert gorilla.decode_timestamps(data) == timestamps
+
+    # A steady sample rate costs one bit per timestamp
+    steady = gorilla.encode_timestamps([1714560000.0 + i for i in range(1000)])
+    assert len(steady) < 4 + 8 + 2 + 1000 // 8 + 1
+
+
+def test_floats_roundtrip(gorilla):
+    values = [12.5, 12.5, 12.51, 12.49, 0.0, -3.75, math.inf, 1e-300, 12.5]
+    data = gorilla.encode_floats(values)
+    assert gorilla.decode_floats(data) == values
+    assert math.isnan(gorilla.decode_floats(gorilla.encode_floats([math.nan]))[0])
+
+
+def test_streaming_matches_bulk(gorilla):
+    values = [10.0 + (i // 7) * 0.01 for i in range(200)]
+    encoder = gorilla.FloatEncoder()
+    for value in values:
+        encoder.append(value)
+    assert encoder.getvalue() == gorilla.encode_floats(values)
+
+    encoder = gorilla.TimestampEncoder()
+    encoder.extend([1.0, 2.0])
+    encoder.extend([3.0, 4.5])
+    assert list(gorilla.iter_timestamps(encoder.getvalue())) == [1.0, 2.0, 3.0, 4.5]
+
+
+def test_compressed_series(gorilla):
+    series = gorilla.CompressedSeries()
+    for second in range(500):
+        series.append(1714560000.0 + second, 12.0 if second < 250 else 12.01)
+
+    assert len(series) == 500
+    assert series.nbytes < 500 * 16 // 10
+    assert list(series)[-1] == (1714560499.0, 12.01)
+
+
+def test_archive_gorilla_encoding(GPIO, tmp_path):
+    from grow.archive import Archive, ArchiveWriter
+
+    path = tmp_path / 'day.col'
+    with ArchiveWriter(path, ['timestamp', 'a'], compression='none', encoding='gorilla') as writer:
+        writer.append([(1000.0 + i, 5.0) for i in range(100)])
+    with ArchiveWriter(path, ['timestamp', 'a']) as writer:
+        writer.append([(1100.0, 6.0)])
+
+    archive = Archive(path)
+    assert archive.column('a') == [5.0] * 100 + [6.0]
+    assert archive.column('timestamp')[-2:] == [1099.0, 1100.0]
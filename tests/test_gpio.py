@@ -0,0 +1,157 @@
+import sys
+
+import mock
+import pytest
+
+
+@pytest.fixture(scope='function')
+def lgpio(monkeypatch):
+    """Mock lgpio module, and select the lgpio backend."""
+    lgpio = mock.MagicMock()
+    lgpio.error = type('error', (Exception,), {})
+    lgpio.gpiochip_open.return_value = 7
+    lgpio.tx_busy.return_value = 0
+    monkeypatch.setitem(sys.modules, 'lgpio', lgpio)
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'lgpio')
+    yield lgpio
+
+
+def test_lgpio_shares_chip_handle(lgpio):
+    from grow import Piezo
+    from grow.moisture import Moisture
+    from grow.pump import PUMP_MAX_DUTY, PUMP_PWM_FREQ, Pump
+
+    moisture = Moisture(channel=1)
+    pump = Pump(channel=2)
+    Piezo()
+
+    lgpio.gpiochip_open.assert_called_once_with(0)
+    lgpio.gpio_claim_input.assert_called_once_with(7, moisture._gpio_pin)
+    lgpio.gpio_claim_alert.assert_called_once_with(7, moisture._gpio_pin, lgpio.RISING_EDGE)
+    lgpio.gpio_claim_output.assert_has_calls([mock.call(7, pump._gpio_pin, 0), mock.call(7, 13, 0)])
+
+    pump.set_speed(0.5)
+    pump.set_speed(0)
+    lgpio.tx_pwm.assert_has_calls([
+        mock.call(7, pump._gpio_pin, PUMP_PWM_FREQ, int(PUMP_MAX_DUTY * 0.5)),
+        mock.call(7, pump._gpio_pin, PUMP_PWM_FREQ, 0)
+    ])
+
+
+def test_lgpio_errors(lgpio):
+    from grow.moisture import Moisture
+
+    lgpio.gpio_claim_input.side_effect = lgpio.error('GPIO busy')
+    with pytest.raises(RuntimeError, match='BCM8'):
+        Moisture(channel=2)
+
+
+def test_lgpio_existing_handle(lgpio):
+    from grow.gpio import LgpioBackend, get_backend, set_backend
+
+    set_backend(LgpioBackend(handle=3))
+    assert get_backend().handle == 3
+    get_backend().close()
+    lgpio.gpiochip_open.assert_not_called()
+    lgpio.gpiochip_close.assert_not_called()
+
+
+def test_backend_selection(monkeypatch):
+    from grow.gpio import MockBackend, get_backend
+
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    backend = get_backend()
+    assert isinstance(backend, MockBackend)
+    assert get_backend() is backend
+    assert get_backend('mock') is backend
+    with pytest.raises(RuntimeError):
+        get_backend('rpi')
+
+
+def test_unknown_backend(monkeypatch):
+    from grow.gpio import get_backend
+
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'serial')
+    with pytest.raises(ValueError):
+        get_backend()
+
+
+def test_mock_edges(monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.gpio import get_backend
+    from grow.moisture import Moisture
+
+    gpio = get_backend()
+    moisture = Moisture(channel=1, min_gate=10.0)
+    assert gpio.modes[moisture._gpio_pin] == 'in'
+
+    # Edge periods come from the backend's ticks, however quickly the edges are delivered
+    for edge in range(20):
+        gpio.edge(moisture._gpio_pin, tick=edge * 100000000)
+    assert moisture._periods.count == 19
+    assert moisture._periods.mean == pytest.approx(0.1)
+
+    moisture._callback.cancel()
+    sequence = moisture.sequence
+    gpio.edge(moisture._gpio_pin)
+    assert moisture.sequence == sequence
+
+
+def test_mock_pump(monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.gpio import get_backend
+    from grow.pump import PUMP_MAX_DUTY, Pump
+
+    gpio = get_backend()
+    pump = Pump(channel=1)
+    assert gpio.levels[pump._gpio_pin] == 0
+
+    assert pump.set_speed(1.0)
+    assert gpio.duty[pump._gpio_pin] == PUMP_MAX_DUTY
+    pump.stop()
+    assert gpio.duty[pump._gpio_pin] == 0
+
+    pump._stop()
+    assert pump._gpio_pin not in gpio.modes
+
+
+def test_lgpio_pulse(lgpio):
+    from grow.dosing import get_dose_queue
+    from grow.pump import Pump
+
+    lgpio.tx_busy.side_effect = [1, 0]
+    pump = Pump(channel=1)
+    done = []
+    future = pump.dose_pulse(0.5, timeout=0.02, callback=done.append)
+
+    # 200 cycles of the 100us PWM period, 45% on, timed by lgpio
+    lgpio.tx_pulse.assert_called_once_with(7, pump._gpio_pin, 45, 55, 0, 200)
+    assert get_dose_queue().running(pump)
+    assert future.result(timeout=1.0) == pytest.approx(0.02)
+    assert done == [future]
+    assert lgpio.tx_busy.call_count == 2
+    assert pump.get_speed() == 0
+    assert not get_dose_queue().running(pump)
+
+    lgpio.tx_busy.side_effect = None
+    assert pump.dose_pulse(1.0, timeout=1.0).done() is False
+    other = Pump(channel=2)
+    queued = other.dose_pulse(0.5, timeout=0.01)
+    assert not queued.running()
+    pump.stop()
+    assert lgpio.tx_pwm.call_args_list[-1] == mock.call(7, pump._gpio_pin, 10000, 0)
+    assert queued.result(timeout=1.0) == pytest.approx(0.01)
+
+
+def test_software_pulse(monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.gpio import get_backend
+    from grow.pump import Pump
+
+    gpio = get_backend()
+    pump = Pump(channel=1)
+    future = pump.dose_pulse(1.0, timeout=0.05)
+    assert gpio.duty[pump._gpio_pin] == 90
+    assert future.result(timeout=1.0) == pytest.approx(0.05, abs=0.03)
+    assert gpio.duty[pump._gpio_pin] == 0
+    assert pump.get_speed() == 0
@@ -0,0 +1,150 @@
+import math
+
+import pytest
+
+
+def test_ring_log_append_and_latest(GPIO, tmp_path):
+    from grow.history import RingLog
+
+    log = RingLog(tmp_path / 'log.bin', fields=['a', 'b'], capacity=4)
+    assert log.latest() is None
+
+    log.append((1.0, 2.0))
+    log.append((3.0, 4.0))
+
+    assert log.latest() == (3.0, 4.0)
+    assert len(log) == 2
+    assert list(log.records()) == [(1.0, 2.0), (3.0, 4.0)]
+
+
+def test_ring_log_wraps(GPIO, tmp_path):
+    from grow.history import RingLog
+
+    log = RingLog(tmp_path / 'log.bin', fields=['a'], capacity=3)
+    for value in range(5):
+        log.append((float(value),))
+
+    assert log.written == 5
+    assert len(log) == 3
+    assert list(log.records()) == [(2.0,), (3.0,), (4.0,)]
+    assert list(log.records(start=0, stop=4)) == [(2.0,), (3.0,)]
+
+
+def test_ring_log_reopen(GPIO, tmp_path):
+    from grow.history import RingLog
+
+    with RingLog(tmp_path / 'log.bin', fields=['a'], capacity=3) as log:
+        log.append((1.0,))
+        log.mark = 1
+
+    reader = RingLog(tmp_path / 'log.bin', readonly=True)
+    assert reader.fields == ['a']
+    assert reader.capacity == 3
+    assert reader.mark == 1
+    assert reader.latest() == (1.0,)
+
+    with pytest.raises(ValueError):
+        RingLog(tmp_path / 'log.bin', fields=['b'])
+
+
+def test_sensor_log_roundtrip(GPIO, tmp_path):
+    from grow.history import SensorLog
+
+    log = SensorLog(tmp_path / 'sensors.bin', capacity=10)
+    reader = SensorLog(tmp_path / 'sensors.bin', readonly=True)
+    assert reader.latest_reading() is None
+
+    reading = {
+        'timestamp': '2024-05-01T12:00:00',
+        'sensors': {'channel2': {'moisture': 12.5, 'alarm': True, 'enabled': True}},
+        'light': {'lux': 3.25, 'proximity': 1.0}
+    }
+    log.append_reading(reading)
+
+    assert math.isnan(log.latest()[3])
+    assert reader.latest_reading() == reading
+
+
+def test_ring_view_columns(GPIO, tmp_path):
+    from grow.history import RingLog, RingView
+
+    log = RingLog(tmp_path / 'log.bin', fields=['timestamp', 'value'], capacity=4)
+    view = RingView(tmp_path / 'log.bin')
+    assert view.latest() is None
+
+    for second in range(6):
+        log.append((float(second), second * 10.0))
+
+    assert view.written == 6
+    assert view.latest() == (5.0, 50.0)
+
+    segments = view.column('value')
+    assert len(segments) == 2
+    assert [value for segment in segments for value in segment.tolist()] == [20.0, 30.0, 40.0, 50.0]
+    assert view.rows(4, 6) == [[4.0, 40.0], [5.0, 50.0]]
+
+    assert view.between(3.0, 5.0) == (3, 5)
+    assert view.between(0.0, 1.0) == (2, 2)
+    assert view.search(10.0) == 6
+
+    del segments
+    view.close()
+
+
+def test_sensor_view_readings(GPIO, tmp_path):
+    from grow.history import SensorLog, SensorView
+
+    log = SensorLog(tmp_path / 'sensors.bin', capacity=10)
+    log.append_reading({
+        'timestamp': '2024-05-01T12:00:00',
+        'sensors': {'channel1': {'moisture': 3.5, 'alarm': False, 'enabled': True}},
+        'light': {'lux': 1.0, 'proximity': 0.0}
+    })
+
+    with SensorView(tmp_path / 'sensors.bin') as view:
+        assert view.channels == 3
+        assert list(view.readings()) == [log.latest_reading()]
+        assert view.latest_reading()['sensors']['channel1']['moisture'] == 3.5
+
+
+def test_ring_log_extend(GPIO, tmp_path):
+    from grow.history import RingLog
+
+    log = RingLog(tmp_path / 'log.bin', fields=['a'], capacity=4)
+    log.extend([(1.0,), (2.0,), (3.0,)])
+    log.extend([(4.0,), (5.0,)])
+    assert list(log.records()) == [(2.0,), (3.0,), (4.0,), (5.0,)]
+
+    log.extend([(float(value),) for value in range(6, 12)])
+    assert log.written == 11
+    assert list(log.records()) == [(8.0,), (9.0,), (10.0,), (11.0,)]
+
+
+def test_ring_view_stale(GPIO, tmp_path):
+    import os
+
+    from grow.history import RingLog, RingView
+
+    path = tmp_path / 'log.bin'
+    with RingLog(path, fields=['a'], capacity=4) as log:
+        log.append((1.0,))
+    view = RingView(path)
+    assert not view.stale()
+
+    # Appends don't make a view stale
+    with RingLog(path) as log:
+        log.append((2.0,))
+    assert not view.stale()
+
+    # Replaced, eg: by a migration with a different capacity
+    with RingLog(tmp_path / 'new.bin', fields=['a'], capacity=8) as log:
+        log.append((3.0,))
+    os.replace(tmp_path / 'new.bin', path)
+    assert view.stale()
+    view.close()
+
+    view = RingView(path)
+    assert not view.stale() and view.capacity == 8
+    os.remove(path)
+    assert view.stale()
+    view.close()
@@ -0,0 +1,139 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def finished_dose(pump, speed, duration, ran, finished, source='auto', volume=None):
+    from grow.dosing import Dose
+
+    dose = Dose(pump, speed, duration, source, volume)
+    dose.set_running_or_notify_cancel()
+    dose.finished = finished
+    dose.ran = ran
+    dose.set_result(ran)
+    return dose
+
+
+class FakePump(object):
+    def __init__(self, channel, flow_model=None):
+        self.channel = channel
+        self.flow_model = flow_model
+
+
+def test_journal(tmp_path):
+    from grow.flow import FlowModel
+    from grow.journal import DoseJournal, JournalView
+
+    monday = datetime(2024, 6, 3, 9).timestamp()
+    tuesday = datetime(2024, 6, 4, 9).timestamp()
+    pump1 = FakePump(1)
+    pump2 = FakePump(2, FlowModel((10.0, 0.0)))
+
+    journal = DoseJournal(tmp_path)
+    journal.record(finished_dose(pump2, 0.5, 1.0, 0.98, monday, volume=10.0))
+    journal.record(finished_dose(pump1, 0.7, 0.5, 0.5, monday + 60, source='web'))
+    journal.record(finished_dose(pump2, 0.5, 2.0, 2.0, monday + 120, source='somewhere'))
+    journal.record(finished_dose(pump2, 0.5, 0.5, 0.5, tuesday))
+    journal.close()
+
+    with JournalView(tmp_path) as view:
+        doses = view.doses()
+        assert len(doses) == 4
+        assert doses[0]['channel'] == 2
+        assert doses[0]['ran'] == pytest.approx(0.98)
+        assert doses[0]['volume'] == 10.0
+        assert doses[0]['delivered'] == pytest.approx(9.8)
+        assert doses[1]['source'] == 'web'
+        assert doses[1]['volume'] is None
+        assert doses[2]['source'] == 'other'
+        assert len(view.doses(channel=2)) == 3
+        assert len(view.doses(monday + 30, tuesday)) == 2
+
+        days = view.daily()
+        assert len(days) == 2
+        assert days[0]['channels'][1] == {'doses': 1, 'seconds': 0.5, 'volume': 0.0}
+        assert days[0]['channels'][2]['seconds'] == pytest.approx(2.98)
+        assert days[0]['channels'][2]['volume'] == pytest.approx(29.8)
+
+        # Rounded down to whole days
+        assert len(view.daily(tuesday)) == 1
+        summary = view.summary(monday + 3600, datetime(2024, 6, 5).timestamp())
+        assert summary[2]['doses'] == 3
+        assert summary[2]['volume'] == pytest.approx(34.8)
+        assert summary[3]['doses'] == 0
+        span = (datetime(2024, 6, 5) - datetime(2024, 6, 3)).total_seconds()
+        assert summary[2]['duty'] == pytest.approx(3.48 / span)
+
+        # Duty is over the whole range asked for, not just the days with doses
+        week = view.summary(tuesday, datetime(2024, 6, 11).timestamp())
+        assert week[2]['doses'] == 1
+        assert week[2]['duty'] == pytest.approx(0.5 / (7 * 24 * 60 * 60))
+
+
+def test_resume(tmp_path):
+    from grow.journal import DoseJournal, JournalView
+
+    monday = datetime(2024, 6, 3, 9).timestamp()
+    journal = DoseJournal(tmp_path)
+    journal.record(finished_dose(FakePump(1), 0.5, 1.0, 1.0, monday))
+    journal.close()
+
+    # Reopened on the same day, the day's totals carry on
+    journal = DoseJournal(tmp_path)
+    journal.record(finished_dose(FakePump(1), 0.5, 1.0, 1.0, monday + 60))
+
+    # Out of order finishes are kept in time order
+    journal.record(finished_dose(FakePump(1), 0.5, 1.0, 1.0, monday + 30))
+    journal.close()
+
+    with JournalView(tmp_path) as view:
+        assert [day['channels'][1]['doses'] for day in view.daily()] == [3]
+        timestamps = [dose['timestamp'] for dose in view.doses()]
+        assert timestamps == sorted(timestamps)
+
+
+def test_queue_listener(tmp_path, monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.dosing import DoseQueue
+    from grow.journal import DoseJournal, JournalView
+    from grow.pump import Pump
+
+    queue = DoseQueue()
+    journal = DoseJournal(tmp_path)
+    queue.add_listener(journal.record)
+    pump = Pump(channel=3, queue=queue)
+    pump.dose(0.5, timeout=0.02, source='manual')
+    journal.close()
+
+    with JournalView(tmp_path) as view:
+        dose, = view.doses()
+        assert dose['channel'] == 3
+        assert dose['source'] == 'manual'
+        assert dose['requested'] == 0.02
+        assert dose['ran'] >= 0.02
+        assert not math.isnan(dose['wait'])
+        today = view.summary((datetime.now() - timedelta(days=1)).timestamp())
+        assert today[3]['doses'] == 1
+
+
+def test_listeners_run_before_dose_resolves(monkeypatch):
+    import time
+
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow.dosing import DoseQueue
+    from grow.pump import Pump
+
+    recorded = []
+
+    def slow_listener(dose):
+        time.sleep(0.05)
+        recorded.append((dose.ran, dose.done()))
+
+    queue = DoseQueue()
+    queue.add_listener(slow_listener)
+    pump = Pump(channel=1, queue=queue)
+    dose = pump.dose(0.5, timeout=0.01)
+    # The blocking dose only returns once the listener has seen it finish
+    assert recorded == [(dose.result(), False)]
+    assert dose.ran >= 0.01
@@ -1,5 +1,7 @@
 import time
 
+import pytest
+
 
 def test_pumps_actually_stop(GPIO, smbus):
     from grow.pump import Pump
@@ -12,36 +14,77 @@ def test_pumps_actually_stop(GPIO, smbus):
 
 
 def test_pumps_are_mutually_exclusive(GPIO, smbus):
-    from grow.pump import Pump, global_lock
+    from grow.dosing import get_dose_queue
+    from grow.pump import Pump
 
+    queue = get_dose_queue()
     ch1 = Pump(channel=1)
     ch2 = Pump(channel=2)
     ch3 = Pump(channel=3)
 
-    ch1.dose(speed=0.5, timeout=1.0, blocking=False)
-
-    assert global_lock.locked() is True
+    first = ch1.dose(speed=0.5, timeout=1.0, blocking=False)
+    assert queue.running(ch1)
+    assert first.running()
 
-    assert ch2.dose(speed=0.5) is False
-    assert ch2.dose(speed=0.5, blocking=False) is False
+    # Other channels wait their turn rather than being dropped
+    second = ch2.dose(speed=0.5, blocking=False)
+    third = ch3.dose(speed=0.5, blocking=False, source='web')
+    assert queue.pending() == [second, third]
+    assert not queue.running(ch2)
+    assert ch2.set_speed(0.5) is False
+    assert third.wait > 0
 
-    assert ch3.dose(speed=0.5) is False
-    assert ch3.dose(speed=0.5, blocking=False) is False
+    ch1.stop()
+    assert first.done()
+    assert second.result(timeout=1.0) == pytest.approx(0.1, abs=0.05)
+    assert third.result(timeout=1.0) == pytest.approx(0.1, abs=0.05)
+    assert third.source == 'web'
+    assert queue.stats()['completed'] == 3
 
 
 def test_pumps_run_sequentially(GPIO, smbus):
-    from grow.pump import Pump, global_lock
+    from grow.dosing import get_dose_queue
+    from grow.pump import Pump
 
-    ch1 = Pump(channel=1)
-    ch2 = Pump(channel=2)
-    ch3 = Pump(channel=3)
+    queue = get_dose_queue()
+    doses = [Pump(channel=channel).dose(speed=0.5, timeout=0.05, blocking=False) for channel in (1, 2, 3)]
+    finished = []
+    queue.add_listener(finished.append)
+    assert doses[2].result(timeout=1.0) > 0
+
+    # Back to back, each starting once the one before had finished
+    assert finished == doses
+    for previous, dose in zip(doses, doses[1:]):
+        assert dose.started >= previous.finished
+    assert doses[2].wait >= 0.1
+    assert queue.stats()['max_wait'] == doses[2].wait
 
-    assert ch1.dose(speed=0.5, timeout=0.1, blocking=False) is True
-    assert global_lock.locked() is True
-    time.sleep(0.3)
-    assert ch2.dose(speed=0.5, timeout=0.1, blocking=False) is True
-    assert global_lock.locked() is True
-    time.sleep(0.3)
-    assert ch3.dose(speed=0.5, timeout=0.1, blocking=False) is True
-    assert global_lock.locked() is True
-    time.sleep(0.3)
+
+def test_max_active(GPIO, smbus):
+    from grow.dosing import DoseQueue
+    from grow.pump import Pump
+
+    queue = DoseQueue(max_active=2)
+    pumps = [Pump(channel=channel, queue=queue) for channel in (1, 2, 3)]
+    doses = [pump.dose(speed=0.5, timeout=0.2, blocking=False) for pump in pumps]
+    assert len(queue.active()) == 2
+    assert queue.pending() == [doses[2]]
+
+    # A second dose for a running pump waits for that pump, not just a free slot
+    again = pumps[0].dose(speed=0.5, timeout=0.05, blocking=False)
+    assert queue.pending() == [doses[2], again]
+    assert queue.cancel(pumps[0]) == 1
+    assert again.cancelled()
+
+    queue.set_max_active(3)
+    assert doses[2].running()
+
+
+def test_stop_without_dose(GPIO, smbus):
+    from grow.pump import Pump
+
+    ch1 = Pump(channel=1)
+    ch1.stop()
+    assert ch1.set_speed(1.0) is True
+    assert ch1.set_speed(0) is True
+    assert ch1.get_speed() == 0
@@ -0,0 +1,95 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+
+def _reading(when, moisture):
+    return {
+        'timestamp': when.isoformat(),
+        'sensors': {'channel1': {'moisture': moisture, 'alarm': False, 'enabled': True}},
+        'light': {'lux': 1.0, 'proximity': 2.0}
+    }
+
+
+def _history(start, count, offset=0):
+    return [_reading(start + timedelta(minutes=offset + i), float(offset + i)) for i in range(count)]
+
+
+def test_iter_array_streams(GPIO):
+    from grow.migrate import iter_array
+
+    text = json.dumps({'sensors': {'a': [1, 2]}, 'history': [{'n': i} for i in range(100)] + [12345], 'light': {}})
+    # A tiny read size splits values, including the trailing number, across reads
+    items = list(iter_array(io.StringIO(text), read_size=7))
+    assert items == [{'n': i} for i in range(100)] + [12345]
+
+    assert list(iter_array(io.StringIO('{"history": []}'))) == []
+    assert list(iter_array(io.StringIO('{"other": 1}'))) == []
+
+
+def test_migration_resumes_and_dedupes(GPIO, tmp_path):
+    from grow.archive import Archive, ArchiveIndex
+    from grow.history import SensorLog
+    from grow.migrate import Migration
+
+    start = datetime(2024, 5, 1, 12, 0)
+    history = tmp_path / 'sensor_history'
+    days = []
+    for n in range(3):
+        day = (start + timedelta(days=n)).date()
+        path = history / str(day.year) / '{:02d}'.format(day.month) / 'sensor_data_{}.json'.format(day.isoformat())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Each file repeats the last 10 readings of the one before
+        path.write_text(json.dumps({'history': _history(start, 30, offset=n * 20)}))
+        days.append(day)
+    sensor_json = tmp_path / 'sensor_data.json'
+    sensor_json.write_text(json.dumps({'history': _history(start, 30, offset=60), 'sensors': {}, 'light': {}}))
+
+    migration = Migration(history)
+    assert len(migration.pending()) == 3
+    # Pretend the first run stopped after the first day
+    migration.pending = lambda: Migration.pending(migration)[:1]
+    assert migration.run_days(workers=1) == 1
+
+    migration = Migration(history)
+    assert [day for day, _, _, _ in migration.pending()] == days[1:]
+    assert migration.run_days(workers=2) == 2
+    assert migration.pending() == []
+
+    index = ArchiveIndex(history)
+    assert [day for day, _ in index.entries()] == days
+    moisture = index.columns(fields=['channel1_moisture'])['channel1_moisture']
+    assert moisture == [float(i) for i in range(70)]
+    with Archive(index.files()[1]) as archive:
+        assert len(archive) == 20
+
+    assert migration.run_sensor_log(sensor_json, tmp_path / 'sensor_data.bin') == 20
+    assert migration.run_sensor_log(sensor_json, tmp_path / 'sensor_data.bin') is None
+    with SensorLog(tmp_path / 'sensor_data.bin') as log:
+        assert [record[3] for record in log.records()] == [float(i) for i in range(70, 90)]
+
+
+def test_migration_merges_existing_archive(GPIO, tmp_path):
+    from grow.archive import Archive, ArchiveWriter, archive_path
+    from grow.history import sensor_fields
+    from grow.migrate import Migration
+
+    start = datetime(2024, 5, 1, 12, 0)
+    history = tmp_path / 'sensor_history'
+    day = start.date()
+    path = history / '2024' / '05' / 'sensor_data_2024-05-01.json'
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps({'history': _history(start, 10)}))
+
+    # The upgraded monitor already archived readings from minute 8 onwards
+    fields = sensor_fields()
+    nan = float('nan')
+    with ArchiveWriter(archive_path(history, day), fields) as archive:
+        archive.append([[(start + timedelta(minutes=i)).timestamp(), 1.0, 2.0, 100.0 + i, 0.0, 1.0] + [nan, 0.0, 0.0] * 2
+                        for i in range(8, 12)])
+
+    assert Migration(history).run_days(workers=1) == 1
+    with Archive(archive_path(history, day)) as archive:
+        moisture = list(archive.column('channel1_moisture'))
+    # Converted readings up to minute 7, then the archive's own, which win where both have one
+    assert moisture == [float(i) for i in range(8)] + [100.0 + i for i in range(8, 12)]
@@ -0,0 +1,121 @@
+import pytest
+
+
+def _reading(moisture, pulses):
+    # Make the next pulse close a one second reading window
+    moisture._time_last_reading -= 1.0
+    moisture._count = pulses - 1
+    moisture._event_handler(moisture._gpio_pin)
+
+
+def test_history_ring(GPIO, monkeypatch):
+    import grow.moisture
+    from grow.moisture import Moisture
+
+    for numpy in (grow.moisture.numpy, None):
+        monkeypatch.setattr(grow.moisture, 'numpy', numpy)
+        moisture = Moisture(channel=1, wet_point=0, dry_point=20, max_gate=1.0)
+        assert len(moisture.history) == 0
+
+        for pulses in range(1, 251):
+            _reading(moisture, pulses % 30)
+
+        history = moisture.history
+        assert len(history) == 200
+        # Newest first: the last reading was 250 % 30 = 10 pulses/sec
+        assert history[0] == pytest.approx(0.5, abs=0.01)
+        assert history[1] == pytest.approx(0.55, abs=0.01)
+        assert moisture.history is history
+
+        moisture.set_wet_point(10)
+        assert moisture.history is not history
+        assert moisture.history[0] == pytest.approx(1.0, abs=0.01)
+
+        _reading(moisture, 20)
+        assert moisture.history[0] == pytest.approx(0.0, abs=0.01)
+        assert moisture.history[1] == pytest.approx(1.0, abs=0.01)
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_adaptive_gate(GPIO, monkeypatch):
+    import grow.moisture
+    from grow.moisture import Moisture
+
+    clock = FakeTime()
+    monkeypatch.setattr(grow.moisture, 'time', clock)
+
+    # Regular 20Hz pulses meet the precision as soon as the minimum gate has passed
+    moisture = Moisture(channel=1, precision=0.02, min_gate=1.0, max_gate=10.0)
+    for _ in range(21):
+        clock.now += 0.05
+        moisture._event_handler(moisture._gpio_pin)
+    reading = moisture.reading
+    assert reading.edges == 21
+    assert reading.frequency == pytest.approx(20.0)
+    assert reading.low == pytest.approx(20.0) and reading.high == pytest.approx(20.0)
+
+    # Jittery 2Hz pulses keep the gate open until the maximum
+    moisture = Moisture(channel=1, precision=0.02, min_gate=1.0, max_gate=10.0)
+    periods = [0.4, 0.6] * 20
+    for period in periods:
+        clock.now += period
+        moisture._event_handler(moisture._gpio_pin)
+        if moisture.reading.edges:
+            break
+    reading = moisture.reading
+    assert 10.0 <= reading.edges / reading.frequency < 10.6
+    assert reading.low < 2.0 < reading.high
+    assert (reading.high - reading.low) / reading.frequency > 0.04
+
+
+def test_snapshots(GPIO):
+    from grow.moisture import Moisture
+
+    moisture = Moisture(channel=1, wet_point=0, dry_point=20, max_gate=1.0)
+    empty = moisture.snapshot()
+    assert empty.sequence == 0 and not empty.active
+
+    _reading(moisture, 10)
+    first = moisture.snapshot()
+    assert moisture.changed_since(empty.sequence)
+    assert not moisture.changed_since(first.sequence)
+    assert first.moisture == pytest.approx(10.0, abs=0.1)
+    assert first.saturation == pytest.approx(0.5, abs=0.01)
+    assert first.active and first.history == (first.saturation,)
+    assert first.reading.edges == 10
+
+    moisture.set_dry_point(10)
+    second = moisture.snapshot()
+    assert second.sequence == first.sequence + 1
+    assert second.moisture == first.moisture
+    assert second.saturation == pytest.approx(0.0, abs=0.01)
+    # Snapshots already handed out never change
+    assert first.saturation == pytest.approx(0.5, abs=0.01)
+
+
+def test_snapshot_goes_inactive(GPIO, monkeypatch):
+    import grow.moisture
+    from grow.moisture import Moisture
+
+    clock = FakeTime()
+    monkeypatch.setattr(grow.moisture, 'time', clock)
+
+    moisture = Moisture(channel=1, wet_point=0, dry_point=20, max_gate=1.0)
+    _reading(moisture, 10)
+    active = moisture.snapshot()
+    assert active.active and moisture.active
+
+    # No pulses for over a second, the snapshot agrees with the sensor
+    clock.now += 1.5
+    assert not moisture.active
+    inactive = moisture.snapshot()
+    assert not inactive.active
+    assert inactive.sequence == active.sequence + 1
+    assert moisture.snapshot() is inactive
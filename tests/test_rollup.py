@@ -0,0 +1,75 @@
+import math
+
+
+def test_tier_buckets(GPIO, tmp_path):
+    from grow.rollup import Tier
+
+    tier = Tier(tmp_path / 'tier.bin', ['a', 'b'], resolution=60, capacity=10)
+    tier.add(0.0, {'a': 1.0, 'b': math.nan})
+    tier.add(30.0, {'a': 3.0})
+    tier.add(61.0, {'a': 5.0, 'b': 2.0})
+
+    records = list(tier.log.records())
+    assert len(records) == 2
+    assert records[0] == (0.0, 2, 1.0, 3.0, 2.0, 0, records[0][6], records[0][7], records[0][8])
+    assert math.isnan(records[0][8])
+    assert records[1] == (60.0, 1, 5.0, 5.0, 5.0, 1, 2.0, 2.0, 2.0)
+
+
+def test_tier_resumes_open_bucket(GPIO, tmp_path):
+    from grow.rollup import Tier
+
+    tier = Tier(tmp_path / 'tier.bin', ['a'], resolution=60, capacity=10)
+    tier.add(0.0, {'a': 1.0})
+    tier.close()
+
+    tier = Tier(tmp_path / 'tier.bin', ['a'], resolution=60, capacity=10)
+    tier.add(10.0, {'a': 3.0})
+    assert list(tier.log.records()) == [(0.0, 2, 1.0, 3.0, 2.0)]
+
+
+def test_tier_resumes_empty_series(GPIO, tmp_path):
+    from grow.rollup import Tier
+
+    tier = Tier(tmp_path / 'tier.bin', ['a', 'b'], resolution=60, capacity=10)
+    tier.add(0.0, {'a': 1.0})
+    tier.close()
+
+    # b had no samples in the open bucket, its stored mean is NaN
+    tier = Tier(tmp_path / 'tier.bin', ['a', 'b'], resolution=60, capacity=10)
+    tier.add(10.0, {'a': 3.0, 'b': 4.0})
+    assert list(tier.log.records()) == [(0.0, 2, 1.0, 3.0, 2.0, 1, 4.0, 4.0, 4.0)]
+
+
+def test_rollups_update_every_tier(GPIO, tmp_path):
+    from grow.rollup import Rollups, choose_tier
+
+    rollups = Rollups(tmp_path, series=['a'], tiers=((1, 100), (60, 10)))
+    for second in range(120):
+        rollups.add(float(second), {'a': float(second)})
+
+    assert [len(tier.log) for tier in rollups.tiers] == [100, 2]
+    assert rollups.tiers[1].log.latest() == (60.0, 60, 60.0, 119.0, 89.5)
+
+    assert choose_tier(rollups.resolutions, 0, 500, points=1000) == 1
+    assert choose_tier(rollups.resolutions, 0, 7 * 24 * 3600, points=1000) == 60
+
+
+def test_tier_converts_old_fields(GPIO, tmp_path):
+    from grow.history import RingLog
+    from grow.rollup import Tier, rollup_fields
+
+    # Laid out before alarm series were rolled up
+    with RingLog(tmp_path / 'tier.bin', rollup_fields(['a']), capacity=10) as log:
+        log.extend([(0.0, 2, 1.0, 3.0, 2.0), (60.0, 1, 5.0, 5.0, 5.0)])
+
+    tier = Tier(tmp_path / 'tier.bin', ['a', 'a_alarm'], resolution=60, capacity=10)
+    assert tier.log.fields == rollup_fields(['a', 'a_alarm'])
+    records = list(tier.log.records())
+    assert records[0][:6] == (0.0, 2, 1.0, 3.0, 2.0, 0)
+    assert all(math.isnan(value) for value in records[0][6:])
+
+    # The open bucket carries on with the new series
+    tier.add(70.0, {'a': 7.0, 'a_alarm': 1.0})
+    assert tier.log.latest() == (60.0, 2, 5.0, 7.0, 6.0, 1, 1.0, 1.0, 1.0)
+    assert not (tmp_path / 'tier.bin.tmp').exists()
@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+def test_events_run_in_order():
+    from grow.scheduler import Scheduler
+
+    scheduler = Scheduler()
+    ran = []
+    done = threading.Event()
+    scheduler.call_later(0.06, ran.append, 'c')
+    scheduler.call_later(0.06, done.set)
+    scheduler.call_later(0.02, ran.append, 'a')
+    # Scheduled after the others but due first, wakes the waiting thread
+    scheduler.call_later(0.0, ran.append, 'now')
+    scheduler.call_later(0.04, ran.append, 'b')
+
+    assert done.wait(1.0)
+    assert ran == ['now', 'a', 'b', 'c']
+    assert scheduler.runs == 5
+    assert scheduler.max_lateness < 0.05
+    scheduler.stop()
+
+
+def test_cancel_and_replace():
+    from grow.scheduler import Scheduler
+
+    scheduler = Scheduler()
+    ran = []
+    first = scheduler.call_later(0.02, ran.append, 1, key='pump')
+    second = scheduler.call_later(0.03, ran.append, 2, key='pump')
+    other = scheduler.call_later(0.03, ran.append, 'other', key='piezo')
+    assert scheduler.pending('pump') == [first, second]
+
+    assert first.cancel() is True
+    assert not first.pending
+
+    third = scheduler.call_later(0.04, ran.append, 3, key='pump', replace=True)
+    assert not second.pending
+    assert scheduler.pending('pump') == [third]
+    assert scheduler.pending() == [other, third]
+
+    time.sleep(0.1)
+    assert ran == ['other', 3]
+    assert third.done
+    assert third.cancel() is False
+    assert scheduler.pending() == []
+    assert scheduler.cancel_key('pump') == 0
+    scheduler.stop()
+
+
+def test_one_thread(GPIO, smbus):
+    from grow.pump import Pump
+    from grow.scheduler import get_scheduler
+
+    threads = threading.active_count()
+    pumps = [Pump(channel=channel) for channel in (1, 2, 3)]
+    for _ in range(10):
+        pumps[0].dose(speed=0.5, timeout=0.05, blocking=False)
+        pumps[0].stop()
+    assert threading.active_count() <= threads + 1
+    assert get_scheduler().pending(pumps[0]) == []
+
+
+def test_failing_event():
+    from grow.scheduler import Scheduler
+
+    scheduler = Scheduler()
+    done = threading.Event()
+    scheduler.call_later(0.0, lambda: 1 / 0)
+    scheduler.call_later(0.01, done.set)
+    assert done.wait(1.0)
+    assert scheduler.errors == 1
+    scheduler.stop()
+
+
+def test_piezo_beeps(monkeypatch):
+    monkeypatch.setenv('GROW_GPIO_BACKEND', 'mock')
+    from grow import Piezo
+    from grow.gpio import get_backend
+
+    gpio = get_backend()
+    piezo = Piezo()
+    piezo.beeps(880, timeout=0.04, count=3, interval=0.1)
+    assert gpio.duty[13] == 1
+    assert gpio.frequency[13] == 880
+    assert piezo.beep(440, blocking=False) is False
+
+    time.sleep(0.12)
+    assert gpio.duty[13] == 1
+    time.sleep(0.2)
+    assert gpio.duty[13] == 0
+    assert piezo.beep(440, timeout=0.02, blocking=False) is True
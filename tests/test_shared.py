@@ -0,0 +1,47 @@
+import uuid
+
+
+def test_shared_readings(GPIO):
+    from grow.shared import SharedReadings
+
+    name = 'grow_test_{}'.format(uuid.uuid4().hex[:8])
+    with SharedReadings(name, ['timestamp', 'value'], capacity=4) as writer:
+        reader = SharedReadings(name)
+        assert reader.fields == ['timestamp', 'value']
+        assert reader.latest() is None
+
+        for i in range(6):
+            writer.write([float(i), i * 10.0])
+
+        assert reader.written == 6
+        assert reader.latest() == (5.0, 50.0)
+        assert reader.history() == [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+        assert reader.history(2) == [(4.0, 40.0), (5.0, 50.0)]
+        reader.close()
+
+
+def test_shared_readings_consistent_across_processes(GPIO):
+    import multiprocessing
+    from grow.shared import SharedReadings
+
+    name = 'grow_test_{}'.format(uuid.uuid4().hex[:8])
+    with SharedReadings(name, ['a', 'b', 'c'], capacity=8) as writer:
+        reader_done = multiprocessing.Event()
+        process = multiprocessing.Process(target=_read_until_done, args=(name, reader_done))
+        process.start()
+        for i in range(20000):
+            writer.write([float(i)] * 3)
+        reader_done.set()
+        process.join(10)
+        assert process.exitcode == 0
+
+
+def _read_until_done(name, done):
+    from grow.shared import SharedReadings
+
+    reader = SharedReadings(name)
+    while not done.is_set():
+        for record in reader.history():
+            # Every field of a record is written together, a torn read would mix values
+            assert record[0] == record[1] == record[2]
+    reader.close()
@@ -0,0 +1,142 @@
+import threading
+import time
+
+
+def test_writer_batches_by_size(GPIO):
+    from grow.writer import StorageWriter
+
+    batches = []
+    writer = StorageWriter(batches.append, batch_size=3, flush_interval=10.0)
+    for i in range(6):
+        writer.put([float(i)])
+        if i == 2:
+            time.sleep(0.1)
+
+    time.sleep(0.1)
+    writer.close()
+    assert [len(batch) for batch in batches] == [3, 3]
+    assert writer.stats()['written'] == 6
+    assert writer.stats()['batches'] == 2
+
+
+def test_writer_flushes_on_interval(GPIO):
+    from grow.writer import StorageWriter
+
+    batches = []
+    writer = StorageWriter(batches.append, batch_size=100, flush_interval=0.05)
+    writer.put([1.0])
+    time.sleep(0.2)
+    assert batches == [[[1.0]]]
+    writer.close()
+
+
+def test_writer_overflow_policies(GPIO):
+    from grow.writer import StorageWriter
+
+    release = threading.Event()
+    batches = []
+
+    def slow_sink(batch):
+        release.wait()
+        batches.append(batch)
+
+    writer = StorageWriter(slow_sink, batch_size=1, max_queue=2)
+    writer.put([0.0])
+    time.sleep(0.05)  # First record is now stuck in the sink
+
+    assert writer.put([1.0]) is True
+    assert writer.put([2.0]) is True
+    assert writer.put([3.0]) is False
+    assert writer.stats()['dropped'] == 1
+    assert writer.depth == 2
+
+    release.set()
+    writer.close()
+    assert batches == [[[0.0]], [[2.0], [3.0]]]
+
+    release.clear()
+    batches[:] = []
+    writer = StorageWriter(slow_sink, batch_size=1, max_queue=1, overflow='aggregate')
+    writer.put([0.0])
+    time.sleep(0.05)
+    writer.put([2.0])
+    writer.put([4.0])
+    assert writer.stats()['aggregated'] == 1
+
+    release.set()
+    writer.close()
+    assert batches == [[[0.0]], [[3.0]]]
+
+
+def test_writer_counts_errors(GPIO):
+    from grow.writer import StorageWriter
+
+    def broken_sink(batch):
+        raise IOError("disk full")
+
+    writer = StorageWriter(broken_sink, batch_size=1, retry_delay=0)
+    writer.put([1.0])
+    writer.close()
+    assert writer.stats()['errors'] == 1
+    assert writer.stats()['written'] == 0
+    assert writer.stats()['retried'] == 2
+    assert writer.stats()['lost'] == 1
+
+
+def test_writer_retries(GPIO):
+    from grow.writer import StorageWriter
+
+    batches = []
+
+    def flaky_sink(batch):
+        if not batches:
+            batches.append(None)
+            raise IOError("busy")
+        batches.append(batch)
+
+    writer = StorageWriter(flaky_sink, batch_size=1, retry_delay=0)
+    writer.put([1.0])
+    writer.close()
+    assert batches == [None, [[1.0]]]
+    assert writer.stats()['errors'] == 0
+    assert writer.stats()['retried'] == 1
+
+
+def test_writer_rejects_after_close(GPIO):
+    from grow.writer import StorageWriter
+
+    writer = StorageWriter(lambda batch: None)
+    writer.close()
+    assert writer.put([1.0]) is False
+    assert writer.depth == 0
+    assert writer.stats()['rejected'] == 1
+
+
+def test_writer_retry_stores_once(GPIO, tmp_path):
+    from grow.history import SensorLog, sensor_fields
+    from grow.rollup import Rollups
+    from grow.writer import StorageWriter
+
+    log = SensorLog(tmp_path / 'sensor.bin', channels=1, capacity=100)
+    rollups = Rollups(tmp_path, series=['lux'], tiers=((1, 100), (60, 10)))
+    failures = []
+
+    def sink(batch):
+        # Stored like the monitor does, failing part way through the rollups the first time
+        log.extend(log.unstored(batch))
+        for record in batch:
+            rollups.tiers[0].add(record[0], dict(zip(log.fields, record)))
+            if not failures:
+                failures.append(record)
+                raise IOError("disk full")
+            rollups.tiers[1].add(record[0], dict(zip(log.fields, record)))
+
+    writer = StorageWriter(sink, batch_size=3, retry_delay=0)
+    for second in range(3):
+        writer.put([float(second), 1.0, 0.0] + [0.0] * (len(sensor_fields(1)) - 3))
+    writer.close()
+
+    assert writer.stats()['retried'] == 1
+    assert [record[0] for record in log.records()] == [0.0, 1.0, 2.0]
+    assert [record[1] for record in rollups.tiers[0].log.records()] == [1, 1, 1]
+    assert rollups.tiers[1].log.latest()[1] == 3